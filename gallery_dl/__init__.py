@@ -8,8 +8,10 @@
 
 import sys
 import json
+import zlib
 import logging
 from . import version, config, option, output, extractor, job, util, exception
+from . import metrics, profiler, events
 
 __author__ = "Mike Fährmann"
 __copyright__ = "Copyright 2014-2021 Mike Fährmann"
@@ -99,6 +101,44 @@ def parse_inputfile(file, log):
                 yield line
 
 
+def shard(urls, index, total, key="url"):
+    """Return the 'index'-th of 'total' deterministic partitions of 'urls'
+
+    Config options of input file URLs outside this partition, which are
+    meant to apply to all following URLs (-G), get transferred
+    to the next URL inside of it.
+    """
+    if key == "host":
+        import urllib.parse
+
+        def keyfunc(url):
+            return urllib.parse.urlsplit(url).hostname or url
+    elif key == "category":
+        def keyfunc(url):
+            cls = extractor.find_class(url)
+            return (cls.category or cls.basecategory) if cls else ""
+    else:
+        def keyfunc(url):
+            return url
+
+    result = []
+    gconf = []
+    for url in urls:
+        value = url.value if isinstance(url, util.ExtendedUrl) else url
+        if zlib.crc32(keyfunc(value).encode()) % total == index - 1:
+            if gconf:
+                if isinstance(url, util.ExtendedUrl):
+                    url = util.ExtendedUrl(
+                        value, gconf + url.gconfig, url.lconfig)
+                else:
+                    url = util.ExtendedUrl(value, gconf, [])
+                gconf = []
+            result.append(url)
+        elif isinstance(url, util.ExtendedUrl):
+            gconf.extend(url.gconfig)
+    return result
+
+
 def main():
     try:
         if sys.stdout and sys.stdout.encoding.lower() != "utf-8":
@@ -134,6 +174,7 @@ def main():
 
         # loglevels
         output.configure_logging(args.loglevel)
+        events.initialize()
         if args.loglevel >= logging.ERROR:
             config.set(("output",), "mode", "null")
         elif args.loglevel <= logging.DEBUG:
@@ -165,6 +206,9 @@ def main():
             except AttributeError:
                 pass
 
+        # let extractors skip metadata no download run uses
+        job.DownloadJob.prune_metadata = True
+
         if args.list_modules:
             for module_name in extractor.modules:
                 print(module_name)
@@ -192,8 +236,31 @@ def main():
                     "Deleted %d %s from '%s'",
                     cnt, "entry" if cnt == 1 else "entries", cache._path(),
                 )
+        elif args.serve:
+            if args.list_urls or not issubclass(
+                    args.jobtype or job.DownloadJob, job.DownloadJob):
+                parser.error("--serve only supports downloading files")
+            from . import server
+            metrics.initialize()
+            profiler.initialize()
+            try:
+                return server.serve(
+                    args.serve, args.jobtype or job.DownloadJob,
+                    args.serve_workers)
+            except (OSError, ValueError) as exc:
+                log.error("Unable to start server: %s", exc)
+                return 1
+        elif args.worker:
+            from . import coordinator
+            metrics.initialize()
+            profiler.initialize()
+            try:
+                return coordinator.work(args.worker, args.jobtype)
+            except (exception.CoordinatorError, ValueError) as exc:
+                log.error("Worker failed: %s", exc)
+                return 1
         else:
-            if not args.urls and not args.inputfiles:
+            if not args.urls and not args.inputfiles and not args.resume:
                 parser.error(
                     "The following arguments are required: URL\n"
                     "Use 'gallery-dl --help' to get a list of all options.")
@@ -202,8 +269,7 @@ def main():
                 jobtype = job.UrlJob
                 jobtype.maxdepth = args.list_urls
                 if config.get(("output",), "fallback", True):
-                    jobtype.handle_url = \
-                        staticmethod(jobtype.handle_url_fallback)
+                    jobtype.handle_url = jobtype.handle_url_fallback
             else:
                 jobtype = args.jobtype or job.DownloadJob
 
@@ -222,6 +288,17 @@ def main():
                     except OSError as exc:
                         log.warning("input file: %s", exc)
 
+            if args.shard:
+                index, _, total = args.shard.partition("/")
+                try:
+                    index, total = int(index), int(total)
+                    if not 0 < index <= total:
+                        raise ValueError()
+                except ValueError:
+                    parser.error("Invalid shard '{}'. Expected K/N with "
+                                 "1 <= K <= N".format(args.shard))
+                urls = shard(urls, index, total, args.shard_key)
+
             # unsupported file logging handler
             handler = output.setup_logging_handler(
                 "unsupportedfile", fmt="{message}")
@@ -231,6 +308,31 @@ def main():
                 ulog.propagate = False
                 job.Job.ulog = ulog
 
+            metrics.initialize()
+            profiler.initialize()
+
+            jpath = args.resume or args.journal
+            if args.coordinate:
+                if issubclass(jobtype, job.DownloadJob):
+                    from . import coordinator
+                    try:
+                        return coordinator.coordinate(
+                            args.coordinate, urls, jobtype,
+                            args.coordinate_workers, jpath,
+                            coordinator.worker_args(args))
+                    except (OSError, ValueError) as exc:
+                        log.error("Unable to start coordinator: %s", exc)
+                        return 1
+                log.warning("--coordinate is only supported "
+                            "when downloading files")
+
+            if jpath:
+                if issubclass(jobtype, job.DownloadJob):
+                    from . import journal
+                    return journal.run(jpath, urls, jobtype)
+                log.warning("--journal and --resume are only supported "
+                            "when downloading files")
+
             pformat = config.get(("output",), "progress", True)
             if pformat and len(urls) > 1 and args.loglevel < logging.ERROR:
                 urls = progress(urls, pformat)
@@ -251,6 +353,7 @@ def main():
                 except exception.NoExtractorError:
                     log.error("No suitable extractor found for '%s'", url)
                     retval |= 64
+                metrics.write()
             return retval
 
     except KeyboardInterrupt:
@@ -0,0 +1,451 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2021 Mike Fährmann
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+
+"""Distribute extractor URLs to worker processes over HTTP"""
+
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import threading
+import subprocess
+import requests
+from . import config, journal, server, util, exception
+
+log = logging.getLogger("coordinator")
+
+TOKEN_ENV = "GALLERYDL_COORDINATOR_TOKEN"
+
+# top-level config sections not sent to workers
+PRIVATE_SECTIONS = ("coordinator", "server")
+# config option names, or parts of them, holding credentials
+CREDENTIAL_KEYS = ("username", "password", "cookies")
+CREDENTIAL_PARTS = ("token", "secret", "api-key", "client-id", "password")
+
+
+class Coordinator():
+    """Hand out journal entries to workers and collect their results
+
+    Workers lease entries, report URLs of child extractors as new
+    entries, and check and update download archives through the
+    coordinator. Entries of crashed workers become available again
+    once their lease expires.
+
+    All requests require 'token', which gets generated when not given.
+    """
+
+    def __init__(self, journal, token=None, jobtype="DownloadJob"):
+        self.journal = journal
+        self.token = token or util.generate_token()
+        self.jobtype = jobtype
+        self.archives = {}
+        self.lock = threading.Lock()
+        self.retval = 0
+
+    def lease(self, owner):
+        entry = self.journal.lease(owner, raw=True)
+        if entry:
+            entry_id, url, data = entry
+            return {
+                "entry"     : entry_id,
+                "url"       : url,
+                "data"      : data,
+                "lease-time": self.journal.lease_time,
+            }
+        if self.journal.count(journal.ACTIVE):
+            self.journal.reclaim()
+            return {"wait": True}
+        return {"done": True}
+
+    def renew(self, entry, owner):
+        self.journal.renew(entry, owner)
+
+    def finish(self, entry, owner, status=0):
+        finished = self.journal.finish(entry, status, owner)
+        if finished:
+            with self.lock:
+                self.retval |= status
+        return {"finished": finished}
+
+    def release(self, entry, owner):
+        self.journal.release(entry, owner)
+
+    def add(self, url, data=None, parent=None):
+        if data is not None and not isinstance(data, (str, dict)):
+            raise TypeError("'data' must be a string or object")
+        return {"added": self.journal.add(url, data, parent)}
+
+    def archive(self, cfgpath, key, action="check"):
+        path = archive_path(cfgpath)
+        kwdict = {"_archive_key": key}
+        with self.lock:
+            archive = self.archives.get(path)
+            if archive is None:
+                archive = self.archives[path] = util.DownloadArchive(path)
+            if action == "add":
+                archive.add(kwdict)
+                return {"exists": True}
+            return {"exists": bool(archive.check(kwdict))}
+
+    def config(self):
+        """Return the configuration values workers use"""
+        conf = {
+            key: value
+            for key, value in config._config.items()
+            if key not in PRIVATE_SECTIONS
+        }
+        return {"config": public_config(conf), "jobtype": self.jobtype}
+
+    def status(self):
+        return {
+            "pending": self.journal.count(journal.PENDING),
+            "active" : self.journal.count(journal.ACTIVE),
+            "done"   : self.journal.count(journal.DONE),
+            "status" : self.retval,
+        }
+
+    def done(self):
+        """Return True if all entries have been processed"""
+        return not (self.journal.count(journal.PENDING) or
+                    self.journal.count(journal.ACTIVE))
+
+    def close(self):
+        for archive in self.archives.values():
+            archive.close()
+        self.journal.close()
+
+
+class RequestHandler(server.JSONRequestHandler):
+    """HTTP interface to a Coordinator instance
+
+    GET  /status     number of pending, active, and finished entries
+    GET  /config     configuration values for workers
+    POST /lease      {"owner": OWNER}
+    POST /renew      {"entry": ID, "owner": OWNER}
+    POST /finish     {"entry": ID, "owner": OWNER, "status": STATUS}
+    POST /release    {"entry": ID, "owner": OWNER}
+    POST /add        {"url": URL, "data": DATA, "parent": ID}
+    POST /archive    {"cfgpath": PATH, "key": KEY, "action": "check"|"add"}
+    """
+    endpoints = ("lease", "renew", "finish", "release", "add", "archive")
+
+    def do_GET(self):
+        if not self._check_access():
+            return
+        path = self.path.rstrip("/")
+        app = self.server.app
+
+        if path == "/status":
+            self._send(200, app.status())
+        elif path == "/config":
+            self._send(200, app.config())
+        else:
+            self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        if not self._check_access():
+            return
+        name = self.path.strip("/")
+        if name not in self.endpoints:
+            return self._send(404, {"error": "not found"})
+
+        data = self._read_json()
+        if data is None:
+            return
+
+        try:
+            result = getattr(self.server.app, name)(**data)
+        except (TypeError, ValueError) as exc:
+            return self._send(400, {"error": "invalid request: {}: {}".format(
+                exc.__class__.__name__, exc)})
+        self._send(200, result)
+
+
+class Client():
+    """Journal interface to a remote coordinator"""
+
+    def __init__(self, url, token=None):
+        if "://" not in url:
+            url = "http://" + url
+        self.root = url.rstrip("/")
+        self.session = requests.Session()
+        self.session.headers["Content-Type"] = "application/json"
+        if token:
+            self.session.headers["Authorization"] = "Bearer " + token
+        self.owner = "{}:{}".format(socket.gethostname(), os.getpid())
+        self.lease_time = 600.0
+        self._renewed = {}
+
+    def call(self, endpoint, data=None, retries=5):
+        """Send a request to 'endpoint' and return its JSON response
+
+        Raise CoordinatorError if that fails.
+        """
+        url = self.root + endpoint
+        tries = 0
+        while True:
+            try:
+                if data is None:
+                    response = self.session.get(url, timeout=60)
+                else:
+                    response = self.session.post(
+                        url, data=json.dumps(data, default=str), timeout=60)
+            except requests.exceptions.RequestException as exc:
+                tries += 1
+                if tries > retries:
+                    raise exception.CoordinatorError(exc)
+                log.warning("%s (%s/%s)", exc, tries, retries)
+                time.sleep(tries)
+                continue
+
+            if response.status_code >= 400:
+                raise exception.CoordinatorError("'{} {}' for '{}'".format(
+                    response.status_code, response.reason, url))
+            try:
+                return response.json()
+            except ValueError as exc:
+                raise exception.CoordinatorError(exc)
+
+    def lease(self):
+        """Claim the next available entry
+
+        Return an (id, url, data) tuple, None when all entries are done,
+        or False when entries are still being processed by other workers.
+        """
+        result = self.call("/lease", {"owner": self.owner})
+        if result.get("done"):
+            return None
+        if result.get("wait"):
+            return False
+
+        data = result["data"]
+        data = journal.loads(data) if isinstance(data, str) else {}
+        self.lease_time = result.get("lease-time") or self.lease_time
+        self._renewed[result["entry"]] = time.time()
+        return result["entry"], result["url"], data
+
+    def add(self, url, data=None, parent=None):
+        return self.call("/add", {
+            "url": url, "data": journal.dumps(data), "parent": parent,
+        })["added"]
+
+    def renew(self, entry_id):
+        now = time.time()
+        if now - self._renewed.get(entry_id, 0.0) < self.lease_time / 4:
+            return
+        self._renewed[entry_id] = now
+        self.call("/renew", {"entry": entry_id, "owner": self.owner})
+
+    def finish(self, entry_id, status=0):
+        self._renewed.pop(entry_id, None)
+        return self.call("/finish", {
+            "entry": entry_id, "owner": self.owner, "status": status,
+        })["finished"]
+
+    def release(self, entry_id):
+        self._renewed.pop(entry_id, None)
+        self.call("/release", {"entry": entry_id, "owner": self.owner})
+
+    def open_archive(self, path, extractor):
+        """Return the coordinator's download archive for 'extractor'
+
+        The coordinator determines its location from its own config.
+        """
+        if "{" in extractor.config("archive", ""):
+            raise ValueError("format strings in 'archive' are not "
+                             "supported with --coordinate")
+        return RemoteArchive(self, extractor)
+
+
+class RemoteArchive(util.DownloadArchive):
+    """Download archive stored by a coordinator"""
+
+    def __init__(self, client, extractor):
+        self.client = client
+        self.cfgpath = extractor._cfgpath
+        self.keygen = (
+            extractor.config("archive-prefix", extractor.category) +
+            extractor.config("archive-format", extractor.archive_fmt)
+        ).format_map
+
+    def check(self, kwdict):
+        key = kwdict["_archive_key"] = self.keygen(kwdict)
+        return self.client.call("/archive", {
+            "cfgpath": self.cfgpath, "key": key, "action": "check"})["exists"]
+
+    def check_batch(self, kwdicts):
+        """Check each item separately"""
+
+    def add(self, kwdict):
+        key = kwdict.get("_archive_key") or self.keygen(kwdict)
+        self.client.call("/archive", {
+            "cfgpath": self.cfgpath, "key": key, "action": "add"})
+
+    def close(self):
+        pass
+
+
+def coordinate(address, urls, jobtype, workers=4, path=None, args=()):
+    """Distribute 'urls' and all URLs they spawn to worker processes
+
+    Start 'workers' local worker processes. Additional workers can
+    connect to 'address' with '--worker'.
+    """
+    token = config.get(("coordinator",), "token")
+    jrnl = journal.Journal(
+        util.expand_path(path) if path else ":memory:",
+        config.get(("coordinator",), "lease-time", 600.0))
+    journal.add_urls(jrnl, urls)
+
+    app = Coordinator(jrnl, token, jobtype.__name__)
+    httpd = server.create_server(address, app, RequestHandler, bool(token))
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+
+    host, port = httpd.server_address[:2]
+    if host in ("0.0.0.0", "::"):
+        host = "127.0.0.1" if host == "0.0.0.0" else "::1"
+    if ":" in host:
+        host = "[" + host + "]"
+    url = "http://{}:{}".format(host, port)
+    log.info("Coordinating on %s with %d local worker%s",
+             url, workers, "" if workers == 1 else "s")
+
+    processes = [spawn(url, app.token, args) for _ in range(workers)]
+    try:
+        while not app.done():
+            if processes and all(p.poll() is not None for p in processes):
+                log.error("All worker processes exited with %d entries "
+                          "remaining", app.status()["pending"])
+                app.retval |= 1
+                break
+            time.sleep(1.0)
+
+        # let workers exit on their own after receiving 'done'
+        for process in processes:
+            try:
+                process.wait(10.0)
+            except subprocess.TimeoutExpired:
+                process.terminate()
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+        httpd.shutdown()
+        httpd.server_close()
+        app.close()
+
+    return app.retval
+
+
+def spawn(url, token=None, args=()):
+    """Start a local worker process connecting to 'url'"""
+    env = os.environ.copy()
+    if token:
+        env[TOKEN_ENV] = token
+    if getattr(sys, "frozen", False):
+        cmd = [sys.executable]
+    else:
+        cmd = [sys.executable, "-m", "gallery_dl"]
+    cmd.extend(args)
+    cmd.append("--worker")
+    cmd.append(url)
+    return subprocess.Popen(cmd, env=env)
+
+
+def worker_args(args):
+    """Return command-line arguments for local worker processes
+
+    Workers get their configuration from the coordinator without
+    credentials (see public_config()), so forward the config files
+    and credential options they would otherwise be missing.
+    """
+    if args.loglevel < logging.INFO:
+        wargs = ["--verbose"]
+    elif args.loglevel > logging.INFO:
+        wargs = ["--quiet"]
+    else:
+        wargs = []
+
+    if not args.load_config:
+        wargs.append("--ignore-config")
+    for path in args.cfgfiles or ():
+        wargs.append("--config")
+        wargs.append(path)
+    for path in args.yamlfiles or ():
+        wargs.append("--config-yaml")
+        wargs.append(path)
+
+    for path, key, value in args.options:
+        if key in CREDENTIAL_KEYS or \
+                any(part in key for part in CREDENTIAL_PARTS):
+            wargs.append("--option")
+            wargs.append("{}={}".format(
+                ".".join(tuple(path) + (key,)), json.dumps(value)))
+    return wargs
+
+
+def work(url, jobtype=None):
+    """Process entries leased from the coordinator at 'url'"""
+    from . import job
+
+    token = (config.get(("coordinator",), "token") or
+             os.environ.get(TOKEN_ENV))
+    client = Client(url, token)
+
+    # use the coordinator's configuration
+    info = client.call("/config")
+    util.combine_dict(config._config, info["config"])
+    if jobtype is None:
+        jobtype = getattr(job, info["jobtype"], job.DownloadJob)
+    if not issubclass(jobtype, job.DownloadJob):
+        raise ValueError("unsupported job type '{}'".format(jobtype.__name__))
+
+    retval = 0
+    while True:
+        entry = client.lease()
+        if entry is None:
+            break
+        if entry is False:
+            time.sleep(2.0)
+            continue
+        try:
+            retval |= journal.process(client, entry, jobtype)
+        except exception.CoordinatorError as exc:
+            # 'process()' released the entry if still possible
+            log.error("Stopping after losing entry %s: %s", entry[0], exc)
+            return retval | 1
+    return retval
+
+
+def archive_path(cfgpath):
+    """Return the download archive path configured for 'cfgpath'"""
+    if not isinstance(cfgpath, list) or \
+            not all(isinstance(p, str) for p in cfgpath):
+        raise TypeError("'cfgpath' must be a list of strings")
+    path = config.interpolate(cfgpath, "archive")
+    if not path:
+        raise ValueError("no download archive configured")
+    if "{" in path:
+        raise ValueError("format strings in 'archive' are not supported")
+    return util.expand_path(path)
+
+
+def public_config(conf):
+    """Return a copy of 'conf' without credentials"""
+    result = {}
+    for key, value in conf.items():
+        if key in CREDENTIAL_KEYS or \
+                any(part in key for part in CREDENTIAL_PARTS):
+            continue
+        if isinstance(value, dict):
+            value = public_config(value)
+        result[key] = value
+    return result
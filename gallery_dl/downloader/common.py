@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 
-# Copyright 2014-2020 Mike Fährmann
+# Copyright 2014-2021 Mike Fährmann
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License version 2 as
@@ -9,7 +9,12 @@
 """Common classes and constants used by downloader modules."""
 
 import os
-from .. import config, util
+import time
+import logging
+import threading
+from .. import config, text, util
+
+log = logging.getLogger("downloader")
 
 
 class DownloaderBase():
@@ -18,6 +23,7 @@ class DownloaderBase():
 
     def __init__(self, job):
         self.out = job.out
+        self.stop_event = job.stop_event
         self.session = job.extractor.session
         self.part = self.config("part", True)
         self.partdir = self.config("part-directory")
@@ -33,3 +39,116 @@ class DownloaderBase():
 
     def download(self, url, pathfmt):
         """Write data from 'url' into the file specified by 'pathfmt'"""
+
+
+class TokenBucket():
+    """Token bucket limiting the combined data rate of all its users
+
+    Tokens are allowed to go into debt, which lets concurrent transfers
+    share a single bucket: each caller gets told how long to wait until
+    its own debt is paid off, instead of sleeping after every chunk.
+    """
+
+    def __init__(self, rate):
+        self.lock = threading.Lock()
+        self.tokens = 0.0
+        self.timestamp = time.monotonic()
+        self.update(rate)
+
+    def update(self, rate):
+        """Set a new rate limit or time-of-day schedule"""
+        self.spec = rate
+        if isinstance(rate, dict):
+            self.schedule = parse_schedule(rate)
+            self.rate = None
+            self.recheck = 0.0
+        else:
+            self.schedule = None
+            self.rate = _parse_rate(rate)
+
+    def consume(self, amount):
+        """Take 'amount' tokens and return the number of seconds to wait"""
+        with self.lock:
+            now = time.monotonic()
+            if self.schedule and now >= self.recheck:
+                self.rate = scheduled_rate(self.schedule)
+                self.recheck = now + 60.0
+            rate = self.rate
+            if not rate:
+                self.timestamp = now
+                return 0.0
+
+            # refill, allowing a burst of at most one second worth of data
+            tokens = self.tokens + (now - self.timestamp) * rate
+            if tokens > rate:
+                tokens = rate
+            self.tokens = tokens = tokens - amount
+            self.timestamp = now
+
+        return -tokens / rate if tokens < 0.0 else 0.0
+
+
+def parse_schedule(schedule):
+    """Convert {"HH:MM-HH:MM": RATE, ...} into a list of (from, to, rate)
+
+    Entries with an invalid time span get ignored.
+    """
+    result = []
+    for span, rate in schedule.items():
+        begin, _, end = span.partition("-")
+        begin = _parse_daytime(begin)
+        end = _parse_daytime(end) if end else 1440
+        if begin is None or end is None:
+            log.warning("Invalid rate limit schedule entry '%s'", span)
+            continue
+        result.append((begin, end, _parse_rate(rate)))
+    return result
+
+
+def scheduled_rate(schedule, now=None):
+    """Return the rate limit of the first 'schedule' entry matching 'now'"""
+    if now is None:
+        now = time.localtime()
+    minute = now.tm_hour * 60 + now.tm_min
+    for begin, end, rate in schedule:
+        if begin <= end:
+            if begin <= minute < end:
+                return rate
+        elif minute >= begin or minute < end:  # span wraps around midnight
+            return rate
+    return None
+
+
+def get_bucket(key, rate):
+    """Return the process-wide TokenBucket for 'key'"""
+    with _bucket_lock:
+        try:
+            bucket = _buckets[key]
+        except KeyError:
+            bucket = _buckets[key] = TokenBucket(rate)
+        else:
+            if bucket.spec != rate:
+                bucket.update(rate)
+        return bucket
+
+
+def _parse_rate(rate):
+    if isinstance(rate, str):
+        rate = text.parse_bytes(rate)
+    return rate or None
+
+
+def _parse_daytime(value):
+    hour, _, minute = value.strip().partition(":")
+    try:
+        hour = int(hour)
+        minute = int(minute) if minute else 0
+    except ValueError:
+        return None
+    if 0 <= hour <= 24 and 0 <= minute < 60:
+        return min(hour * 60 + minute, 1440)
+    return None
+
+
+_buckets = {}
+_bucket_lock = threading.Lock()
@@ -8,11 +8,16 @@
 
 """Downloader module for http:// and https:// URLs"""
 
+import sys
 import time
+import zlib
+import hashlib
 import mimetypes
+import urllib.parse
+from http.client import HTTPException
 from requests.exceptions import RequestException, ConnectionError, Timeout
-from .common import DownloaderBase
-from .. import text, util
+from .common import DownloaderBase, TokenBucket, get_bucket
+from .. import text, util, output, metrics, exception
 
 from ssl import SSLError
 try:
@@ -28,7 +33,10 @@ class HttpDownloader(DownloaderBase):
         DownloaderBase.__init__(self, job)
         extractor = job.extractor
         self.chunk_size = 16384
+        self.chunk_size_max = 1048576
         self.downloading = False
+        self.received = 0
+        self.category = extractor.category
 
         self.adjust_extension = self.config("adjust-extensions", True)
         self.headers = self.config("headers")
@@ -39,6 +47,13 @@ class HttpDownloader(DownloaderBase):
         self.verify = self.config("verify", extractor._verify)
         self.mtime = self.config("mtime", True)
         self.rate = self.config("rate")
+        self.rate_global = self.config("rate-global")
+        self.rate_hosts = self.config("rate-hosts")
+        self.hash = self.config("hash")
+        self.hash_check = self.config("hash-check", True)
+        self.readinto = self.config("readinto", True)
+        self.preallocate = self.config("preallocate", True)
+        self.progress = self.config("progress", 3.0)
 
         if self.retries < 0:
             self.retries = float("inf")
@@ -55,16 +70,38 @@ class HttpDownloader(DownloaderBase):
                     "Invalid maximum file size (%r)", self.maxsize)
             self.maxsize = maxsize
         if self.rate:
-            rate = text.parse_bytes(self.rate)
+            rate = self.rate
+            if isinstance(rate, str):
+                rate = text.parse_bytes(rate)
             if rate:
                 if rate < self.chunk_size:
                     self.chunk_size = rate
-                self.rate = rate
-                self.receive = self._receive_rate
+                if rate < self.chunk_size_max:
+                    self.chunk_size_max = rate
+                self.rate = TokenBucket(rate)
             else:
                 self.log.warning("Invalid rate limit (%r)", self.rate)
+                self.rate = None
+        if self.rate_hosts and not isinstance(self.rate_hosts, dict):
+            self.log.warning("Invalid per-host rate limits (%r)",
+                             self.rate_hosts)
+            self.rate_hosts = None
+        if self.hash:
+            if isinstance(self.hash, str):
+                self.hash = self.hash.split(",")
+            for name in self.hash:
+                try:
+                    _new_hash(name)
+                except ValueError:
+                    self.log.warning("Unsupported hash algorithm '%s'", name)
+                    self.hash = None
+                    break
+        else:
+            self.hash = None
 
     def download(self, url, pathfmt):
+        started = time.monotonic()
+        self.received = 0
         try:
             return self._download_impl(url, pathfmt)
         except Exception:
@@ -74,6 +111,13 @@ class HttpDownloader(DownloaderBase):
             # remove file from incomplete downloads
             if self.downloading and not self.part:
                 util.remove_file(pathfmt.temppath)
+            if metrics.active:
+                labels = {"category": self.category,
+                          "host": metrics.hostname(url)}
+                metrics.active.observe(
+                    "download_seconds", time.monotonic() - started, **labels)
+                metrics.active.count(
+                    "download_bytes_total", self.received, **labels)
 
     def _download_impl(self, url, pathfmt):
         response = None
@@ -87,6 +131,17 @@ class HttpDownloader(DownloaderBase):
         if self.part:
             pathfmt.part_enable(self.partdir)
 
+        buckets = self._select_buckets(url)
+
+        # digests to compute while receiving
+        checksum = kwdict.get("_http_hash") if self.hash_check else None
+        hashes = self.hash
+        if checksum:
+            if not hashes:
+                hashes = (checksum[0],)
+            elif checksum[0] not in hashes:
+                hashes = hashes + [checksum[0]]
+
         while True:
             if tries:
                 if response:
@@ -95,6 +150,13 @@ class HttpDownloader(DownloaderBase):
                 self.log.warning("%s (%s/%s)", msg, tries, self.retries+1)
                 if tries > self.retries:
                     return False
+                if metrics.active:
+                    metrics.active.count(
+                        "download_retries_total", 1, category=self.category,
+                        host=metrics.hostname(url))
+                    metrics.active.count(
+                        "sleep_seconds_total", tries,
+                        category=self.category, reason="retry")
                 time.sleep(tries)
 
             tries += 1
@@ -135,6 +197,14 @@ class HttpDownloader(DownloaderBase):
                 offset = file_size
                 size = response.headers["Content-Range"].rpartition("/")[2]
             elif code == 416 and file_size:  # Requested Range Not Satisfiable
+                if hashes:
+                    hashers = {name: _new_hash(name) for name in hashes}
+                    with pathfmt.open("r+b") as fp:
+                        self._hash_file(fp, hashers, file_size)
+                        msg = self._check_hashes(kwdict, hashers, checksum)
+                        if msg:
+                            fp.truncate(0)
+                            continue
                 break
             else:
                 msg = "'{} {}' for '{}'".format(code, response.reason, url)
@@ -170,7 +240,10 @@ class HttpDownloader(DownloaderBase):
                         size, self.maxsize)
                     return False
 
-            content = response.iter_content(self.chunk_size)
+            if self.readinto and self._supports_readinto(response):
+                content = self._iter_readinto(response)
+            else:
+                content = response.iter_content(self.chunk_size)
 
             # check filename extension against file header
             if adjust_extension and not offset and \
@@ -197,24 +270,51 @@ class HttpDownloader(DownloaderBase):
                 mode = "r+b"
                 self.log.debug("Resuming download at byte %d", offset)
 
+            # set up checksum computation
+            if hashes:
+                hashers = {name: _new_hash(name) for name in hashes}
+                content = self._hash_content(content, hashers.values())
+            else:
+                hashers = None
+
+            if self.stop_event is not None:
+                content = self._stop_content(content, self.stop_event)
+
+            if self.progress is not None:
+                content = self._progress_content(
+                    content, pathfmt.path, size,
+                    offset + len(file_header) if file_header else offset)
+
             # download content
             self.downloading = True
             with pathfmt.open(mode) as fp:
                 if file_header:
                     fp.write(file_header)
+                    if hashers:
+                        for hasher in hashers.values():
+                            hasher.update(file_header)
                 elif offset:
                     if adjust_extension and \
                             pathfmt.extension in FILE_SIGNATURES:
                         self._adjust_extension(pathfmt, fp.read(16))
+                    if hashers:
+                        self._hash_file(fp, hashers, offset)
                     fp.seek(offset)
+                if size and self.preallocate and _fallocate:
+                    _fallocate(fp, offset, size - offset)
 
                 self.out.start(pathfmt.path)
                 try:
-                    self.receive(fp, content)
+                    if buckets:
+                        self._receive_rate(fp, content, buckets)
+                    else:
+                        self.receive(fp, content)
                 except (RequestException, SSLError, OpenSSLError) as exc:
                     msg = str(exc)
                     print()
                     continue
+                finally:
+                    self.received += fp.tell() - offset
 
                 # check file size
                 if size and fp.tell() < size:
@@ -223,6 +323,14 @@ class HttpDownloader(DownloaderBase):
                     print()
                     continue
 
+                # verify checksum
+                if hashers:
+                    msg = self._check_hashes(kwdict, hashers, checksum)
+                    if msg:
+                        fp.truncate(0)
+                        print()
+                        continue
+
             break
 
         self.downloading = False
@@ -239,23 +347,158 @@ class HttpDownloader(DownloaderBase):
         for data in content:
             write(data)
 
-    def _receive_rate(self, fp, content):
-        rt = self.rate
-        t1 = time.time()
+    @staticmethod
+    def _receive_rate(fp, content, buckets):
+        write = fp.write
+        sleep = time.sleep
 
         for data in content:
-            fp.write(data)
+            write(data)
 
-            t2 = time.time()           # current time
-            actual = t2 - t1           # actual elapsed time
-            expected = len(data) / rt  # expected elapsed time
+            size = len(data)
+            wait = 0.0
+            for bucket in buckets:
+                seconds = bucket.consume(size)
+                if seconds > wait:
+                    wait = seconds
+
+            # only sleep once enough debt has accumulated
+            if wait >= 0.05:
+                sleep(wait)
+
+    def _progress_content(self, content, path, bytes_total, bytes_start):
+        """Report download progress to 'self.out' while iterating 'content'
+
+        Reports start after 'self.progress' seconds and happen at most
+        once every PROGRESS_INTERVAL seconds.
+        """
+        progress = self.out.progress
+        monotonic = time.monotonic
+        interval = output.PROGRESS_INTERVAL
+        time_last = monotonic()
+        time_next = time_last + self.progress
+        received = received_last = 0
+        rate = None
 
-            if actual < expected:
-                # sleep if less time elapsed than expected
-                time.sleep(expected - actual)
-                t1 = time.time()
-            else:
-                t1 = t2
+        try:
+            for data in content:
+                yield data
+                received += len(data)
+
+                now = monotonic()
+                if now < time_next:
+                    continue
+                time_next = now + interval
+
+                current = (received - received_last) / (now - time_last)
+                rate = current if rate is None else rate * 0.7 + current * 0.3
+                time_last = now
+                received_last = received
+                progress(path, bytes_total, bytes_start + received, int(rate))
+        finally:
+            if rate is not None:
+                self.out.progress_end()
+
+    @staticmethod
+    def _supports_readinto(response):
+        """Return True if the raw response body can be read directly"""
+        raw = response.raw
+        encoding = response.headers.get("Content-Encoding")
+        return (not raw.chunked and
+                (not encoding or encoding == "identity") and
+                hasattr(getattr(raw, "_fp", None), "readinto"))
+
+    def _iter_readinto(self, response):
+        """Yield memoryviews of a reused buffer filled by 'readinto()'
+
+        The buffer size doubles while it gets filled in less than 50ms
+        and halves when that takes longer than 500ms.
+        """
+        raw = response.raw
+        readinto = raw._fp.readinto
+        monotonic = time.monotonic
+        size = self.chunk_size
+        size_min = size
+        size_max = self.chunk_size_max
+        view = memoryview(bytearray(size))
+
+        while True:
+            t1 = monotonic()
+            try:
+                num = readinto(view)
+            except (OSError, HTTPException) as exc:
+                raise ConnectionError(exc)
+            if not num:
+                break
+            yield view[:num]
+
+            if num == size:
+                elapsed = monotonic() - t1
+                if elapsed < 0.05:
+                    if size < size_max:
+                        size = min(size * 2, size_max)
+                        view = memoryview(bytearray(size))
+                elif elapsed > 0.5 and size > size_min:
+                    size //= 2
+                    view = view[:size]
+
+        # hand the connection back to its pool
+        raw.release_conn()
+
+    @staticmethod
+    def _stop_content(content, stop_event):
+        """Stop iterating 'content' once 'stop_event' is set"""
+        is_set = stop_event.is_set
+        for data in content:
+            if is_set():
+                raise exception.TerminateExtraction()
+            yield data
+
+    @staticmethod
+    def _hash_content(content, hashers):
+        updates = [hasher.update for hasher in hashers]
+        for data in content:
+            for update in updates:
+                update(data)
+            yield data
+
+    @staticmethod
+    def _hash_file(fp, hashers, size):
+        """Update 'hashers' with the first 'size' bytes of 'fp'"""
+        fp.seek(0)
+        while size > 0:
+            data = fp.read(min(size, 65536))
+            if not data:
+                break
+            size -= len(data)
+            for hasher in hashers.values():
+                hasher.update(data)
+
+    @staticmethod
+    def _check_hashes(kwdict, hashers, checksum):
+        """Store computed digests in 'kwdict' and compare with 'checksum'"""
+        for name, hasher in hashers.items():
+            kwdict["_hash_" + name] = hasher.hexdigest()
+        if checksum:
+            name, expected = checksum
+            actual = kwdict["_hash_" + name]
+            if actual != expected.lower():
+                return "{} checksum mismatch ({} != {})".format(
+                    name, actual, expected)
+        return None
+
+    def _select_buckets(self, url):
+        """Collect all TokenBuckets limiting downloads from 'url'"""
+        buckets = []
+        if self.rate:
+            buckets.append(self.rate)
+        if self.rate_global:
+            buckets.append(get_bucket("", self.rate_global))
+        if self.rate_hosts:
+            host = urllib.parse.urlsplit(url).hostname
+            if host in self.rate_hosts:
+                buckets.append(get_bucket(host, self.rate_hosts[host]))
+        return buckets
 
     def _find_extension(self, response):
         """Get filename extension from MIME type"""
@@ -287,6 +530,51 @@ class HttpDownloader(DownloaderBase):
         return False
 
 
+class CRC32():
+    """hashlib-like wrapper around zlib.crc32"""
+    name = "crc32"
+
+    def __init__(self):
+        self.value = 0
+
+    def update(self, data):
+        self.value = zlib.crc32(data, self.value)
+
+    def hexdigest(self):
+        return "{:08x}".format(self.value)
+
+
+def _fallocate_linux():
+    """Return a function reserving disk space without changing file sizes"""
+    import ctypes
+    import ctypes.util
+
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    fallocate = libc.fallocate
+    fallocate.argtypes = (
+        ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64)
+
+    def func(fp, offset, length, keep_size=1):  # FALLOC_FL_KEEP_SIZE
+        if length > 0:
+            fallocate(fp.fileno(), keep_size, offset, length)
+    return func
+
+
+if sys.platform.startswith("linux"):
+    try:
+        _fallocate = _fallocate_linux()
+    except Exception:
+        _fallocate = None
+else:
+    _fallocate = None
+
+
+def _new_hash(name):
+    if name == "crc32":
+        return CRC32()
+    return hashlib.new(name)
+
+
 MIME_TYPES = {
     "image/jpeg"    : "jpg",
     "image/jpg"     : "jpg",
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2021 Mike Fährmann
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+
+"""Structured event stream in JSON Lines format"""
+
+import json
+import time
+import logging
+from . import output
+
+log = logging.getLogger("events")
+log.propagate = False
+
+active = False
+
+
+class Formatter(logging.Formatter):
+    """Format the event data of a log record as a single line of JSON"""
+
+    def format(self, record):
+        return json.dumps(record.event, default=str, ensure_ascii=False)
+
+
+def initialize():
+    """Set up the event stream from 'output.events'"""
+    global active
+    handler = output.setup_logging_handler(
+        "events", lvl=logging.INFO, formatter=Formatter())
+    if handler:
+        log.addHandler(handler)
+        log.setLevel(logging.INFO)
+        active = True
+
+
+def emit(event, job=None, **fields):
+    """Write an event and its 'fields' to the event stream
+
+    Events of a job include its extractor's category, subcategory,
+    and input URL.
+    """
+    data = {"event": event, "time": time.time()}
+    if job:
+        extr = job.extractor
+        data["category"] = extr.category
+        data["subcategory"] = extr.subcategory
+        data["job"] = extr.url
+    data.update(fields)
+    log.info(event, extra={"event": data})
@@ -12,6 +12,7 @@ Class Hierarchy:
 
 Exception
  +-- GalleryDLException
+      +-- CoordinatorError
       +-- ExtractionError
       |    +-- AuthenticationError
       |    +-- AuthorizationError
@@ -43,6 +44,11 @@ class GalleryDLException(Exception):
         Exception.__init__(self, message)
 
 
+class CoordinatorError(GalleryDLException):
+    """Communication with a coordinator failed"""
+    default = "Coordinator request failed"
+
+
 class ExtractionError(GalleryDLException):
     """Base class for exceptions during information extraction"""
 
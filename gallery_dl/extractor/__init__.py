@@ -161,6 +161,14 @@ def find(url):
     return None
 
 
+def find_class(url):
+    """Return the extractor class for 'url' without instantiating it"""
+    for cls in _list_classes():
+        if cls.pattern.match(url):
+            return cls
+    return None
+
+
 def add(cls):
     """Add 'cls' to the list of available extractors"""
     cls.pattern = re.compile(cls.pattern)
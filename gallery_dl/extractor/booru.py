@@ -23,8 +23,9 @@ class BooruExtractor(BaseExtractor):
     def items(self):
         self.login()
         data = self.metadata()
-        tags = self.config("tags", False)
-        notes = self.config("notes", False)
+        tags = self.config("tags", False) and self.metadata_needed(
+            "tags_*", "tag_string_*")
+        notes = self.config("notes", False) and self.metadata_needed("notes")
 
         for post in self.posts():
             try:
@@ -36,6 +37,10 @@ class BooruExtractor(BaseExtractor):
                                "(md5: %s)", post.get("id"), post.get("md5"))
                 continue
 
+            md5 = post.get("md5")
+            if md5 and md5 in url:
+                post.setdefault("_http_hash", ("md5", md5))
+
             page_html = None
             if tags:
                 page_html = self._extended_tags(post)
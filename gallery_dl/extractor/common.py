@@ -10,6 +10,7 @@
 
 import re
 import ssl
+import sys
 import time
 import netrc
 import queue
@@ -17,9 +18,11 @@ import logging
 import datetime
 import requests
 import threading
+import collections
+import concurrent.futures
 from requests.adapters import HTTPAdapter
 from .message import Message
-from .. import config, text, util, exception
+from .. import config, text, util, exception, metrics
 
 
 class Extractor():
@@ -37,18 +40,25 @@ class Extractor():
     test = None
     request_interval = 0.0
     request_interval_min = 0.0
-    request_timestamp = 0.0
+    request_timestamps = {}
+    request_lock = threading.Lock()
+    cookiestore = util.CookieStore()
+    session_pool = {}
+    session_lock = threading.Lock()
+    prefetch = 0
 
     def __init__(self, match):
         self.log = logging.getLogger(self.category)
         self.url = match.string
         self.finalize = None
+        self._prefetch_thread = None
 
         if self.basecategory:
             self.config = self._config_shared
             self.config_accumulate = self._config_shared_accumulate
         self._cfgpath = ("extractor", self.category, self.subcategory)
         self._parentdir = ""
+        self._fields = None
 
         self._write_pages = self.config("write-pages", False)
         self._retries = self.config("retries", 4)
@@ -58,6 +68,7 @@ class Extractor():
             self.config("sleep-request", self.request_interval),
             self.request_interval_min,
         )
+        self._interval_per_host = self.config("sleep-request-per-host", False)
 
         if self._retries < 0:
             self._retries = float("inf")
@@ -74,6 +85,9 @@ class Extractor():
         return cls(match) if match else None
 
     def __iter__(self):
+        depth = self.config("extractor-prefetch", self.prefetch)
+        if depth and depth > 0:
+            return self._prefetch(self.items(), depth)
         return self.items()
 
     def items(self):
@@ -85,6 +99,26 @@ class Extractor():
     def config(self, key, default=None):
         return config.interpolate(self._cfgpath, key, default)
 
+    def metadata_needed(self, *fields):
+        """Return True if any of 'fields' gets used by the current job
+
+        A field ending in '*' stands for all fields starting with
+        its prefix. Extractors can use this to skip fetching
+        additional metadata nobody is going to use.
+        """
+        used = self._fields
+        if used is None:
+            return True
+        for field in fields:
+            if field[-1] == "*":
+                prefix = field[:-1]
+                for name in used:
+                    if name.startswith(prefix):
+                        return True
+            elif field in used:
+                return True
+        return False
+
     def config_accumulate(self, key):
         return config.accumulate(self._cfgpath, key)
 
@@ -115,15 +149,30 @@ class Extractor():
         tries = 1
 
         if self._interval:
-            seconds = (self._interval() -
-                       (time.time() - Extractor.request_timestamp))
+            # reserve a time slot for all requests or those to this host,
+            # which also spaces out requests from concurrent threads
+            host = (url.partition("://")[2].partition("/")[0]
+                    if self._interval_per_host else "")
+            interval = self._interval()
+            with Extractor.request_lock:
+                now = time.time()
+                start = max(now, Extractor.request_timestamps.get(
+                    host, 0.0) + interval)
+                Extractor.request_timestamps[host] = start
+            seconds = start - now
             if seconds > 0.0:
                 self.log.debug("Sleeping for %.5s seconds", seconds)
                 time.sleep(seconds)
+                if metrics.active:
+                    metrics.active.count(
+                        "sleep_seconds_total", seconds,
+                        category=self.category, reason="request")
 
         while True:
+            started = time.monotonic()
+            current = None
             try:
-                response = session.request(method, url, **kwargs)
+                response = current = session.request(method, url, **kwargs)
             except (requests.exceptions.ConnectionError,
                     requests.exceptions.Timeout,
                     requests.exceptions.ChunkedEncodingError,
@@ -159,16 +208,50 @@ class Extractor():
                     break
 
             finally:
-                Extractor.request_timestamp = time.time()
+                if self._interval:
+                    with Extractor.request_lock:
+                        timestamps = Extractor.request_timestamps
+                        timestamps[host] = max(
+                            timestamps[host], time.time())
+                if metrics.active:
+                    self._record_request(url, current, started, kwargs)
 
             self.log.debug("%s (%s/%s)", msg, tries, retries+1)
             if tries > retries:
                 break
-            time.sleep(max(tries, self.request_interval))
+            seconds = max(tries, self.request_interval)
+            if metrics.active:
+                host = metrics.hostname(url)
+                metrics.active.count(
+                    "request_retries_total", 1,
+                    category=self.category, host=host)
+                metrics.active.count(
+                    "sleep_seconds_total", seconds,
+                    category=self.category, reason="retry")
+            time.sleep(seconds)
             tries += 1
 
         raise exception.HttpError(msg, response)
 
+    def request_json(self, url, **kwargs):
+        """Send a request and return its decoded JSON response body"""
+        return self.parse_json(self.request(url, **kwargs))
+
+    def parse_json(self, response):
+        """Decode the raw bytes of 'response' as JSON
+
+        Unlike response.json(), this skips requests' charset detection.
+        """
+        if not metrics.active:
+            return util.json_loads(response.content)
+        started = time.monotonic()
+        try:
+            return util.json_loads(response.content)
+        finally:
+            metrics.active.observe(
+                "json_decode_seconds", time.monotonic() - started,
+                category=self.category)
+
     def wait(self, *, seconds=None, until=None, adjust=1.0,
              reason="rate limit reset"):
         now = time.time()
@@ -195,6 +278,144 @@ class Extractor():
             isotime = "{:02}:{:02}:{:02}".format(t.hour, t.minute, t.second)
             self.log.info("Waiting until %s for %s.", isotime, reason)
         time.sleep(seconds)
+        if metrics.active:
+            metrics.active.count(
+                "sleep_seconds_total", seconds,
+                category=self.category, reason="wait")
+
+    def stop_prefetch(self):
+        """Stop the thread started by _prefetch() and wait for it to end
+
+        Consumers of this extractor's messages call this in a 'finally'
+        block, since a generator's own cleanup only runs once it gets
+        garbage collected, which is not deterministic on e.g. PyPy.
+        """
+        thread = self._prefetch_thread
+        if thread is None:
+            return
+        self._prefetch_thread = None
+
+        # let the producer thread stop after its current message
+        self._prefetch_stop.set()
+        buffer = self._prefetch_buffer
+        while not buffer.empty():
+            buffer.get_nowait()
+        if not isinstance(sys.exc_info()[1], KeyboardInterrupt):
+            thread.join()
+
+    def map_concurrent(self, func, iterable):
+        """Yield 'func(item)' for each item of 'iterable' in order
+
+        Up to 'fetch-concurrency' calls run in parallel threads, sharing
+        this extractor's session and request intervals. An exception
+        raised by 'func' gets raised by the generator at the position
+        of its item. When the generator stops, remaining calls get
+        cancelled and calls already in progress finish before it
+        returns, unless it got interrupted by KeyboardInterrupt.
+        """
+        concurrency = self.config("fetch-concurrency", 1)
+        if not concurrency or concurrency <= 1:
+            yield from map(func, iterable)
+            return
+
+        executor = concurrent.futures.ThreadPoolExecutor(concurrency)
+        pending = collections.deque()
+        limit = concurrency * 2
+        stop = threading.Event()
+
+        def call(item):
+            if stop.is_set():
+                return None
+            return func(item)
+
+        try:
+            for item in iterable:
+                pending.append(executor.submit(call, item))
+                if len(pending) >= limit:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            stop.set()
+            for future in pending:
+                future.cancel()
+            executor.shutdown(
+                not isinstance(sys.exc_info()[1], KeyboardInterrupt))
+
+    def _prefetch(self, messages, depth):
+        """Run 'messages' in a separate thread, up to 'depth' ahead"""
+        buffer = queue.Queue(depth)
+        stop = threading.Event()
+
+        def produce():
+            try:
+                for msg in messages:
+                    # copy metadata dicts that might get modified
+                    # while the consumer is still processing them
+                    if isinstance(msg[-1], (dict, util.LayeredDict)):
+                        msg = msg[:-1] + (msg[-1].copy(),)
+                    buffer.put(msg)
+                    if stop.is_set():
+                        return messages.close()
+                msg = None
+            except Exception as exc:
+                msg = exc
+            if not stop.is_set():
+                buffer.put(msg)
+
+        thread = threading.Thread(target=produce, daemon=True)
+        self._prefetch_thread = thread
+        self._prefetch_stop = stop
+        self._prefetch_buffer = buffer
+        thread.start()
+
+        waits = count = 0
+        waited = 0.0
+        try:
+            while True:
+                try:
+                    msg = buffer.get_nowait()
+                except queue.Empty:
+                    started = time.monotonic()
+                    msg = buffer.get()
+                    waited += time.monotonic() - started
+                    waits += 1
+
+                if msg is None:
+                    thread.join()
+                    return
+                if isinstance(msg, Exception):
+                    thread.join()
+                    raise msg
+                count += 1
+                yield msg
+        finally:
+            if self._prefetch_thread is thread:
+                self.stop_prefetch()
+            self.log.debug("Prefetch: waited %d times (%.2fs) "
+                           "for %d messages", waits, waited, count)
+            if metrics.active:
+                metrics.active.count(
+                    "prefetch_messages_total", count, category=self.category)
+                metrics.active.count(
+                    "prefetch_waits_total", waits, category=self.category)
+                metrics.active.count(
+                    "prefetch_wait_seconds_total", waited,
+                    category=self.category)
+
+    def _record_request(self, url, response, started, kwargs):
+        """Update request metrics"""
+        labels = {"category": self.category, "host": metrics.hostname(url)}
+        metrics.active.observe(
+            "request_seconds", time.monotonic() - started, **labels)
+        if response is not None:
+            metrics.active.count(
+                "requests_total", 1, status=response.status_code, **labels)
+            if not kwargs.get("stream"):
+                metrics.active.count(
+                    "request_bytes_total", len(response.content), **labels)
+        else:
+            metrics.active.count("requests_total", 1, status=0, **labels)
 
     def _get_auth_info(self):
         """Return authentication information as (username, password) tuple"""
@@ -215,11 +436,36 @@ class Extractor():
         return username, password
 
     def _init_session(self):
+        """Create a session with headers and adapters of a pooled template
+
+        Extractors with the same session options share a template, which
+        avoids setting up browser emulation and TLS contexts for every
+        child extractor. Headers and cookies are never shared.
+        """
+        options = (
+            self.config("browser") or self.browser,
+            self.config("user-agent"),
+            self.config("headers"),
+            self.config("ciphers"),
+        )
+        key = repr(options)
+
+        with Extractor.session_lock:
+            template = Extractor.session_pool.get(key)
+            if template is None:
+                template = Extractor.session_pool[key] = \
+                    self._build_session(*options)
+
         self.session = session = requests.Session()
+        session.headers = template.headers.copy()
+        session.adapters = template.adapters.copy()
+
+    @staticmethod
+    def _build_session(browser, useragent, custom_headers, ciphers):
+        session = requests.Session()
         headers = session.headers
         headers.clear()
 
-        browser = self.config("browser") or self.browser
         if browser and isinstance(browser, str):
             browser, _, platform = browser.lower().partition(":")
 
@@ -238,22 +484,22 @@ class Extractor():
             else:
                 _emulate_browser_firefox(session, platform)
         else:
-            headers["User-Agent"] = self.config("user-agent", (
-                "Mozilla/5.0 (Windows NT 10.0; Win64; x64; "
-                "rv:91.0) Gecko/20100101 Firefox/91.0"))
+            if useragent is None:
+                useragent = ("Mozilla/5.0 (Windows NT 10.0; Win64; x64; "
+                             "rv:91.0) Gecko/20100101 Firefox/91.0")
+            headers["User-Agent"] = useragent
             headers["Accept"] = "*/*"
             headers["Accept-Language"] = "en-US,en;q=0.5"
-            headers["Accept-Encoding"] = "gzip, deflate"
+            headers["Accept-Encoding"] = ACCEPT_ENCODING
 
-        custom_headers = self.config("headers")
         if custom_headers:
             headers.update(custom_headers)
 
-        ciphers = self.config("ciphers")
         if ciphers:
             if isinstance(ciphers, list):
                 ciphers = ":".join(ciphers)
             session.mount("https://", HTTPSAdapter(ciphers))
+        return session
 
     def _init_proxies(self):
         """Update the session's proxy map"""
@@ -283,8 +529,7 @@ class Extractor():
             elif isinstance(cookies, str):
                 cookiefile = util.expand_path(cookies)
                 try:
-                    with open(cookiefile) as fp:
-                        cookies = util.load_cookiestxt(fp)
+                    cookies = self.cookiestore.load(cookiefile)
                 except Exception as exc:
                     self.log.warning("cookies: %s", exc)
                 else:
@@ -299,8 +544,8 @@ class Extractor():
         """Store the session's cookiejar in a cookies.txt file"""
         if self._cookiefile and self.config("cookies-update", True):
             try:
-                with open(self._cookiefile, "w") as fp:
-                    util.save_cookiestxt(fp, self._cookiejar)
+                if self.cookiestore.store(self._cookiefile, self._cookiejar):
+                    self.log.debug("Updated %s", self._cookiefile)
             except OSError as exc:
                 self.log.warning("cookies: %s", exc)
 
@@ -466,14 +711,20 @@ class GalleryExtractor(Extractor):
             images = enum(imgs, 1)
 
         yield Message.Directory, data
-        for data[self.enum], (url, imgdata) in images:
-            if imgdata:
-                data.update(imgdata)
-                if "extension" not in imgdata:
-                    text.nameext_from_url(url, data)
+        # send already available image lists as a single batch
+        batch = [] if hasattr(imgs, "__len__") else None
+        for num, (url, imgdata) in images:
+            # layer per-image metadata on top of the shared gallery data
+            kwdict = util.LayeredDict(data, dict(imgdata) if imgdata else {})
+            kwdict[self.enum] = num
+            if not imgdata or "extension" not in imgdata:
+                text.nameext_from_url(url, kwdict)
+            if batch is None:
+                yield Message.Url, url, kwdict
             else:
-                text.nameext_from_url(url, data)
-            yield Message.Url, url, data
+                batch.append((url, kwdict))
+        if batch:
+            yield Message.UrlBatch, batch
 
     def login(self):
         """Login and set necessary cookies"""
@@ -533,34 +784,7 @@ class MangaExtractor(Extractor):
 
 class AsynchronousMixin():
     """Run info extraction in a separate thread"""
-
-    def __iter__(self):
-        messages = queue.Queue(5)
-        thread = threading.Thread(
-            target=self.async_items,
-            args=(messages,),
-            daemon=True,
-        )
-
-        thread.start()
-        while True:
-            msg = messages.get()
-            if msg is None:
-                thread.join()
-                return
-            if isinstance(msg, Exception):
-                thread.join()
-                raise msg
-            yield msg
-            messages.task_done()
-
-    def async_items(self, messages):
-        try:
-            for msg in self.items():
-                messages.put(msg)
-        except Exception as exc:
-            messages.put(exc)
-        messages.put(None)
+    prefetch = 5
 
 
 class BaseExtractor(Extractor):
@@ -622,7 +846,7 @@ def _emulate_browser_firefox(session, platform):
     headers["Accept"] = ("text/html,application/xhtml+xml,"
                          "application/xml;q=0.9,image/webp,*/*;q=0.8")
     headers["Accept-Language"] = "en-US,en;q=0.5"
-    headers["Accept-Encoding"] = "gzip, deflate"
+    headers["Accept-Encoding"] = ACCEPT_ENCODING
     headers["Referer"] = None
     headers["Upgrade-Insecure-Requests"] = "1"
     headers["Cookie"] = None
@@ -661,7 +885,7 @@ def _emulate_browser_chrome(session, platform):
     headers["Accept"] = ("text/html,application/xhtml+xml,application/xml;"
                          "q=0.9,image/webp,image/apng,*/*;q=0.8")
     headers["Referer"] = None
-    headers["Accept-Encoding"] = "gzip, deflate"
+    headers["Accept-Encoding"] = ACCEPT_ENCODING
     headers["Accept-Language"] = "en-US,en;q=0.9"
     headers["Cookie"] = None
 
@@ -685,6 +909,19 @@ def _emulate_browser_chrome(session, platform):
     ))
 
 
+def _accept_encoding():
+    """Return all content codings urllib3 is able to decode"""
+    try:
+        from urllib3.util.request import ACCEPT_ENCODING as encodings
+    except ImportError:
+        return "gzip, deflate"
+    # 'br' and 'zstd' get included when brotli/zstandard are installed
+    return ", ".join(enc.strip() for enc in encodings.split(","))
+
+
+ACCEPT_ENCODING = _accept_encoding()
+
+
 # Undo automatic pyOpenSSL injection by requests
 pyopenssl = config.get((), "pyopenssl", False)
 if not pyopenssl:
@@ -49,6 +49,9 @@ class DanbooruExtractor(Extractor):
 
     def items(self):
         data = self.metadata()
+        extended_metadata = self.extended_metadata and self.metadata_needed(
+            "artist_commentary", "children", "notes", "parent")
+
         for post in self.posts():
             try:
                 url = post["file_url"]
@@ -59,6 +62,9 @@ class DanbooruExtractor(Extractor):
                     yield Message.Queue, post["source"], post
                 continue
 
+            if post.get("md5"):
+                post["_http_hash"] = ("md5", post["md5"])
+
             text.nameext_from_url(url, post)
             if post["extension"] == "zip":
                 if self.ugoira:
@@ -70,8 +76,9 @@ class DanbooruExtractor(Extractor):
                 else:
                     url = post["large_file_url"]
                     post["extension"] = "webm"
+                    post["_http_hash"] = None
 
-            if self.extended_metadata:
+            if extended_metadata:
                 template = (
                     "{}/posts/{}.json"
                     "?only=artist_commentary,children,notes,parent"
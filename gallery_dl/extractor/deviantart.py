@@ -1194,7 +1194,7 @@ class DeviantartOAuthAPI():
         auth = (self.client_id, self.client_secret)
         response = self.extractor.request(
             url, method="POST", data=data, auth=auth, fatal=False)
-        data = response.json()
+        data = self.extractor.parse_json(response)
 
         if response.status_code != 200:
             self.log.debug("Server response: %s", data)
@@ -1217,7 +1217,7 @@ class DeviantartOAuthAPI():
             self.authenticate(None if public else self.refresh_token_key)
             kwargs["headers"] = self.headers
             response = self.extractor.request(url, **kwargs)
-            data = response.json()
+            data = self.extractor.parse_json(response)
             status = response.status_code
 
             if 200 <= status < 400:
@@ -1387,7 +1387,7 @@ class DeviantartEclipseAPI():
             raise exception.StopExtraction(
                 "Your account must use the Eclipse interface.")
         try:
-            return response.json()
+            return self.extractor.parse_json(response)
         except Exception:
             return {"error": response.text}
 
@@ -44,6 +44,7 @@ class E621Extractor(danbooru.DanbooruExtractor):
 
             post["filename"] = file["md5"]
             post["extension"] = file["ext"]
+            post["_http_hash"] = ("md5", file["md5"])
             post.update(data)
             yield Message.Directory, post
             yield Message.Url, file["url"], post
@@ -247,31 +247,37 @@ class ExhentaiGalleryExtractor(ExhentaiExtractor):
             data["date"] = text.parse_timestamp(data["posted"])
         return data
 
+    _metadata_rules = text.compile_rules((
+        ("thumb"       , "background:transparent url(", ")"),
+        ("title"       , '<h1 id="gn">', '</h1>'),
+        ("title_jpn"   , '<h1 id="gj">', '</h1>'),
+        ("_"           , '<div id="gdc"><div class="cs ct', '"'),
+        ("eh_category" , '>', '<'),
+        ("uploader"    , '/uploader/', '"'),
+        ("date"        , '>Posted:</td><td class="gdt2">', '</td>'),
+        ("parent"      , '>Parent:</td><td class="gdt2"><a href="', '"'),
+        ("expunged"    , '>Visible:</td><td class="gdt2">', '<'),
+        ("language"    , '>Language:</td><td class="gdt2">', ' '),
+        ("filesize"    , '>File Size:</td><td class="gdt2">', '<'),
+        ("filecount"   , '>Length:</td><td class="gdt2">', ' '),
+        ("favorites"   , 'id="favcount">', ' '),
+        ("rating"      , ">Average: ", "<"),
+        ("torrentcount", '>Torrent Download (', ')'),
+    ), "")
+
     def metadata_from_page(self, page):
-        extr = text.extract_from(page)
         data = {
-            "gid"          : self.gallery_id,
-            "token"        : self.gallery_token,
-            "thumb"        : extr("background:transparent url(", ")"),
-            "title"        : text.unescape(extr('<h1 id="gn">', '</h1>')),
-            "title_jpn"    : text.unescape(extr('<h1 id="gj">', '</h1>')),
-            "_"            : extr('<div id="gdc"><div class="cs ct', '"'),
-            "eh_category"  : extr('>', '<'),
-            "uploader"     : text.unquote(extr('/uploader/', '"')),
-            "date"         : text.parse_datetime(extr(
-                '>Posted:</td><td class="gdt2">', '</td>'), "%Y-%m-%d %H:%M"),
-            "parent"       : extr(
-                '>Parent:</td><td class="gdt2"><a href="', '"'),
-            "expunged"     : "Yes" != extr(
-                '>Visible:</td><td class="gdt2">', '<'),
-            "language"     : extr('>Language:</td><td class="gdt2">', ' '),
-            "filesize"     : text.parse_bytes(extr(
-                '>File Size:</td><td class="gdt2">', '<').rstrip("Bb")),
-            "filecount"    : extr('>Length:</td><td class="gdt2">', ' '),
-            "favorites"    : extr('id="favcount">', ' '),
-            "rating"       : extr(">Average: ", "<"),
-            "torrentcount" : extr('>Torrent Download (', ')'),
+            "gid"  : self.gallery_id,
+            "token": self.gallery_token,
         }
+        self._metadata_rules(page, 0, data)
+
+        data["title"] = text.unescape(data["title"])
+        data["title_jpn"] = text.unescape(data["title_jpn"])
+        data["uploader"] = text.unquote(data["uploader"])
+        data["date"] = text.parse_datetime(data["date"], "%Y-%m-%d %H:%M")
+        data["expunged"] = "Yes" != data["expunged"]
+        data["filesize"] = text.parse_bytes(data["filesize"].rstrip("Bb"))
 
         f = data["favorites"][0]
         if f == "N":
@@ -34,8 +34,8 @@ class FuraffinityExtractor(Extractor):
     def items(self):
         external = self.config("external", False)
         metadata = self.metadata()
-        for post_id in util.advance(self.posts(), self.offset):
-            post = self._parse_post(post_id)
+        for post in self.map_concurrent(
+                self._parse_post, util.advance(self.posts(), self.offset)):
             if post:
                 if metadata:
                     post.update(metadata)
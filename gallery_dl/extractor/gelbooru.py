@@ -27,6 +27,7 @@ class GelbooruBase():
             md5 = post["md5"]
             path = "/images/{}/{}/{}.webm".format(md5[0:2], md5[2:4], md5)
             post["_fallback"] = GelbooruBase._video_fallback(path)
+            post["_http_hash"] = None  # 'md5' belongs to the original video
             url = "https://img3.gelbooru.com" + path
         return url
 
@@ -21,7 +21,11 @@ class GelbooruV02Extractor(booru.BooruExtractor):
 
     def _api_request(self, params):
         url = self.root + "/index.php?page=dapi&s=post&q=index"
-        return ElementTree.fromstring(self.request(url, params=params).text)
+        try:
+            return ElementTree.fromstring(
+                self.request(url, params=params).text)
+        except ElementTree.ParseError as exc:
+            raise exception.StopExtraction("Invalid API response (%s)", exc)
 
     def _pagination(self, params):
         params["pid"] = self.page_start
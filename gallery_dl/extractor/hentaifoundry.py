@@ -36,8 +36,8 @@ class HentaifoundryExtractor(Extractor):
         self._init_site_filters()
         data = self.metadata()
 
-        for post_url in util.advance(self.posts(), self.start_post):
-            image = self._parse_post(post_url)
+        for image in self.map_concurrent(
+                self._parse_post, util.advance(self.posts(), self.start_post)):
             image.update(data)
             yield Message.Directory, image
             yield Message.Url, image["src"], image
@@ -65,32 +65,43 @@ class HentaifoundryExtractor(Extractor):
                 return
             num += 1
 
+    _post_rules = text.compile_rules((
+        ("title"      , 'class="imageTitle">', '<'),
+        ("artist"     , '/profile">', '<'),
+        ("width"      , 'width="', '"'),
+        ("height"     , 'height="', '"'),
+        ("src"        , 'src="', '"'),
+        ("description", '>Description</div>', '</section>'),
+        ("ratings"    , "class='ratings_box'", "</div>"),
+        ("media"      , "Media</b></td>\t\t<td>", "<"),
+        ("date"       , "datetime='", "'"),
+        ("views"      , "Views</b></td>\t\t<td>", "<"),
+        ("tags"       , "<td><b>Keywords</b></td>", "</tr>"),
+        ("score"      , 'Score</b></td>\t\t<td>', '<'),
+    ), "")
+
     def _parse_post(self, path):
         """Collect url and metadata from an image post"""
         url = text.urljoin(self.root, path)
         page = self.request(url).text
-        extr = text.extract_from(page, page.index('id="picBox"'))
-
-        data = {
-            "title"      : text.unescape(extr('class="imageTitle">', '<')),
-            "artist"     : text.unescape(extr('/profile">', '<')),
-            "width"      : text.parse_int(extr('width="', '"')),
-            "height"     : text.parse_int(extr('height="', '"')),
-            "index"      : text.parse_int(path.rsplit("/", 2)[1]),
-            "src"        : text.urljoin(self.root, text.unescape(extr(
-                'src="', '"'))),
-            "description": text.unescape(text.remove_html(extr(
-                '>Description</div>', '</section>')
-                .replace("\r\n", "\n"), "", "")),
-            "ratings"    : [text.unescape(r) for r in text.extract_iter(extr(
-                "class='ratings_box'", "</div>"), "title='", "'")],
-            "media"      : text.unescape(extr("Media</b></td>\t\t<td>", "<")),
-            "date"       : text.parse_datetime(extr("datetime='", "'")),
-            "views"      : text.parse_int(extr("Views</b></td>\t\t<td>", "<")),
-            "tags"       : text.split_html(extr(
-                "<td><b>Keywords</b></td>", "</tr>"))[::2],
-            "score"      : text.parse_int(extr('Score</b></td>\t\t<td>', '<')),
-        }
+        data = self._post_rules(page, page.index('id="picBox"'))[0]
+
+        pi = text.parse_int
+        data["title"] = text.unescape(data["title"])
+        data["artist"] = text.unescape(data["artist"])
+        data["width"] = pi(data["width"])
+        data["height"] = pi(data["height"])
+        data["index"] = pi(path.rsplit("/", 2)[1])
+        data["src"] = text.urljoin(self.root, text.unescape(data["src"]))
+        data["description"] = text.unescape(text.remove_html(
+            data["description"].replace("\r\n", "\n"), "", ""))
+        data["ratings"] = [text.unescape(r) for r in text.extract_iter(
+            data["ratings"], "title='", "'")]
+        data["media"] = text.unescape(data["media"])
+        data["date"] = text.parse_datetime(data["date"])
+        data["views"] = pi(data["views"])
+        data["tags"] = text.split_html(data["tags"])[::2]
+        data["score"] = pi(data["score"])
 
         return text.nameext_from_url(data["src"], data)
 
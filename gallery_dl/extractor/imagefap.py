@@ -10,6 +10,7 @@
 
 from .common import Extractor, Message
 from .. import text
+import itertools
 import json
 
 
@@ -60,7 +61,7 @@ class ImagefapGalleryExtractor(ImagefapExtractor):
         page = self.request(url).text
         data = self.get_job_metadata(page)
         yield Message.Directory, data
-        for url, image in self.get_images():
+        for url, image in self.get_images(data["count"]):
             data.update(image)
             yield Message.Url, url, data
 
@@ -81,14 +82,19 @@ class ImagefapGalleryExtractor(ImagefapExtractor):
             "count": text.parse_int(count),
         }
 
-    def get_images(self):
+    def get_images(self, count=0):
         """Collect image-urls and -metadata"""
         num = 0
-        url = "{}/photo/{}/".format(self.root, self.image_id)
-        params = {"gid": self.gid, "idx": 0, "partial": "true"}
-        while True:
+        # fetch the listing pages covered by the gallery's image count
+        # concurrently and any further ones one by one, until an empty
+        # or partial page marks the end of the gallery
+        ahead = (count + 23) // 24 * 24
+        pages = itertools.chain(
+            self.map_concurrent(self._get_page, range(0, ahead, 24)),
+            map(self._get_page, itertools.count(ahead, 24)),
+        )
+        for page in pages:
             pos = 0
-            page = self.request(url, params=params).text
             for _ in range(24):
                 imgurl, pos = text.extract(page, '<a href="', '"', pos)
                 if not imgurl:
@@ -98,7 +104,12 @@ class ImagefapGalleryExtractor(ImagefapExtractor):
                 data["num"] = num
                 data["image_id"] = text.parse_int(data["filename"])
                 yield imgurl, data
-            params["idx"] += 24
+
+    def _get_page(self, offset):
+        """Fetch the partial image list starting at 'offset'"""
+        url = "{}/photo/{}/".format(self.root, self.image_id)
+        params = {"gid": self.gid, "idx": offset, "partial": "true"}
+        return self.request(url, params=params).text
 
 
 class ImagefapImageExtractor(ImagefapExtractor):
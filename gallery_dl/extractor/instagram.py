@@ -98,7 +98,7 @@ class InstagramExtractor(Extractor):
         kwargs["cookies"] = {
             "csrftoken": self.csrf_token,
         }
-        return self.request(url, **kwargs).json()
+        return self.request_json(url, **kwargs)
 
     def _request_graphql(self, query_hash, variables):
         url = self.root + "/graphql/query/"
@@ -115,9 +115,9 @@ class InstagramExtractor(Extractor):
         cookies = {
             "csrftoken": self.csrf_token,
         }
-        return self.request(
+        return self.request_json(
             url, params=params, headers=headers, cookies=cookies,
-        ).json()["data"]
+        )["data"]
 
     def login(self):
         if not self._check_cookies(self.cookienames):
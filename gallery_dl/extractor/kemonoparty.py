@@ -30,10 +30,11 @@ class KemonopartyExtractor(Extractor):
         self._prepare_ddosguard_cookies()
 
         find_inline = re.compile(r'src="(/inline/[^"]+)').findall
+        find_hash = re.compile(r"/([0-9a-f]{64})\.[^/]+$").search
         skip_service = \
             "patreon" if self.config("patreon-skip-file", True) else None
 
-        if self.config("metadata"):
+        if self.config("metadata") and self.metadata_needed("username"):
             username = text.unescape(text.extract(
                 self.request(self.user_url).text,
                 '<meta name="artist_name" content="', '"')[0])
@@ -74,6 +75,9 @@ class KemonopartyExtractor(Extractor):
                     url = self.root + url
 
                 text.nameext_from_url(file["name"], post)
+                match = find_hash(url)
+                post["_http_hash"] = ("sha256", match.group(1)) \
+                    if match else None
                 yield Message.Url, url, post
 
     def login(self):
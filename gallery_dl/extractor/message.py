@@ -43,6 +43,11 @@ class Message():
     - Message.Urllist:  # obsolete
       - Same as Message.Url, but its 2nd element is a list of multiple URLs
       - The additional URLs serve as a fallback if the primary one fails
+
+    - Message.UrlBatch:
+      - Multiple image URLs and their metadata at once
+      - 2nd element is a list of (URL, metadata-dictionary) pairs
+      - Each pair gets handled the same way as a Message.Url would
     """
 
     Version = 1
@@ -53,3 +58,4 @@ class Message():
     Queue = 6
     #  Urllist = 7
     #  Metadata = 8
+    UrlBatch = 9
@@ -39,14 +39,9 @@ class NewgroundsExtractor(Extractor):
     def items(self):
         self.login()
 
-        for post_url in self.posts():
-            try:
-                post = self.extract_post(post_url)
-                url = post.get("url")
-            except Exception:
-                self.log.debug("", exc_info=True)
-                url = None
-
+        for post_url, post in self.map_concurrent(
+                self._try_extract_post, self.posts()):
+            url = post.get("url") if post else None
             if url:
                 yield Message.Directory, post
                 yield Message.Url, url, text.nameext_from_url(url, post)
@@ -96,6 +91,13 @@ class NewgroundsExtractor(Extractor):
             if cookie.expires and cookie.domain == self.cookiedomain
         }
 
+    def _try_extract_post(self, post_url):
+        try:
+            return post_url, self.extract_post(post_url)
+        except Exception:
+            self.log.debug("", exc_info=True)
+            return post_url, None
+
     def extract_post(self, post_url):
 
         if "/art/view/" in post_url:
@@ -30,18 +30,10 @@ class NozomiExtractor(Extractor):
         self.session.headers["Origin"] = self.root
         self.session.headers["Referer"] = self.root + "/"
 
-        for post_id in map(str, self.posts()):
-            url = "https://j.nozomi.la/post/{}/{}/{}.json".format(
-                post_id[-1], post_id[-3:-1], post_id)
-            response = self.request(url, fatal=False)
-
-            if response.status_code >= 400:
-                self.log.warning(
-                    "Skipping post %s ('%s %s')",
-                    post_id, response.status_code, response.reason)
+        for post in self.map_concurrent(self._fetch_post, self.posts()):
+            if not post:
                 continue
 
-            post = response.json()
             post["tags"] = self._list(post.get("general"))
             post["artist"] = self._list(post.get("artist"))
             post["copyright"] = self._list(post.get("copyright"))
@@ -68,6 +60,20 @@ class NozomiExtractor(Extractor):
                 post["dataid"] = post["filename"]
                 yield Message.Url, url, post
 
+    def _fetch_post(self, post_id):
+        """Return the JSON data of a post or None"""
+        post_id = str(post_id)
+        url = "https://j.nozomi.la/post/{}/{}/{}.json".format(
+            post_id[-1], post_id[-3:-1], post_id)
+        response = self.request(url, fatal=False)
+
+        if response.status_code >= 400:
+            self.log.warning(
+                "Skipping post %s ('%s %s')",
+                post_id, response.status_code, response.reason)
+            return None
+        return response.json()
+
     def posts(self):
         url = "https://n.nozomi.la" + self.nozomi
         offset = (text.parse_int(self.pnum, 1) - 1) * 256
@@ -66,22 +66,29 @@ class PatreonExtractor(Extractor):
         return ()
 
     def _images(self, post):
-        for image in post["images"]:
-            url = image.get("download_url")
-            if url:
-                name = image.get("file_name") or self._filename(url) or url
-                yield "image", url, name
+        images = [image for image in post["images"]
+                  if image.get("download_url")]
+        for image, name in zip(images, self.map_concurrent(
+                self._image_filename, images)):
+            url = image["download_url"]
+            yield "image", url, name or url
 
-    def _attachments(self, post):
-        for attachment in post["attachments"]:
-            url = self.request(
-                attachment["url"], method="HEAD",
-                allow_redirects=False, fatal=False,
-            ).headers.get("Location")
+    def _image_filename(self, image):
+        return image.get("file_name") or \
+            self._filename(image["download_url"])
 
+    def _attachments(self, post):
+        for attachment, url in zip(post["attachments"], self.map_concurrent(
+                self._attachment_url, post["attachments"])):
             if url:
                 yield "attachment", url, attachment["name"]
 
+    def _attachment_url(self, attachment):
+        return self.request(
+            attachment["url"], method="HEAD",
+            allow_redirects=False, fatal=False,
+        ).headers.get("Location")
+
     @staticmethod
     def _content(post):
         content = post.get("content")
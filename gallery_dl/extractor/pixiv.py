@@ -629,7 +629,7 @@ class PixivAppAPI():
             self.log.debug(response.text)
             raise exception.AuthenticationError("Invalid refresh token")
 
-        data = response.json()["response"]
+        data = self.extractor.parse_json(response)["response"]
         return data["user"], "Bearer " + data["access_token"]
 
     def illust_detail(self, illust_id):
@@ -678,7 +678,7 @@ class PixivAppAPI():
 
         self.login()
         response = self.extractor.request(url, params=params, fatal=False)
-        data = response.json()
+        data = self.extractor.parse_json(response)
 
         if "error" in data:
             if response.status_code == 404:
@@ -353,7 +353,7 @@ class RedditAPI():
         response = self.extractor.request(
             url, method="POST", headers=self.headers,
             data=data, auth=(self.client_id, ""), fatal=False)
-        data = response.json()
+        data = self.extractor.parse_json(response)
 
         if response.status_code != 200:
             self.log.debug("Server response: %s", data)
@@ -374,7 +374,7 @@ class RedditAPI():
             return self._call(endpoint, params)
 
         try:
-            data = response.json()
+            data = self.extractor.parse_json(response)
         except ValueError:
             raise exception.StopExtraction(text.remove_html(response.text))
 
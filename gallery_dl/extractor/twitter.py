@@ -779,7 +779,7 @@ class TwitterAPI():
             if csrf_token:
                 self.headers["x-csrf-token"] = csrf_token
 
-            data = response.json()
+            data = self.extractor.parse_json(response)
             if "errors" in data:
                 try:
                     msg = ", ".join(
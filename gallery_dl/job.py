@@ -6,16 +6,20 @@
 # it under the terms of the GNU General Public License version 2 as
 # published by the Free Software Foundation.
 
+import os
 import sys
 import json
 import time
 import errno
 import logging
 import operator
+import threading
 import functools
 import collections
+import concurrent.futures
 from . import extractor, downloader, postprocessor
-from . import config, text, util, output, exception
+from . import config, text, util, output, exception, metrics, profiler
+from . import events
 from .extractor.message import Message
 
 
@@ -34,6 +38,12 @@ class Job():
         self.kwdict = {}
         self.status = 0
         self.url_key = extr.config("url-metadata")
+        # set when the job running this one's parent in a thread pool
+        # gets interrupted
+        self.stop_event = parent.stop_event if parent else None
+        # profile of the job running this one in a thread pool
+        self.profile_parent = None
+        self.profile = None
 
         self._logger_extra = {
             "job"      : self,
@@ -74,24 +84,37 @@ class Job():
 
         sleep = util.build_duration_func(extractor.config("sleep-extractor"))
         if sleep:
-            time.sleep(sleep())
-
+            seconds = sleep()
+            time.sleep(seconds)
+            if metrics.active:
+                metrics.active.count(
+                    "sleep_seconds_total", seconds,
+                    category=extractor.category, reason="extractor")
+
+        started = time.monotonic()
+        profile = self.profile = (profiler.start(self, self.profile_parent)
+                                  if profiler.directory else None)
+        if events.active:
+            events.emit("job-start", self)
         try:
             for msg in extractor:
                 self.dispatch(msg)
         except exception.StopExtraction as exc:
             if exc.message:
                 log.error(exc.message)
+                self._emit_error(exc)
             self.status |= exc.code
-        except exception.TerminateExtraction:
+        except (exception.TerminateExtraction, exception.CoordinatorError):
             raise
         except exception.GalleryDLException as exc:
             log.error("%s: %s", exc.__class__.__name__, exc)
+            self._emit_error(exc)
             self.status |= exc.code
         except OSError as exc:
             log.error("Unable to download data:  %s: %s",
                       exc.__class__.__name__, exc)
             log.debug("", exc_info=True)
+            self._emit_error(exc)
             self.status |= 128
         except Exception as exc:
             log.error(("An unexpected error occurred: %s - %s. "
@@ -100,6 +123,7 @@ class Job():
                        "https://github.com/mikf/gallery-dl/issues ."),
                       exc.__class__.__name__, exc)
             log.debug("", exc_info=True)
+            self._emit_error(exc)
             self.status |= 1
         except BaseException:
             self.status |= 1
@@ -108,14 +132,28 @@ class Job():
             if msg is None:
                 log.info("No results for %s", extractor.url)
         finally:
+            extractor.stop_prefetch()
             self.handle_finalize()
             if extractor.finalize:
                 extractor.finalize()
+            if profile:
+                profile.stop()
+            if metrics.active:
+                metrics.active.observe(
+                    "job_seconds", time.monotonic() - started,
+                    category=extractor.category,
+                    subcategory=extractor.subcategory)
+            if events.active:
+                events.emit("job-end", self, status=self.status,
+                            seconds=time.monotonic() - started)
 
         return self.status
 
     def dispatch(self, msg):
         """Call the appropriate message handler"""
+        if self.stop_event is not None and self.stop_event.is_set():
+            raise exception.TerminateExtraction()
+
         if msg[0] == Message.Url:
             _, url, kwdict = msg
             if self.url_key:
@@ -124,6 +162,9 @@ class Job():
                 self.update_kwdict(kwdict)
                 self.handle_url(url, kwdict)
 
+        elif msg[0] == Message.UrlBatch:
+            self.handle_url_batch(msg[1])
+
         elif msg[0] == Message.Directory:
             self.update_kwdict(msg[1])
             self.handle_directory(msg[1])
@@ -138,6 +179,20 @@ class Job():
     def handle_url(self, url, kwdict):
         """Handle Message.Url"""
 
+    def handle_url_batch(self, items):
+        """Handle Message.UrlBatch"""
+        url_key = self.url_key
+        pred_url = self.pred_url
+        update_kwdict = self.update_kwdict
+        handle_url = self.handle_url
+
+        for url, kwdict in items:
+            if url_key:
+                kwdict[url_key] = url
+            if pred_url(url, kwdict):
+                update_kwdict(kwdict)
+                handle_url(url, kwdict)
+
     def handle_directory(self, kwdict):
         """Handle Message.Directory"""
 
@@ -194,9 +249,45 @@ class Job():
         if self.ulog:
             self.ulog.info(url)
 
+    def _finalize_executor(self, futures):
+        """Wait for all child jobs and shut down their thread pool
+
+        'futures' returns the Futures of all child jobs not yet collected.
+        When this job got terminated or interrupted, running child jobs
+        get told to stop and queued ones get cancelled instead.
+        """
+        if sys.exc_info()[0] is None:
+            try:
+                while self.pending:
+                    self._collect(True)
+            except BaseException:
+                self._stop_children(futures())
+                raise
+            self.executor.shutdown(wait=True)
+        else:
+            self._stop_children(futures())
+
+    def _stop_children(self, futures):
+        self.stop_event.set()
+        for future in futures:
+            future.cancel()
+        if not isinstance(sys.exc_info()[1], KeyboardInterrupt):
+            # running child jobs stop at their next message
+            concurrent.futures.wait(futures)
+        self.executor.shutdown(wait=False)
+
+    def _emit_error(self, exc):
+        if events.active:
+            events.emit("error", self, error=exc.__class__.__name__,
+                        message=str(exc))
+
 
 class DownloadJob(Job):
     """Download images into appropriate directory/filename locations"""
+    visited_lock = threading.Lock()
+    # tell extractors which metadata fields get used;
+    # only enabled for command-line runs by main()
+    prune_metadata = False
 
     def __init__(self, url, parent=None):
         Job.__init__(self, url, parent)
@@ -209,8 +300,53 @@ class DownloadJob(Job):
         self.downloaders = {}
         self.out = output.select()
         self.visited = parent.visited if parent else set()
+        self.journal = None
+        self.journal_entry = None
+        self.executor = None
         self._skipcnt = 0
 
+        # run child jobs in parallel,
+        # unless this job already runs inside a thread pool
+        self.pooled = parent is not None and (
+            parent.pooled or parent.executor is not None)
+        if not self.pooled:
+            concurrency = self.extractor.config("queue-concurrency", 1)
+            if concurrency > 1:
+                if self.extractor.config("parent-skip"):
+                    self.log.debug("Ignoring 'queue-concurrency' "
+                                   "because of 'parent-skip'")
+                else:
+                    self._init_executor(concurrency)
+
+        if self.prune_metadata:
+            try:
+                self.extractor._fields = self._metadata_fields()
+            except Exception as exc:
+                self.log.debug("Unable to determine used metadata fields "
+                               "(%s: %s)", exc.__class__.__name__, exc)
+
+    @classmethod
+    def from_journal(cls, journal, entry):
+        """Create a job for an entry leased from a journal"""
+        _, url, data = entry
+
+        cls_extr = data.get("extractor")
+        extr = cls_extr.from_url(url) if cls_extr else extractor.find(url)
+        if not extr:
+            raise exception.NoExtractorError()
+
+        if data.get("category"):
+            extr._cfgpath, extr.category, extr.subcategory = data["category"]
+        if "parentdir" in data:
+            extr._parentdir = data["parentdir"]
+
+        job = cls(extr)
+        job.journal = journal
+        job.journal_entry = entry
+        if data.get("kwdict"):
+            job.kwdict.update(data["kwdict"])
+        return job
+
     def handle_url(self, url, kwdict):
         """Download the resource specified in 'url'"""
         hooks = self.hooks
@@ -219,6 +355,8 @@ class DownloadJob(Job):
 
         # prepare download
         pathfmt.set_filename(kwdict)
+        if events.active:
+            events.emit("url", self, url=url, path=pathfmt.path)
 
         if "prepare" in hooks:
             for callback in hooks["prepare"]:
@@ -236,13 +374,22 @@ class DownloadJob(Job):
             return
 
         if self.sleep:
-            time.sleep(self.sleep())
+            seconds = self.sleep()
+            time.sleep(seconds)
+            if metrics.active:
+                metrics.active.count(
+                    "sleep_seconds_total", seconds,
+                    category=self.extractor.category, reason="download")
 
         # download from URL
+        started = time.monotonic()
         if not self.download(url):
 
             # use fallback URLs if available/enabled
             fallback = kwdict.get("_fallback", ()) if self.fallback else ()
+            if fallback and "_http_hash" in kwdict:
+                # checksums only apply to the primary URL
+                del kwdict["_http_hash"]
             for num, url in enumerate(fallback, 1):
                 util.remove_file(pathfmt.temppath)
                 self.log.info("Trying fallback URL #%d", num)
@@ -253,6 +400,9 @@ class DownloadJob(Job):
                 self.status |= 4
                 self.log.error("Failed to download %s",
                                pathfmt.filename or url)
+                if events.active:
+                    events.emit("error", self, url=url, path=pathfmt.path,
+                                message="Failed to download")
                 return
 
         if not pathfmt.temppath:
@@ -269,6 +419,13 @@ class DownloadJob(Job):
         # download succeeded
         pathfmt.finalize()
         self.out.success(pathfmt.path, 0)
+        if events.active:
+            try:
+                size = os.stat(pathfmt.realpath).st_size
+            except OSError:
+                size = None
+            events.emit("success", self, url=url, path=pathfmt.path,
+                        size=size, seconds=time.monotonic() - started)
         self._skipcnt = 0
         if archive:
             archive.add(kwdict)
@@ -276,6 +433,36 @@ class DownloadJob(Job):
             for callback in hooks["after"]:
                 callback(pathfmt)
 
+    def handle_url_batch(self, items):
+        if not self.archive or len(items) < 2:
+            return Job.handle_url_batch(self, items)
+
+        # apply predicates to the whole batch first,
+        # then look up all of its archive entries at once
+        url_key = self.url_key
+        pred_url = self.pred_url
+        update_kwdict = self.update_kwdict
+        selected = []
+        stop = None
+
+        try:
+            for url, kwdict in items:
+                if url_key:
+                    kwdict[url_key] = url
+                if pred_url(url, kwdict):
+                    update_kwdict(kwdict)
+                    selected.append((url, kwdict))
+        except (exception.StopExtraction,
+                exception.TerminateExtraction) as exc:
+            stop = exc
+
+        if selected:
+            self.archive.check_batch([kwdict for _, kwdict in selected])
+            for url, kwdict in selected:
+                self.handle_url(url, kwdict)
+        if stop:
+            raise stop
+
     def handle_directory(self, kwdict):
         """Set and create the target directory for downloads"""
         if not self.pathfmt:
@@ -287,9 +474,10 @@ class DownloadJob(Job):
                 callback(self.pathfmt)
 
     def handle_queue(self, url, kwdict):
-        if url in self.visited:
-            return
-        self.visited.add(url)
+        with self.visited_lock:
+            if url in self.visited:
+                return
+            self.visited.add(url)
 
         cls = kwdict.get("_extractor")
         if cls:
@@ -303,7 +491,6 @@ class DownloadJob(Job):
                     extr = None
 
         if extr:
-            job = self.__class__(extr, self)
             pfmt = self.pathfmt
             pextr = self.extractor
 
@@ -312,20 +499,43 @@ class DownloadJob(Job):
             else:
                 extr._parentdir = pextr._parentdir
 
+            pdata = {}
             pmeta = pextr.config("parent-metadata")
             if pmeta:
                 if isinstance(pmeta, str):
                     data = self.kwdict.copy()
                     if kwdict:
                         data.update(kwdict)
-                    job.kwdict[pmeta] = data
+                    pdata[pmeta] = data
                 else:
                     if self.kwdict:
-                        job.kwdict.update(self.kwdict)
+                        pdata.update(self.kwdict)
                     if kwdict:
-                        job.kwdict.update(kwdict)
+                        pdata.update(kwdict)
+
+            if self.journal:
+                # defer child extractors to a separate journal entry
+                self.journal.add(url, {
+                    "config"   : self.journal_entry[2].get("config"),
+                    "extractor": extr.__class__,
+                    "category" : (
+                        (pextr._cfgpath, pextr.category, pextr.subcategory)
+                        if pextr.config("category-transfer",
+                                        pextr.categorytransfer) else None),
+                    "parentdir": extr._parentdir,
+                    "kwdict"   : pdata,
+                }, self.journal_entry[0])
+                return
 
-            if pextr.config("parent-skip"):
+            job = self.__class__(extr, self)
+            if pdata:
+                job.kwdict.update(pdata)
+
+            if self.executor:
+                job.profile_parent = self.profile
+                self.pending.append(self.executor.submit(job.run))
+                self._collect(len(self.pending) >= self.limit)
+            elif pextr.config("parent-skip"):
                 job._skipcnt = self._skipcnt
                 self.status |= job.run()
                 self._skipcnt = job._skipcnt
@@ -335,6 +545,9 @@ class DownloadJob(Job):
             self._write_unsupported(url)
 
     def handle_finalize(self):
+        if self.executor:
+            self._finalize_executor(lambda: list(self.pending))
+
         pathfmt = self.pathfmt
         if self.archive:
             self.archive.close()
@@ -348,6 +561,8 @@ class DownloadJob(Job):
     def handle_skip(self):
         pathfmt = self.pathfmt
         self.out.skip(pathfmt.path)
+        if events.active:
+            events.emit("skip", self, path=pathfmt.path)
         if "skip" in self.hooks:
             for callback in self.hooks["skip"]:
                 callback(pathfmt)
@@ -356,6 +571,94 @@ class DownloadJob(Job):
             if self._skipcnt >= self._skipmax:
                 raise self._skipexc()
 
+    def _metadata_fields(self):
+        """Return the names of all metadata fields used by this job
+
+        Return None if any field might get used, e.g. when writing
+        all metadata to a JSON file or passing it to child extractors.
+        """
+        extr = self.extractor
+        cfg = extr.config
+        if cfg("parent-metadata"):
+            return None
+
+        fields = set()
+        formats = []
+        expressions = []
+
+        for key, default in (("filename", extr.filename_fmt),
+                             ("directory", extr.directory_fmt)):
+            fmt = cfg(key)
+            if fmt is None:
+                fmt = (default,)
+            elif isinstance(fmt, dict):
+                expressions.extend(expr for expr in fmt if expr)
+                values = list(fmt.values())
+                if "" not in fmt:
+                    values.append(default)
+                fmt = values
+            else:
+                fmt = (fmt,)
+            for value in fmt:
+                if isinstance(value, str):
+                    formats.append(value)
+                else:
+                    formats.extend(value)
+
+        archive = cfg("archive")
+        if archive:
+            formats.append(archive)
+            formats.append(cfg("archive-prefix", extr.category))
+            formats.append(cfg("archive-format", extr.archive_fmt))
+
+        for target in ("image", "chapter"):
+            expr = cfg(target + "-filter")
+            if expr:
+                expressions.append(expr)
+
+        postprocessors = extr.config_accumulate("postprocessors")
+        if postprocessors:
+            pp_conf = config.get((), "postprocessor") or {}
+            for pp_dict in postprocessors:
+                if isinstance(pp_dict, str):
+                    pp_dict = pp_conf.get(pp_dict) or {"name": pp_dict}
+                pp_cls = postprocessor.find(pp_dict.get("name"))
+                if not pp_cls:
+                    continue
+                pp_fields = pp_cls.fields(pp_dict)
+                if pp_fields is None:
+                    return None
+                fields.update(pp_fields)
+                if pp_dict.get("filter"):
+                    expressions.append(pp_dict["filter"])
+
+        for fmt in formats:
+            fields.update(util.format_fields(fmt))
+        for expr in expressions:
+            names = util.expression_fields(expr)
+            if names is None:
+                return None
+            fields.update(names)
+        return fields
+
+    def _init_executor(self, concurrency):
+        """Create a thread pool for the child jobs of this job"""
+        self.executor = concurrent.futures.ThreadPoolExecutor(concurrency)
+        self.stop_event = threading.Event()
+        self.pending = collections.deque()
+        self.limit = concurrency * 2
+
+    def _collect(self, wait):
+        """Merge the exit status of finished child jobs"""
+        pending = self.pending
+        if wait:
+            concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in [future for future in pending if future.done()]:
+            pending.remove(future)
+            if not future.cancelled():
+                self.status |= future.result()
+
     def download(self, url):
         """Download 'url'"""
         scheme = url.partition(":")[0]
@@ -410,7 +713,11 @@ class DownloadJob(Job):
             try:
                 if "{" in path:
                     path = util.Formatter(path).format_map(kwdict)
-                self.archive = util.DownloadArchive(path, self.extractor)
+                if self.journal:
+                    self.archive = self.journal.open_archive(
+                        path, self.extractor)
+                else:
+                    self.archive = util.DownloadArchive(path, self.extractor)
             except Exception as exc:
                 self.extractor.log.warning(
                     "Failed to open download archive at '%s' ('%s: %s')",
@@ -438,6 +745,9 @@ class DownloadJob(Job):
             if self.archive:
                 self.archive.check = pathfmt.exists
 
+        if self.archive and metrics.active:
+            metrics.instrument_archive(self.archive, self.extractor.category)
+
         postprocessors = self.extractor.config_accumulate("postprocessors")
         if postprocessors:
             self.hooks = collections.defaultdict(list)
@@ -484,6 +794,16 @@ class DownloadJob(Job):
     def register_hooks(self, hooks, options=None):
         expr = options.get("filter") if options else None
 
+        if metrics.active:
+            category = self.extractor.category
+            name = options.get("name") if options else None
+            hooks = {
+                hook: metrics.instrument_hook(
+                    callback, hook, category,
+                    name or getattr(callback, "__qualname__", ""))
+                for hook, callback in hooks.items()
+            }
+
         if expr:
             condition = util.compile_expression(expr)
             for hook, callback in hooks.items():
@@ -622,19 +942,26 @@ class UrlJob(Job):
     def __init__(self, url, parent=None, depth=1):
         Job.__init__(self, url, parent)
         self.depth = depth
+        self.write = parent.write if parent else self._print
+        self.executor = None
+
         if depth >= self.maxdepth:
             self.handle_queue = self.handle_url
-
-    @staticmethod
-    def handle_url(url, _):
-        print(url)
-
-    @staticmethod
-    def handle_url_fallback(url, kwdict):
-        print(url)
+        elif not parent or not parent.executor:
+            # resolve child URLs in parallel,
+            # unless this job already runs inside a parent's thread pool
+            concurrency = self.extractor.config("queue-concurrency", 1)
+            if concurrency > 1:
+                self._init_executor(concurrency)
+
+    def handle_url(self, url, _):
+        self.write(url)
+
+    def handle_url_fallback(self, url, kwdict):
+        self.write(url)
         if "_fallback" in kwdict:
             for url in kwdict["_fallback"]:
-                print("|", url)
+                self.write("| " + url)
 
     def handle_queue(self, url, kwdict):
         cls = kwdict.get("_extractor")
@@ -643,10 +970,78 @@ class UrlJob(Job):
         else:
             extr = extractor.find(url)
 
-        if extr:
+        if not extr:
+            self._write_unsupported(url)
+        elif self.executor:
+            job = self.__class__(extr, self, self.depth + 1)
+            if self.ordered:
+                # collect output until all previous jobs are finished
+                buffer = []
+                job.write = buffer.append
+            else:
+                buffer = None
+            job.profile_parent = self.profile
+            self.pending.append((self.executor.submit(job.run), buffer))
+            self._collect(len(self.pending) >= self.limit)
+        else:
             self.status |= self.__class__(extr, self, self.depth + 1).run()
+
+    def handle_finalize(self):
+        if self.executor:
+            self._finalize_executor(lambda: [
+                future for future, _ in self.pending if future])
+
+    def _init_executor(self, concurrency):
+        self.executor = concurrent.futures.ThreadPoolExecutor(concurrency)
+        self.stop_event = threading.Event()
+        self.pending = collections.deque()
+        self.limit = concurrency * 4
+        self.ordered = self.extractor.config("queue-ordered", True)
+        self.lock = threading.Lock()
+        self._write = self.write
+        if self.ordered:
+            self.write = self._write_ordered
         else:
-            self._write_unsupported(url)
+            self.write = self._write_locked
+
+    def _collect(self, wait):
+        """Process results of finished child jobs"""
+        pending = self.pending
+
+        if self.ordered:
+            while pending:
+                future, buffer = pending[0]
+                if future:
+                    if not wait and not future.done():
+                        return
+                    self.status |= future.result()
+                    wait = False
+                pending.popleft()
+                for line in buffer:
+                    self._write(line)
+            return
+
+        if wait:
+            concurrent.futures.wait(
+                [future for future, _ in pending],
+                return_when=concurrent.futures.FIRST_COMPLETED)
+        for item in [item for item in pending if item[0].done()]:
+            pending.remove(item)
+            self.status |= item[0].result()
+
+    def _write_ordered(self, line):
+        if self.pending:
+            self.pending.append((None, (line,)))
+        else:
+            self._write(line)
+
+    def _write_locked(self, line):
+        with self.lock:
+            self._write(line)
+
+    @staticmethod
+    def _print(line):
+        print(line)
 
 
 class InfoJob(Job):
@@ -690,15 +1085,23 @@ class DataJob(Job):
         self.file = file
         self.data = []
         self.ascii = config.get(("output",), "ascii", ensure_ascii)
+        self.num_to_str = False
+        self._flushed = 0.0
 
         private = config.get(("output",), "private")
-        self.filter = util.identity if private else util.filter_dict
+        self.filter = dict if private else util.filter_dict
+
+        # write each message as soon as it arrives
+        self.lines = config.interpolate(("output",), "json-lines", False)
+        self.append = self.write_line if self.lines else self.data.append
 
     def run(self):
         sleep = util.build_duration_func(
             self.extractor.config("sleep-extractor"))
         if sleep:
             time.sleep(sleep())
+        self.num_to_str = config.get(("output",), "num-to-str", False)
+        profile = profiler.start(self) if profiler.directory else None
 
         # collect data
         try:
@@ -707,12 +1110,23 @@ class DataJob(Job):
         except exception.StopExtraction:
             pass
         except Exception as exc:
-            self.data.append((exc.__class__.__name__, str(exc)))
+            self.append((exc.__class__.__name__, str(exc)))
         except BaseException:
             pass
+        finally:
+            self.extractor.stop_prefetch()
+            if profile:
+                profile.stop()
+
+        if self.lines:
+            try:
+                self.file.flush()
+            except Exception:
+                pass
+            return 0
 
         # convert numbers to string
-        if config.get(("output",), "num-to-str", False):
+        if self.num_to_str:
             for msg in self.data:
                 util.transform_dict(msg[-1], util.number_to_string)
 
@@ -726,10 +1140,33 @@ class DataJob(Job):
         return 0
 
     def handle_url(self, url, kwdict):
-        self.data.append((Message.Url, url, self.filter(kwdict)))
+        self.append((Message.Url, url, self.filter(kwdict)))
 
     def handle_directory(self, kwdict):
-        self.data.append((Message.Directory, self.filter(kwdict)))
+        self.append((Message.Directory, self.filter(kwdict)))
 
     def handle_queue(self, url, kwdict):
-        self.data.append((Message.Queue, url, self.filter(kwdict)))
+        self.append((Message.Queue, url, self.filter(kwdict)))
+
+    def write_line(self, msg):
+        """Write 'msg' as a single line of JSON"""
+        if self.num_to_str and isinstance(msg[-1], dict):
+            msg = msg[:-1] + (self._numbers_to_string(msg[-1]),)
+        self.file.write(json.dumps(
+            msg, ensure_ascii=self.ascii, default=str, sort_keys=True))
+        self.file.write("\n")
+
+        now = time.monotonic()
+        if now - self._flushed >= 1.0:
+            self._flushed = now
+            self.file.flush()
+
+    @classmethod
+    def _numbers_to_string(cls, kwdict):
+        # copy instead of modifying 'kwdict', which the extractor
+        # might still use
+        return {
+            key: (cls._numbers_to_string(value) if isinstance(value, dict)
+                  else util.number_to_string(value))
+            for key, value in kwdict.items()
+        }
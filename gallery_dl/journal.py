@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2021 Mike Fährmann
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+
+"""Persistent queue of extractor URLs to resume interrupted runs"""
+
+import os
+import json
+import time
+import socket
+import logging
+import sqlite3
+import datetime
+import importlib
+import threading
+from . import config, util, exception, metrics
+
+log = logging.getLogger("journal")
+
+PENDING = 0
+ACTIVE = 1
+DONE = 2
+
+
+class Journal():
+    """SQLite database of URLs waiting to be processed
+
+    Entries get claimed by 'lease()' and stay claimed as long as their
+    owner keeps calling 'renew()'. Entries of a crashed or killed process
+    become available again once their lease expires.
+
+    Entry data gets stored as JSON; see 'dumps()' and 'loads()'.
+    """
+
+    def __init__(self, path, lease_time=600.0):
+        con = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        con.isolation_level = None
+        self.close = con.close
+        self.cursor = con.cursor()
+        self.lock = threading.Lock()
+        self.lease_time = lease_time
+        self.owner = "{}:{}".format(socket.gethostname(), os.getpid())
+        self._renewed = {}
+
+        try:
+            self.cursor.execute("PRAGMA journal_mode=WAL")
+        except sqlite3.OperationalError:
+            pass
+        self.cursor.execute(
+            "CREATE TABLE IF NOT EXISTS queue ("
+            "id INTEGER PRIMARY KEY, "
+            "url TEXT UNIQUE NOT NULL, "
+            "parent INTEGER, "
+            "state INTEGER NOT NULL DEFAULT 0, "
+            "owner TEXT, "
+            "expires REAL NOT NULL DEFAULT 0, "
+            "status INTEGER NOT NULL DEFAULT 0, "
+            "data BLOB)")
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS queue_state ON queue (state, id)")
+        self.reclaim()
+
+    def add(self, url, data=None, parent=None):
+        """Add 'url' to the journal unless it is already part of it
+
+        'data' is either a dict or a string as returned by 'dumps()'.
+        Return True if a new entry was created.
+        """
+        if isinstance(data, str):
+            json.loads(data)  # raise ValueError for invalid data
+        else:
+            data = dumps(data)
+        with self.lock:
+            self.cursor.execute(
+                "INSERT OR IGNORE INTO queue (url, parent, data) "
+                "VALUES (?, ?, ?)", (url, parent, data))
+            return self.cursor.rowcount > 0
+
+    def lease(self, owner=None, raw=False):
+        """Claim the next available entry
+
+        Return an (id, url, data) tuple or None.
+        With 'raw', 'data' is the serialized JSON string.
+        """
+        now = time.time()
+        with self.lock:
+            cursor = self.cursor
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                cursor.execute(
+                    "SELECT id, url, data FROM queue WHERE state=? OR "
+                    "(state=? AND expires<?) ORDER BY id LIMIT 1",
+                    (PENDING, ACTIVE, now))
+                row = cursor.fetchone()
+                if row:
+                    cursor.execute(
+                        "UPDATE queue SET state=?, owner=?, expires=? "
+                        "WHERE id=?",
+                        (ACTIVE, owner or self.owner,
+                         now + self.lease_time, row[0]))
+                cursor.execute("COMMIT")
+            except BaseException:
+                cursor.execute("ROLLBACK")
+                raise
+            if not row:
+                return None
+            self._renewed[row[0]] = now
+        return row[0], row[1], row[2] if raw else loads(row[2])
+
+    def renew(self, entry_id, owner=None):
+        """Extend the lease of an entry claimed by this process"""
+        now = time.time()
+        if now - self._renewed.get(entry_id, 0.0) < self.lease_time / 4:
+            return
+        self._renewed[entry_id] = now
+        with self.lock:
+            self.cursor.execute(
+                "UPDATE queue SET expires=? WHERE id=? AND owner=?",
+                (now + self.lease_time, entry_id, owner or self.owner))
+
+    def finish(self, entry_id, status=0, owner=None):
+        """Mark an entry claimed by 'owner' as completely processed
+
+        Return False if the entry is claimed by someone else.
+        """
+        self._renewed.pop(entry_id, None)
+        with self.lock:
+            self.cursor.execute(
+                "UPDATE queue SET state=?, status=?, expires=0 "
+                "WHERE id=? AND state=? AND owner=?",
+                (DONE, status, entry_id, ACTIVE, owner or self.owner))
+            return self.cursor.rowcount > 0
+
+    def release(self, entry_id, owner=None):
+        """Give up the claim on an entry without finishing it"""
+        self._renewed.pop(entry_id, None)
+        with self.lock:
+            self.cursor.execute(
+                "UPDATE queue SET state=?, owner=NULL, expires=0 "
+                "WHERE id=? AND owner=?",
+                (PENDING, entry_id, owner or self.owner))
+
+    def reclaim(self):
+        """Release entries claimed by no longer running local processes"""
+        if os.name == "nt":
+            return
+        host = socket.gethostname() + ":"
+        with self.lock:
+            self.cursor.execute(
+                "SELECT id, owner FROM queue WHERE state=?", (ACTIVE,))
+            entries = self.cursor.fetchall()
+        for entry_id, owner in entries:
+            if owner and owner.startswith(host):
+                pid = owner[len(host):]
+                if pid.isdecimal() and not _process_alive(int(pid)):
+                    self.release(entry_id, owner)
+
+    def open_archive(self, path, extractor):
+        """Return the download archive at 'path'"""
+        return util.DownloadArchive(path, extractor)
+
+    def count(self, state):
+        """Return the number of entries in 'state'"""
+        with self.lock:
+            self.cursor.execute(
+                "SELECT COUNT(*) FROM queue WHERE state=?", (state,))
+            return self.cursor.fetchone()[0]
+
+
+def run(path, urls, jobtype):
+    """Process 'urls' and all URLs they spawn through the journal at 'path'
+
+    Entries remaining from a previous run get processed as well.
+    """
+    journal = Journal(util.expand_path(path))
+    add_urls(journal, urls)
+    retval = 0
+
+    pending = journal.count(PENDING)
+    if pending:
+        log.debug("%d pending %s in '%s'",
+                  pending, "entry" if pending == 1 else "entries", path)
+
+    try:
+        while True:
+            entry = journal.lease()
+            if not entry:
+                # wait for other processes working on the same journal
+                if not journal.count(ACTIVE):
+                    break
+                time.sleep(2.0)
+                journal.reclaim()
+                continue
+
+            retval |= process(journal, entry, jobtype)
+    finally:
+        journal.close()
+
+    return retval
+
+
+def add_urls(journal, urls):
+    """Add input URLs and their config options to 'journal'"""
+    gconf = []
+    for url in urls:
+        if isinstance(url, util.ExtendedUrl):
+            gconf.extend(url.gconfig)
+            for opts in url.gconfig:
+                config.set(*opts)
+            conf = gconf + url.lconfig
+            url = url.value
+        else:
+            conf = gconf.copy()
+        journal.add(url, {"config": conf})
+
+
+def process(journal, entry, jobtype):
+    """Run a job for a leased journal entry and return its exit status"""
+    entry_id, url, data = entry
+    status = 0
+    try:
+        with Heartbeat(journal, entry_id), \
+                config.apply(data.get("config") or ()):
+            job = jobtype.from_journal(journal, entry)
+            log.debug("Starting %s for '%s'", jobtype.__name__, url)
+            status = job.run()
+    except exception.TerminateExtraction:
+        pass
+    except exception.NoExtractorError:
+        log.error("No suitable extractor found for '%s'", url)
+        status = 64
+    except BaseException:
+        journal.release(entry_id)
+        raise
+    journal.finish(entry_id, status)
+    metrics.write()
+    return status
+
+
+class Heartbeat():
+    """Periodically renew the lease of an entry from a background thread
+
+    Keeps entries claimed while a single download or extractor request
+    takes longer than the journal's lease time.
+    """
+
+    def __init__(self, journal, entry_id):
+        self.journal = journal
+        self.entry_id = entry_id
+        self.event = threading.Event()
+
+    def __enter__(self):
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.event.set()
+
+    def run(self):
+        interval = self.journal.lease_time / 4
+        while not self.event.wait(interval):
+            try:
+                self.journal.renew(self.entry_id)
+            except Exception as exc:
+                log.warning("Failed to renew lease of entry %s (%s: %s)",
+                            self.entry_id, exc.__class__.__name__, exc)
+
+
+def dumps(data):
+    """Serialize the data of a journal entry to a JSON string
+
+    Extractor classes get stored by name, private and non-serializable
+    metadata values get dropped or converted to strings.
+    """
+    if not data:
+        return None
+    data = data.copy()
+    cls = data.get("extractor")
+    if isinstance(cls, type):
+        data["extractor"] = "{}:{}".format(cls.__module__, cls.__qualname__)
+    if data.get("kwdict"):
+        data["kwdict"] = util.filter_dict(data["kwdict"])
+    return json.dumps(data, default=_encode, separators=(",", ":"))
+
+
+def loads(data):
+    """Deserialize the JSON string of a journal entry"""
+    if not data:
+        return {}
+    if isinstance(data, bytes):
+        log.warning("Ignoring entry data in unsupported format "
+                    "(written by an older version of gallery-dl)")
+        return {}
+    data = json.loads(data, object_hook=_decode)
+    if data.get("extractor"):
+        data["extractor"] = import_extractor(data["extractor"])
+    return data
+
+
+def import_extractor(name):
+    """Return the extractor class for a 'module:qualname' string"""
+    from .extractor.common import Extractor
+
+    module, _, qualname = name.partition(":")
+    cls = importlib.import_module(module)
+    for attr in qualname.split("."):
+        cls = getattr(cls, attr)
+    if not (isinstance(cls, type) and issubclass(cls, Extractor)):
+        raise ValueError("'{}' is not an extractor class".format(name))
+    return cls
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+def _encode(obj):
+    if isinstance(obj, datetime.datetime):
+        if obj.tzinfo:
+            obj = (obj - obj.utcoffset()).replace(tzinfo=None)
+        return {"$datetime": obj.strftime("%Y-%m-%dT%H:%M:%S.%f")}
+    return str(obj)
+
+
+def _decode(obj):
+    if len(obj) == 1 and "$datetime" in obj:
+        return datetime.datetime.strptime(
+            obj["$datetime"], "%Y-%m-%dT%H:%M:%S.%f")
+    return obj
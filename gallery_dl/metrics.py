@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2021 Mike Fährmann
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+
+"""Collect counters and timing histograms of a gallery-dl run"""
+
+import os
+import time
+import json
+import bisect
+import functools
+import threading
+import logging
+import urllib.parse
+from . import config, util
+
+log = logging.getLogger("metrics")
+# Registry instance while metrics collection is enabled
+active = None
+
+# upper bounds of histogram buckets in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+class Histogram():
+    """Distribution of observed values"""
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """Return (upper bound, cumulative count) pairs"""
+        result = []
+        total = 0
+        for bound, count in zip(BUCKETS + ("+Inf",), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class Registry():
+    """Thread-safe collection of labelled counters and histograms"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.started = time.time()
+
+    def count(self, name, value=1, **labels):
+        """Add 'value' to counter 'name'"""
+        key = (name, tuple(labels.items()))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """Add 'value' to histogram 'name'"""
+        key = (name, tuple(labels.items()))
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram()
+            hist.observe(value)
+
+    def as_dict(self):
+        """Return all metrics as JSON-serializable dict"""
+        with self.lock:
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self.counters.items())
+            ]
+            histograms = [
+                {"name": name, "labels": dict(labels),
+                 "count": hist.count, "sum": hist.sum,
+                 "buckets": {str(bound): count
+                             for bound, count in hist.cumulative()}}
+                for (name, labels), hist in sorted(
+                    self.histograms.items(), key=lambda x: x[0])
+            ]
+        return {
+            "started"   : self.started,
+            "duration"  : time.time() - self.started,
+            "counters"  : counters,
+            "histograms": histograms,
+        }
+
+    def as_prometheus(self, prefix="gallerydl_"):
+        """Return all metrics in Prometheus' text exposition format"""
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(
+                self.histograms.items(), key=lambda x: x[0])
+
+            previous = None
+            for (name, labels), value in counters:
+                name = prefix + name
+                if name != previous:
+                    lines.append("# TYPE {} counter".format(name))
+                    previous = name
+                lines.append("{}{} {}".format(
+                    name, _format_labels(labels), value))
+
+            for (name, labels), hist in histograms:
+                name = prefix + name
+                if name != previous:
+                    lines.append("# TYPE {} histogram".format(name))
+                    previous = name
+                for bound, count in hist.cumulative():
+                    lines.append("{}_bucket{} {}".format(
+                        name, _format_labels(labels + (("le", bound),)),
+                        count))
+                lines.append("{}_sum{} {}".format(
+                    name, _format_labels(labels), hist.sum))
+                lines.append("{}_count{} {}".format(
+                    name, _format_labels(labels), hist.count))
+
+        lines.append("")
+        return "\n".join(lines)
+
+
+def initialize():
+    """Enable metrics collection if an output file is configured"""
+    global active
+    if config.interpolate(("output",), "metrics") or \
+            config.interpolate(("output",), "metrics-prometheus"):
+        if active is None:
+            active = Registry()
+    return active
+
+
+def write():
+    """Write collected metrics to all configured output files"""
+    if active is None:
+        return
+
+    path = config.interpolate(("output",), "metrics")
+    if path:
+        _write_atomic(path, json.dumps(active.as_dict(), indent=4))
+
+    path = config.interpolate(("output",), "metrics-prometheus")
+    if path:
+        _write_atomic(path, active.as_prometheus())
+
+
+def _write_atomic(path, content):
+    path = util.expand_path(path)
+    temp = path + ".tmp"
+    try:
+        with open(temp, "w", encoding="utf-8") as fp:
+            fp.write(content)
+        os.replace(temp, path)
+    except OSError as exc:
+        log.warning("Unable to write metrics to '%s' (%s: %s)",
+                    path, exc.__class__.__name__, exc)
+
+
+def hostname(url):
+    """Return the lowercase hostname of 'url'"""
+    return urllib.parse.urlsplit(url).hostname or ""
+
+
+def instrument_archive(archive, category):
+    """Record timings and hit rate of a DownloadArchive"""
+    check = archive.check
+    add = archive.add
+
+    def check_metrics(kwdict):
+        start = time.monotonic()
+        result = check(kwdict)
+        active.observe("archive_seconds", time.monotonic() - start,
+                       category=category, operation="check")
+        active.count("archive_checks_total", 1, category=category,
+                     result="hit" if result else "miss")
+        return result
+
+    def add_metrics(kwdict):
+        start = time.monotonic()
+        add(kwdict)
+        active.observe("archive_seconds", time.monotonic() - start,
+                       category=category, operation="add")
+
+    archive.check = check_metrics
+    archive.add = add_metrics
+
+
+def instrument_hook(callback, event, category, name):
+    """Record execution time of a post-processor hook"""
+    @functools.wraps(callback)
+    def wrap(*args):
+        start = time.monotonic()
+        try:
+            callback(*args)
+        finally:
+            active.observe(
+                "postprocessor_seconds", time.monotonic() - start,
+                category=category, postprocessor=name, event=event)
+    return wrap
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(
+        '{}="{}"'.format(key, str(value).replace("\\", "\\\\")
+                         .replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    ) + "}"
@@ -102,6 +102,59 @@ def build_parser():
         help=("Download URLs found in FILE ('-' for stdin). "
               "More than one --input-file can be specified"),
     )
+    general.add_argument(
+        "--shard",
+        dest="shard", metavar="K/N",
+        help=("Only process the K-th of N deterministic partitions "
+              "of all input URLs (e.g. 2/4)"),
+    )
+    general.add_argument(
+        "--shard-key",
+        dest="shard_key", metavar="KEY", default="url",
+        choices=("url", "host", "category"),
+        help=("Assign URLs to --shard partitions by 'url' (default), "
+              "'host', or 'category'"),
+    )
+    general.add_argument(
+        "--journal",
+        dest="journal", metavar="FILE",
+        help=("Record queued URLs in FILE to be able to continue "
+              "an interrupted run with --resume"),
+    )
+    general.add_argument(
+        "--resume",
+        dest="resume", metavar="FILE",
+        help="Continue processing the URLs recorded in journal FILE",
+    )
+    general.add_argument(
+        "--serve",
+        dest="serve", metavar="ADDRESS",
+        help=("Keep running and accept jobs over HTTP on ADDRESS "
+              "(HOST:PORT on localhost, which requires 'server.token', "
+              "or the path of a UNIX socket)"),
+    )
+    general.add_argument(
+        "--serve-workers",
+        dest="serve_workers", metavar="N", type=int, default=4,
+        help="Number of jobs to run in parallel with --serve (default: 4)",
+    )
+    general.add_argument(
+        "--coordinate",
+        dest="coordinate", metavar="ADDRESS",
+        help=("Distribute all URLs to worker processes leasing them "
+              "over HTTP from ADDRESS (HOST:PORT)"),
+    )
+    general.add_argument(
+        "--coordinate-workers",
+        dest="coordinate_workers", metavar="N", type=int, default=4,
+        help=("Number of local worker processes to start "
+              "with --coordinate (default: 4)"),
+    )
+    general.add_argument(
+        "--worker",
+        dest="worker", metavar="URL",
+        help="Process URLs leased from the coordinator at URL",
+    )
     general.add_argument(
         "--cookies",
         dest="cookies", metavar="FILE", action=ConfigAction,
@@ -142,11 +195,23 @@ def build_parser():
         dest="list_urls", action="store_const", const=128,
         help="Print URLs instead of downloading; resolve intermediary URLs",
     )
+    output.add_argument(
+        "--unordered",
+        dest="queue-ordered", nargs=0, action=ConfigConstAction, const=False,
+        help=("Print URLs resolved in parallel as soon as they are "
+              "available instead of in their original order"),
+    )
     output.add_argument(
         "-j", "--dump-json",
         dest="jobtype", action="store_const", const=job.DataJob,
         help="Print JSON information",
     )
+    output.add_argument(
+        "--json-lines",
+        dest="json-lines", nargs=0, action=ConfigConstAction, const=True,
+        help=("Print each result as a single line of JSON "
+              "as soon as it is available (with --dump-json)"),
+    )
     output.add_argument(
         "-s", "--simulate",
         dest="jobtype", action="store_const", const=job.SimulationJob,
@@ -185,6 +250,30 @@ def build_parser():
         help=("Write URLs, which get emitted by other extractors but cannot "
               "be handled, to FILE"),
     )
+    output.add_argument(
+        "--write-events",
+        dest="events", metavar="FILE", action=ConfigAction,
+        help=("Write job, download, and error events "
+              "as JSON Lines to FILE"),
+    )
+    output.add_argument(
+        "--write-metrics",
+        dest="metrics", metavar="FILE", action=ConfigAction,
+        help=("Write request, download, and post-processing "
+              "statistics to FILE"),
+    )
+    output.add_argument(
+        "--profile",
+        dest="profile", metavar="DIR", action=ConfigAction,
+        help="Write execution profiles of all jobs to DIR",
+    )
+    output.add_argument(
+        "--profile-sample",
+        dest="profile-mode", nargs=0, action=ConfigConstAction,
+        const="sample",
+        help=("Use a low-overhead sampling profiler "
+              "instead of cProfile for --profile"),
+    )
     output.add_argument(
         "--write-pages",
         dest="write-pages", nargs=0, action=ConfigConstAction, const=True,
@@ -198,6 +287,18 @@ def build_parser():
         dest="rate", metavar="RATE", action=ConfigAction,
         help="Maximum download rate (e.g. 500k or 2.5M)",
     )
+    downloader.add_argument(
+        "--limit-rate-global",
+        dest="rate-global", metavar="RATE", action=ConfigAction,
+        help=("Maximum combined download rate "
+              "of all concurrent downloads (e.g. 2M)"),
+    )
+    downloader.add_argument(
+        "--queue-concurrency",
+        dest="queue-concurrency", metavar="N", type=int, action=ConfigAction,
+        help=("Run up to N child extractors (chapters, galleries, etc.) "
+              "in parallel"),
+    )
     downloader.add_argument(
         "-R", "--retries",
         dest="retries", metavar="N", type=int, action=ConfigAction,
@@ -7,9 +7,16 @@
 # published by the Free Software Foundation.
 
 import os
+import re
 import sys
+import copy
+import time
+import queue
+import atexit
 import shutil
 import logging
+import logging.handlers
+import threading
 import unicodedata
 from . import config, util
 
@@ -85,16 +92,112 @@ class KwdictProxy():
         return pathfmt.kwdict.get(name) if pathfmt else None
 
 
+class ProxySnapshot():
+    """Copy of the values behind a PathfmtProxy or KwdictProxy"""
+    __slots__ = ("data",)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __getattribute__(self, name):
+        return object.__getattribute__(self, "data").get(name)
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """Pass log records to a background thread
+
+    Proxies of a record get replaced with snapshots of their current
+    values, since the job they refer to keeps changing them.
+    'fields' maps "path" and "keywords" to the names of the values
+    to copy, or to None for all of them. Proxies not listed in 'fields'
+    become empty snapshots. Without 'fields', all values get copied.
+    """
+
+    def __init__(self, queue, fields=None):
+        logging.handlers.QueueHandler.__init__(self, queue)
+        self.fields = fields
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = _formatter.formatException(record.exc_info)
+            record.exc_info = None
+
+        data = record.__dict__
+        path = data.get("path")
+        if type(path) is PathfmtProxy:
+            pathfmt = object.__getattribute__(path, "job").pathfmt
+            record.path = self._snapshot(
+                "path", pathfmt.__dict__ if pathfmt else None)
+        keywords = data.get("keywords")
+        if type(keywords) is KwdictProxy:
+            pathfmt = object.__getattribute__(keywords, "job").pathfmt
+            record.keywords = self._snapshot(
+                "keywords", pathfmt.kwdict if pathfmt else None)
+        return record
+
+    def _snapshot(self, proxy, values):
+        if not values:
+            return ProxySnapshot({})
+        if self.fields is None:
+            return ProxySnapshot(values.copy())
+        if proxy not in self.fields:
+            return ProxySnapshot({})
+        names = self.fields[proxy]
+        if names is None:
+            return ProxySnapshot(values.copy())
+        return ProxySnapshot({name: values.get(name) for name in names})
+
+
+def queue_handler(handler):
+    """Return a handler passing records to 'handler' in a background thread"""
+    records = queue.Queue()
+    listener = logging.handlers.QueueListener(records, handler)
+    listener.start()
+    atexit.register(listener.stop)
+
+    fields = getattr(handler.formatter, "fields", None)
+    qhandler = QueueHandler(records, fields)
+    qhandler.setLevel(handler.level)
+    return qhandler
+
+
+def proxy_fields(formats):
+    """Return the 'path' and 'keywords' values used by format strings
+
+    The result maps each referenced proxy name to a set of
+    value names, or to None if the proxy itself gets formatted.
+    """
+    fields = {}
+    for fmt in formats:
+        if not isinstance(fmt, str):
+            continue
+        for proxy, name in _PROXY_FIELD_RE.findall(fmt):
+            if not name:
+                fields[proxy] = None
+            elif fields.get(proxy, ()) is not None:
+                fields.setdefault(proxy, set()).add(name)
+    return fields
+
+
+_PROXY_FIELD_RE = re.compile(r"\{(path|keywords)(?:\.(\w+))?")
+
+
 class Formatter(logging.Formatter):
     """Custom formatter that supports different formats per loglevel"""
 
     def __init__(self, fmt, datefmt):
         if isinstance(fmt, dict):
+            self.fields = proxy_fields(fmt.values())
             for key in ("debug", "info", "warning", "error"):
                 value = fmt[key] if key in fmt else LOG_FORMAT
                 fmt[key] = (util.Formatter(value).format_map,
                             "{asctime" in value)
         else:
+            self.fields = proxy_fields((fmt,))
             if fmt == LOG_FORMAT:
                 fmt = (fmt.format_map, False)
             else:
@@ -171,7 +274,7 @@ def configure_logging(loglevel):
     root.setLevel(minlevel)
 
 
-def setup_logging_handler(key, fmt=LOG_FORMAT, lvl=LOG_LEVEL):
+def setup_logging_handler(key, fmt=LOG_FORMAT, lvl=LOG_LEVEL, formatter=None):
     """Setup a new logging handler"""
     opts = config.interpolate(("output",), key)
     if not opts:
@@ -195,10 +298,12 @@ def setup_logging_handler(key, fmt=LOG_FORMAT, lvl=LOG_LEVEL):
         return None
 
     handler.setLevel(opts.get("level", lvl))
-    handler.setFormatter(Formatter(
+    handler.setFormatter(formatter or Formatter(
         opts.get("format", fmt),
         opts.get("format-date", LOG_FORMAT_DATE),
     ))
+    if config.get(("output",), "log-async"):
+        return queue_handler(handler)
     return handler
 
 
@@ -258,50 +363,199 @@ class NullOutput():
     def success(self, path, tries):
         """Print a message indicating the completion of a download"""
 
+    def progress(self, path, bytes_total, bytes_downloaded, bytes_per_second):
+        """Update the progress indicator of the current download"""
+
+    def progress_end(self):
+        """Remove the progress indicator of the current download"""
+
 
 class PipeOutput(NullOutput):
 
+    def __init__(self):
+        self._next = 0.0
+
     def skip(self, path):
         print(CHAR_SKIP, path, sep="", flush=True)
 
     def success(self, path, tries):
         print(path, flush=True)
 
+    def progress(self, path, bytes_total, bytes_downloaded, bytes_per_second):
+        # keep stdout clean and only print one summary every few seconds
+        now = time.monotonic()
+        if now < self._next:
+            return
+        self._next = now + PROGRESS_INTERVAL_PIPE
+        sys.stderr.write("{}: {}\n".format(path, format_progress(
+            bytes_total, bytes_downloaded, bytes_per_second)))
+
+    def progress_end(self):
+        self._next = 0.0
+
 
 class TerminalOutput(NullOutput):
 
     def __init__(self):
         shorten = config.get(("output",), "shorten", True)
+        self.width = shutil.get_terminal_size().columns - OFFSET
         if shorten:
             func = shorten_string_eaw if shorten == "eaw" else shorten_string
-            limit = shutil.get_terminal_size().columns - OFFSET
+            limit = self.width
             sep = CHAR_ELLIPSIES
             self.shorten = lambda txt: func(txt, limit, sep)
         else:
             self.shorten = util.identity
+        self.board = _progress_board(self.__class__ is ColorOutput)
 
     def start(self, path):
+        self.board.clear()
         print(self.shorten("  " + path), end="", flush=True)
 
     def skip(self, path):
+        self.board.clear()
         print(self.shorten(CHAR_SKIP + path))
 
     def success(self, path, tries):
+        self.board.clear()
         print("\r", self.shorten(CHAR_SUCCESS + path), sep="")
 
+    def progress(self, path, bytes_total, bytes_downloaded, bytes_per_second):
+        self.board.update(id(self), (
+            path, bytes_total, bytes_downloaded, bytes_per_second),
+            self.width)
+
+    def progress_end(self):
+        self.board.remove(id(self))
+
 
 class ColorOutput(TerminalOutput):
 
     def start(self, path):
+        self.board.clear()
         print(self.shorten(path), end="", flush=True)
 
     def skip(self, path):
+        self.board.clear()
         print("\033[2m", self.shorten(path), "\033[0m", sep="")
 
     def success(self, path, tries):
+        self.board.clear()
         print("\r\033[1;32m", self.shorten(path), "\033[0m", sep="")
 
 
+class ProgressBoard():
+    """Live view of all running downloads of this process
+
+    With ANSI escape sequences, every download gets its own line and the
+    cursor stays at the first of them, so that regular output overwrites
+    the board. Otherwise, a single line shows either the only running
+    download or a summary of all of them.
+
+    Drawing happens at most once every PROGRESS_INTERVAL seconds.
+    """
+
+    def __init__(self, ansi, stream=None):
+        self.ansi = ansi
+        self.stream = stream
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.drawn = 0
+        self.last = 0.0
+
+    def update(self, key, entry, width=80):
+        with self.lock:
+            self.entries[key] = entry
+            now = time.monotonic()
+            if now - self.last < PROGRESS_INTERVAL:
+                return
+            self.last = now
+            self._draw(width)
+
+    def remove(self, key):
+        with self.lock:
+            if self.entries.pop(key, None) is not None:
+                self._clear()
+
+    def clear(self):
+        """Erase the board to make room for regular output"""
+        if self.drawn:
+            with self.lock:
+                self._clear()
+
+    def _draw(self, width):
+        write = (self.stream or sys.stdout).write
+        entries = list(self.entries.values())
+
+        if self.ansi:
+            lines = [_progress_line(*entry, width=width) for entry in entries]
+            write("\r\033[J" + "\n".join(lines))
+            if len(lines) > 1:
+                write("\033[{}A".format(len(lines) - 1))
+            write("\r")
+            self.drawn = len(lines)
+        else:
+            if len(entries) == 1:
+                line = _progress_line(*entries[0], width=width)
+            else:
+                totals = [entry[1] for entry in entries]
+                line = "{} downloads  {}".format(len(entries), format_progress(
+                    sum(totals) if all(totals) else None,
+                    sum(entry[2] for entry in entries),
+                    sum(entry[3] for entry in entries),
+                ))[:width]
+            write("\r" + line.ljust(self.drawn))
+            self.drawn = len(line)
+        (self.stream or sys.stdout).flush()
+
+    def _clear(self):
+        if not self.drawn:
+            return
+        stream = self.stream or sys.stdout
+        if self.ansi:
+            stream.write("\r\033[J")
+        else:
+            stream.write("\r" + " " * self.drawn + "\r")
+        stream.flush()
+        self.drawn = 0
+
+
+def _progress_board(ansi, boards={}):
+    board = boards.get(ansi)
+    if board is None:
+        board = boards[ansi] = ProgressBoard(ansi)
+    return board
+
+
+def _progress_line(path, bytes_total, bytes_downloaded, bytes_per_second,
+                   width=80):
+    progress = format_progress(bytes_total, bytes_downloaded, bytes_per_second)
+    limit = width - len(progress) - 2
+    if limit < 10:
+        return progress[:width]
+    return shorten_string(path, limit, CHAR_ELLIPSIES).ljust(limit) + \
+        "  " + progress
+
+
+def format_progress(bytes_total, bytes_downloaded, bytes_per_second):
+    """Return percentage, size, rate, and remaining time as string"""
+    bdl = util.format_value(bytes_downloaded)
+    bps = util.format_value(bytes_per_second) + "/s"
+    if not bytes_total:
+        return "{:>8} {:>10}".format(bdl, bps)
+
+    if bytes_per_second:
+        seconds = int((bytes_total - bytes_downloaded) / bytes_per_second)
+        minutes, seconds = divmod(seconds, 60)
+        hours, minutes = divmod(minutes, 60)
+        eta = "{}:{:02}:{:02}".format(hours, minutes, seconds)
+    else:
+        eta = "-:--:--"
+    return "{:>3}% {:>8}/{} {:>10} ETA {}".format(
+        bytes_downloaded * 100 // bytes_total, bdl,
+        util.format_value(bytes_total), bps, eta)
+
+
 class EAWCache(dict):
 
     def __missing__(self, key):
@@ -352,6 +606,11 @@ def shorten_string_eaw(txt, limit, sep="…", cache=EAWCache()):
     return txt[:left] + sep + txt[right+1:]
 
 
+_formatter = logging.Formatter()
+
+PROGRESS_INTERVAL = 0.2
+PROGRESS_INTERVAL_PIPE = 10.0
+
 if util.WINDOWS:
     ANSI = os.environ.get("TERM") == "ANSI"
     OFFSET = 1
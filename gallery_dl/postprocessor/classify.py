@@ -34,6 +34,10 @@ class ClassifyPP(PostProcessor):
         job.register_hooks(
             {"prepare": self.prepare, "file": self.move}, options)
 
+    @staticmethod
+    def fields(options):
+        return ()
+
     def prepare(self, pathfmt):
         ext = pathfmt.extension
         if ext in self.mapping:
@@ -18,3 +18,11 @@ class PostProcessor():
 
     def __repr__(self):
         return self.__class__.__name__
+
+    @staticmethod
+    def fields(options):
+        """Return the names of all metadata fields used with 'options'
+
+        Return None if any field might get used.
+        """
+        return None
@@ -25,6 +25,10 @@ class ComparePP(PostProcessor):
             self.compare
         )}, options)
 
+    @staticmethod
+    def fields(options):
+        return ()
+
     def compare(self, pathfmt):
         try:
             if self._compare(pathfmt.realpath, pathfmt.temppath):
@@ -43,6 +43,16 @@ class ExecPP(PostProcessor):
             events = events.split(",")
         job.register_hooks({event: execute for event in events}, options)
 
+    @staticmethod
+    def fields(options):
+        args = options["command"]
+        if isinstance(args, str):
+            return ()
+        fields = set()
+        for arg in args:
+            fields.update(util.format_fields(arg))
+        return fields
+
     def exec_list(self, pathfmt, status=None):
         if status:
             return
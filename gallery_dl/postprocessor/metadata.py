@@ -59,6 +59,25 @@ class MetadataPP(PostProcessor):
             events = events.split(",")
         job.register_hooks({event: self.run for event in events}, options)
 
+    @staticmethod
+    def fields(options):
+        mode = options.get("mode", "json")
+        if mode == "custom":
+            cfmt = options.get("content-format") or options.get("format")
+            if isinstance(cfmt, list):
+                cfmt = "\n".join(cfmt)
+            fields = util.format_fields(cfmt)
+        elif mode == "tags":
+            fields = {"tags", "tag_string"}
+        else:
+            return None
+
+        for key in ("filename", "extension-format"):
+            fmt = options.get(key)
+            if fmt:
+                fields.update(util.format_fields(fmt))
+        return fields
+
     def run(self, pathfmt):
         directory = self._directory(pathfmt)
         path = directory + self._filename(pathfmt)
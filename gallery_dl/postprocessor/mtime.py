@@ -19,6 +19,10 @@ class MtimePP(PostProcessor):
         self.key = options.get("key", "date")
         job.register_hooks({"file": self.run}, options)
 
+    @staticmethod
+    def fields(options):
+        return (options.get("key", "date"),)
+
     def run(self, pathfmt):
         mtime = pathfmt.kwdict.get(self.key)
         ts = getattr(mtime, "timestamp", None)
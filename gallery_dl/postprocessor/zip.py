@@ -44,6 +44,10 @@ class ZipPP(PostProcessor):
         }, options)
         job.hooks["finalize"].append(self.finalize)
 
+    @staticmethod
+    def fields(options):
+        return ()
+
     def write(self, pathfmt, zfile=None):
         # 'NameToInfo' is not officially documented, but it's available
         # for all supported Python versions and using it directly is a lot
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2021 Mike Fährmann
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+
+"""Profile individual jobs with cProfile or a sampling profiler"""
+
+import os
+import sys
+import time
+import json
+import pstats
+import cProfile
+import logging
+import itertools
+import threading
+import collections
+from . import config, util
+
+log = logging.getLogger("profile")
+
+# output directory while profiling is enabled
+directory = None
+mode = "cprofile"
+interval = 0.005
+
+_local = threading.local()
+_lock = threading.Lock()
+_counter = itertools.count(1)
+
+
+def initialize():
+    """Enable profiling if an output directory is configured"""
+    global directory, mode, interval
+    path = config.interpolate(("output",), "profile")
+    if not path:
+        return None
+
+    directory = util.expand_path(path)
+    os.makedirs(directory, exist_ok=True)
+    mode = config.interpolate(("output",), "profile-mode", "cprofile")
+    interval = config.interpolate(("output",), "profile-interval", 0.005)
+    if mode not in ("cprofile", "sample"):
+        log.warning("Invalid profile mode '%s'", mode)
+        mode = "cprofile"
+    return directory
+
+
+def start(job, parent=None):
+    """Start profiling 'job' in the current thread
+
+    'parent' is the profile of the job that started 'job' in another
+    thread. Without it, the innermost profile of the current thread
+    becomes the parent and gets paused until 'job' finishes.
+    """
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+
+    nested = parent is None and bool(stack)
+    if nested:
+        parent = stack[-1]
+        parent.pause()
+
+    cls = SamplingProfile if mode == "sample" else DeterministicProfile
+    profile = cls(job, parent)
+    profile.nested = nested
+    stack.append(profile)
+    profile.resume()
+    return profile
+
+
+class Profile():
+    """Profile of a single Job.run() call"""
+
+    def __init__(self, job, parent):
+        extr = job.extractor
+        self.id = next(_counter)
+        self.parent = parent
+        self.category = extr.category
+        self.subcategory = extr.subcategory
+        self.url = extr.url
+        self.label = "job {}/{}".format(extr.category, extr.subcategory)
+        self.prefix = (parent.prefix + ";" if parent else "") + self.label
+        self.name = "{:04}_{}_{}".format(
+            self.id, extr.category, extr.subcategory or "")
+        self.started = time.monotonic()
+        self.nested = False
+
+    def stop(self):
+        """Stop profiling and write results to disk"""
+        self.pause()
+        duration = time.monotonic() - self.started
+        stack = _local.stack
+        if stack and stack[-1] is self:
+            stack.pop()
+
+        path = os.path.join(directory, self.name)
+        files = []
+        try:
+            files = self.write(path)
+        except OSError as exc:
+            log.warning("Unable to write profile '%s' (%s: %s)",
+                        path, exc.__class__.__name__, exc)
+
+        entry = {
+            "id"         : self.id,
+            "parent"     : self.parent.id if self.parent else None,
+            "category"   : self.category,
+            "subcategory": self.subcategory,
+            "url"        : self.url,
+            "seconds"    : duration,
+            "mode"       : mode,
+            "files"      : files,
+        }
+        path = os.path.join(directory, "index.jsonl")
+        try:
+            with _lock, open(path, "a", encoding="utf-8") as fp:
+                fp.write(json.dumps(entry) + "\n")
+        except OSError as exc:
+            log.warning("Unable to update profile index '%s' (%s: %s)",
+                        path, exc.__class__.__name__, exc)
+
+        if self.nested:
+            self.parent.resume()
+
+    def pause(self):
+        """Temporarily stop collecting data, e.g. while a child job runs"""
+
+    def resume(self):
+        """Continue collecting data"""
+
+    def write(self, path):
+        """Write profiling results to files starting with 'path'"""
+        return []
+
+    def _write_collapsed(self, path, stacks):
+        path += ".collapsed"
+        with open(path, "w", encoding="utf-8") as fp:
+            for stack, value in stacks.items():
+                if value:
+                    fp.write("{};{} {}\n".format(self.prefix, stack, value))
+        return path
+
+
+class DeterministicProfile(Profile):
+    """Profile a job with cProfile"""
+
+    def __init__(self, job, parent):
+        Profile.__init__(self, job, parent)
+        self.profile = cProfile.Profile()
+
+    def pause(self):
+        self.profile.disable()
+
+    def resume(self):
+        self.profile.enable()
+
+    def write(self, path):
+        stats = pstats.Stats(self.profile)
+        stats.dump_stats(path + ".pstats")
+        return [path + ".pstats",
+                self._write_collapsed(path, collapse_stats(stats.stats))]
+
+
+class SamplingProfile(Profile):
+    """Profile a job by periodically sampling its call stack"""
+
+    def __init__(self, job, parent):
+        Profile.__init__(self, job, parent)
+        self.stacks = collections.Counter()
+        self.thread_id = threading.get_ident()
+        self.root = sys._getframe(2)
+        self.event = threading.Event()
+        self.active = False
+        self.thread = threading.Thread(target=self._sample, daemon=True)
+        self.thread.start()
+
+    def pause(self):
+        self.active = False
+
+    def resume(self):
+        self.active = True
+
+    def stop(self):
+        self.event.set()
+        self.thread.join()
+        Profile.stop(self)
+
+    def write(self, path):
+        return [self._write_collapsed(path, self.stacks)]
+
+    def _sample(self):
+        wait = self.event.wait
+        current_frames = sys._current_frames
+        root = self.root
+        thread_id = self.thread_id
+        stacks = self.stacks
+
+        while not wait(interval):
+            if not self.active:
+                continue
+            frame = current_frames().get(thread_id)
+            names = []
+            while frame is not None and frame is not root:
+                names.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            if names:
+                names.reverse()
+                stacks[";".join(names)] += 1
+
+
+def collapse_stats(stats, max_depth=64, min_time=1e-5):
+    """Convert cProfile statistics into collapsed stacks
+
+    cProfile only records caller/callee pairs, so the time of functions
+    called from several places gets distributed proportionally.
+    Paths taking less than 'min_time' seconds are omitted.
+    Values are in microseconds.
+    """
+    callees = collections.defaultdict(list)
+    roots = []
+    for func, (_, _, _, _, callers) in stats.items():
+        if not callers:
+            roots.append(func)
+        for caller, (_, _, _, cumulative) in callers.items():
+            callees[caller].append((func, cumulative))
+
+    result = collections.Counter()
+
+    def walk(func, path, share, seen):
+        name = _func_name(func)
+        name = path + ";" + name if path else name
+        result[name] += int(stats[func][2] * share * 1000000)
+        if len(seen) >= max_depth:
+            return
+        seen = seen | {func}
+        for callee, time_spent in callees[func]:
+            total = stats[callee][3]
+            if callee not in seen and total and \
+                    share * time_spent >= min_time:
+                walk(callee, name, share * time_spent / total, seen)
+
+    for func in roots:
+        walk(func, "", 1.0, frozenset())
+    return result
+
+
+def _func_name(func):
+    filename, lineno, name = func
+    if filename == "~":
+        return name
+    return "{} ({}:{})".format(
+        name, os.path.basename(filename), lineno)
+
+
+def _frame_name(code):
+    return "{} ({}:{})".format(
+        code.co_name, os.path.basename(code.co_filename),
+        code.co_firstlineno)
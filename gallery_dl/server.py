@@ -0,0 +1,435 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2021 Mike Fährmann
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+
+"""Long-running process accepting jobs over a local HTTP API"""
+
+import os
+import hmac
+import json
+import stat
+import time
+import queue
+import socket
+import logging
+import threading
+import itertools
+import collections
+import socketserver
+import http.server
+from . import config, metrics, exception
+
+log = logging.getLogger("server")
+
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1")
+
+# options submitted jobs may set unless 'server.options' says otherwise;
+# nothing that runs commands, evaluates expressions, or chooses paths
+JOB_OPTIONS = (
+    "image-range", "chapter-range", "image-unique", "chapter-unique",
+    "skip", "sleep", "sleep-request", "sleep-extractor", "retries",
+    "timeout", "videos", "include", "metadata", "comments",
+    "retweets", "replies", "quoted", "text-posts",
+)
+
+
+class Server():
+    """Run submitted jobs on a pool of worker threads
+
+    Jobs without options run concurrently. Jobs with options modify the
+    global config and therefore run while no other job is active.
+    """
+
+    def __init__(self, jobtype, workers=4, history=10000,
+                 token=None, options=JOB_OPTIONS):
+        self.jobtype = jobtype
+        self.workers = max(workers, 1)
+        self.token = token
+        self.options = frozenset(options)
+        self.queue = queue.Queue()
+        self.jobs = collections.OrderedDict()
+        self.history = history
+        self.lock = threading.Lock()
+        self.config_lock = SharedLock()
+        self.adapters = {}
+        self.threads = []
+        self._ids = itertools.count(1)
+
+    def start(self):
+        """Start all worker threads"""
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._worker, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        """Let worker threads exit after finishing their current job"""
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads.clear()
+
+    def submit(self, url, options=None):
+        """Add a job for 'url' and return its status"""
+        entry = {
+            "id"       : next(self._ids),
+            "url"      : url,
+            "options"  : options or [],
+            "state"    : "queued",
+            "status"   : None,
+            "submitted": time.time(),
+            "started"  : None,
+            "finished" : None,
+        }
+        with self.lock:
+            self.jobs[entry["id"]] = entry
+            while len(self.jobs) > self.history:
+                oldest = next(iter(self.jobs.values()))
+                if oldest["state"] != "finished":
+                    break
+                self.jobs.popitem(last=False)
+        self.queue.put(entry)
+        return self.status(entry["id"])
+
+    def status(self, job_id=None):
+        """Return the status of a single job or a summary of all jobs"""
+        with self.lock:
+            if job_id is not None:
+                entry = self.jobs.get(job_id)
+                return _public(entry) if entry else None
+            states = collections.Counter(
+                entry["state"] for entry in self.jobs.values())
+            return {
+                "workers" : self.workers,
+                "queued"  : states["queued"],
+                "running" : states["running"],
+                "finished": states["finished"],
+            }
+
+    def list(self):
+        """Return the status of all known jobs"""
+        with self.lock:
+            return [_public(entry) for entry in self.jobs.values()]
+
+    def run(self, entry):
+        """Run the job described by 'entry'"""
+        options = entry["options"]
+        if options:
+            self.config_lock.acquire_exclusive()
+        else:
+            self.config_lock.acquire_shared()
+
+        try:
+            with config.apply(options):
+                job = self.jobtype(entry["url"])
+                if not options:
+                    self._share_adapters(job.extractor)
+                with self.lock:
+                    entry["state"] = "running"
+                    entry["started"] = time.time()
+                return job.run()
+        finally:
+            if options:
+                self.config_lock.release_exclusive()
+            else:
+                self.config_lock.release_shared()
+
+    def _share_adapters(self, extr):
+        """Reuse connection pools of previous jobs of the same category"""
+        with self.lock:
+            adapters = self.adapters.get(extr.category)
+            if adapters is None:
+                self.adapters[extr.category] = extr.session.adapters
+            else:
+                extr.session.adapters = adapters
+
+    def _worker(self):
+        while True:
+            entry = self.queue.get()
+            if entry is None:
+                return
+
+            status = 0
+            try:
+                status = self.run(entry)
+            except exception.TerminateExtraction:
+                pass
+            except exception.NoExtractorError:
+                log.error("No suitable extractor found for '%s'", entry["url"])
+                status = 64
+            except Exception as exc:
+                log.error("%s: %s", exc.__class__.__name__, exc)
+                log.debug("", exc_info=True)
+                status = 1
+            except BaseException as exc:
+                # e.g. SystemExit from 'skip: exit' in the user's config;
+                # keep this worker alive
+                log.error("Job %s stopped by %s",
+                          entry["id"], exc.__class__.__name__)
+                status = 1
+
+            with self.lock:
+                entry["state"] = "finished"
+                entry["status"] = status
+                entry["finished"] = time.time()
+            metrics.write()
+
+
+class SharedLock():
+    """Lock that can be held by multiple 'shared' or one 'exclusive' owner
+
+    Waiting exclusive owners block new shared owners.
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.shared = 0
+        self.exclusive = False
+        self.waiting = 0
+
+    def acquire_shared(self):
+        with self.cond:
+            while self.exclusive or self.waiting:
+                self.cond.wait()
+            self.shared += 1
+
+    def release_shared(self):
+        with self.cond:
+            self.shared -= 1
+            if not self.shared:
+                self.cond.notify_all()
+
+    def acquire_exclusive(self):
+        with self.cond:
+            self.waiting += 1
+            while self.exclusive or self.shared:
+                self.cond.wait()
+            self.waiting -= 1
+            self.exclusive = True
+
+    def release_exclusive(self):
+        with self.cond:
+            self.exclusive = False
+            self.cond.notify_all()
+
+
+class JSONRequestHandler(http.server.BaseHTTPRequestHandler):
+    """Base class for HTTP interfaces exchanging JSON data"""
+    server_version = "gallery-dl"
+
+    def _check_access(self):
+        """Require the configured token or a local hostname"""
+        token = self.server.app.token
+        if not token:
+            return self._check_host()
+        auth = self.headers.get("Authorization", "")
+        if hmac.compare_digest(auth, "Bearer " + token):
+            return True
+        self._send(401, {"error": "invalid token"})
+        return False
+
+    def _check_host(self):
+        """Reject requests for non-local hostnames (DNS rebinding)"""
+        if self.server.address_family == getattr(socket, "AF_UNIX", None):
+            return True
+        host = self.headers.get("Host", "")
+        if host.startswith("["):
+            host = host[1:].partition("]")[0]
+        else:
+            host = host.partition(":")[0]
+        if host in LOCAL_HOSTS:
+            return True
+        self._send(403, {"error": "forbidden host"})
+        return False
+
+    def _read_json(self):
+        """Return the JSON request body or None after sending an error"""
+        # require a JSON body to prevent simple cross-origin requests
+        if self.headers.get("Content-Type", "").partition(";")[0] != \
+                "application/json":
+            self._send(415, {"error": "expected application/json"})
+            return None
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(length).decode())
+        except ValueError as exc:
+            self._send(400, {"error": "invalid request: {}: {}".format(
+                exc.__class__.__name__, exc)})
+            return None
+
+    def _send(self, code, data):
+        body = json.dumps(data, default=str).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        log.debug(fmt, *args)
+
+
+class RequestHandler(JSONRequestHandler):
+    """HTTP interface to a Server instance
+
+    GET  /status     summary of all jobs
+    GET  /jobs       status of all jobs
+    GET  /jobs/ID    status of a single job
+    POST /jobs       submit a job: {"url": URL, "options": {KEY: VALUE}}
+    """
+
+    def do_GET(self):
+        if not self._check_access():
+            return
+        path = self.path.rstrip("/")
+        app = self.server.app
+
+        if path == "/status":
+            self._send(200, app.status())
+        elif path == "/jobs":
+            self._send(200, app.list())
+        elif path.startswith("/jobs/"):
+            job_id = path[6:]
+            entry = app.status(int(job_id)) if job_id.isdecimal() else None
+            if entry:
+                self._send(200, entry)
+            else:
+                self._send(404, {"error": "job not found"})
+        else:
+            self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        if not self._check_access():
+            return
+        if self.path.rstrip("/") != "/jobs":
+            return self._send(404, {"error": "not found"})
+
+        data = self._read_json()
+        if data is None:
+            return
+
+        try:
+            url = data["url"]
+            options = parse_options(
+                data.get("options"), self.server.app.options)
+            if not isinstance(url, str):
+                raise ValueError("'url' must be a string")
+        except (ValueError, KeyError, TypeError, AttributeError) as exc:
+            return self._send(400, {"error": "invalid request: {}: {}".format(
+                exc.__class__.__name__, exc)})
+
+        self._send(202, self.server.app.submit(url, options))
+
+
+class HTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class HTTPServer6(HTTPServer):
+    address_family = socket.AF_INET6
+
+
+if hasattr(socketserver, "UnixStreamServer"):
+    class UnixHTTPServer(socketserver.ThreadingMixIn,
+                         socketserver.UnixStreamServer):
+        daemon_threads = True
+
+        def get_request(self):
+            request, _ = self.socket.accept()
+            return request, ("local", 0)
+
+
+def parse_options(options, allowed=JOB_OPTIONS):
+    """Convert {"dot.separated.key": value} to config.apply() arguments
+
+    Only option names in 'allowed' are accepted,
+    either at the top level or for extractors. 'skip' values stopping
+    the whole process ("exit", "terminate") are rejected.
+    """
+    if not options:
+        return []
+    result = []
+    for name, value in options.items():
+        path = name.split(".")
+        key = path.pop()
+        if key not in allowed or path and path[0] != "extractor":
+            raise ValueError("option '{}' is not allowed".format(name))
+        if key == "skip" and isinstance(value, str) and \
+                value.partition(":")[0] in ("exit", "terminate"):
+            raise ValueError("'skip' value '{}' is not allowed".format(value))
+        result.append((path, key, value))
+    return result
+
+
+def create_server(address, app, handler=RequestHandler, remote=False):
+    """Create an HTTP server listening on 'address'
+
+    'address' is either HOST:PORT for a loopback address
+    or the path of a UNIX socket.
+    Non-loopback addresses are only allowed when 'remote' is True.
+    """
+    if _is_unix_address(address):
+        if address.startswith("unix:"):
+            address = address[5:]
+        if os.path.lexists(address):
+            if not stat.S_ISSOCK(os.lstat(address).st_mode):
+                raise ValueError(
+                    "'{}' exists and is not a socket".format(address))
+            os.unlink(address)
+        # only the owner may connect
+        umask = os.umask(0o177)
+        try:
+            server = UnixHTTPServer(address, handler)
+        finally:
+            os.umask(umask)
+    else:
+        host, _, port = address.rpartition(":")
+        host = host.strip("[]") or "127.0.0.1"
+        if host not in LOCAL_HOSTS and not remote:
+            raise ValueError(
+                "refusing to listen on non-local address '{}'".format(host))
+        cls = HTTPServer6 if ":" in host else HTTPServer
+        server = cls((host, int(port)), handler)
+    server.app = app
+    return server
+
+
+def _is_unix_address(address):
+    return os.sep in address or address.startswith("unix:")
+
+
+def _public(entry):
+    return {key: value for key, value in entry.items() if key != "options"}
+
+
+def serve(address, jobtype, workers=4):
+    """Accept and run jobs until interrupted
+
+    A UNIX socket is only accessible by its owner.
+    HTTP addresses require 'server.token'.
+    """
+    token = config.get(("server",), "token")
+    if not token and not _is_unix_address(address):
+        raise ValueError("'server.token' is required for HOST:PORT addresses")
+    app = Server(jobtype, workers, token=token,
+                 options=config.get(("server",), "options") or JOB_OPTIONS)
+    server = create_server(address, app)
+    app.start()
+
+    log.info("Listening on %s with %d worker%s",
+             address, app.workers, "" if app.workers == 1 else "s")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if server.address_family == getattr(socket, "AF_UNIX", None):
+            try:
+                os.unlink(server.server_address)
+            except OSError:
+                pass
+    return 0
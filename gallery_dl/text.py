@@ -11,6 +11,7 @@
 import re
 import html
 import datetime
+import functools
 import urllib.parse
 
 HTML_RE = re.compile("<[^>]+>")
@@ -124,6 +125,44 @@ def extract_all(txt, rules, pos=0, values=None):
     return values, pos
 
 
+def compile_rules(rules, default=None):
+    """Return a function applying extract_all()'s 'rules' in a single pass
+
+    The returned function takes the same 'txt', 'pos', and 'values'
+    arguments as extract_all() and returns the same (values, pos) tuple,
+    but uses 'default' instead of None for fields that were not found.
+    Build it once per rule list, e.g. as class attribute.
+    """
+    return functools.partial(_extract_rules, tuple(
+        (key, begin, len(begin), end, len(end))
+        for key, begin, end in rules
+    ), default)
+
+
+def _extract_rules(rules, default, txt, pos=0, values=None):
+    if values is None:
+        values = {}
+    try:
+        find = txt.find
+    except AttributeError:
+        find = None
+
+    for key, begin, lbeg, end, lend in rules:
+        if find:
+            first = find(begin, pos)
+            if first >= 0:
+                first += lbeg
+                last = find(end, first)
+                if last >= 0:
+                    if key:
+                        values[key] = txt[first:last]
+                    pos = last + lend
+                    continue
+        if key:
+            values[key] = default
+    return values, pos
+
+
 def extract_iter(txt, begin, end, pos=0):
     """Yield values that would be returned by repeated calls of extract()"""
     index = txt.index
@@ -11,6 +11,7 @@
 import re
 import os
 import sys
+import ast
 import json
 import time
 import random
@@ -22,12 +23,20 @@ import binascii
 import datetime
 import operator
 import functools
+import threading
 import itertools
+import collections.abc
 import urllib.parse
 from http.cookiejar import Cookie
+from requests.utils import guess_json_utf
 from email.utils import mktime_tz, parsedate_tz
 from . import text, exception
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 def bencode(num, alphabet="0123456789"):
     """Encode an integer into a base-N encoded string"""
@@ -93,8 +102,7 @@ def noop():
 
 def generate_token(size=16):
     """Generate a random token with hexadecimal digits"""
-    data = random.getrandbits(size * 8).to_bytes(size, "big")
-    return binascii.hexlify(data).decode()
+    return binascii.hexlify(os.urandom(size)).decode()
 
 
 def format_value(value, unit="B", suffixes="kMGTPEZY"):
@@ -175,6 +183,24 @@ def to_timestamp(dt):
         return ""
 
 
+def json_loads(data):
+    """Decode JSON from 'data' (bytes or str)
+
+    Use 'orjson' when available and fall back to the 'json' module for
+    input it rejects, like UTF-16 text or NaN values. Note that 'orjson'
+    returns integers outside the 64-bit range as float.
+    """
+    if orjson:
+        try:
+            return orjson.loads(data)
+        except ValueError:
+            pass
+    if isinstance(data, bytes):
+        # json.loads() accepts bytes only since Python 3.6
+        data = data.decode(guess_json_utf(data) or "utf-8")
+    return json.loads(data)
+
+
 def dump_json(obj, fp=sys.stdout, ensure_ascii=True, indent=4):
     """Serialize 'obj' as JSON and write it to 'fp'"""
     json.dump(
@@ -311,22 +337,98 @@ def save_cookiestxt(fp, cookies):
     fp.write("# Netscape HTTP Cookie File\n\n")
 
     for cookie in cookies:
-        if cookie.value is None:
-            name = ""
-            value = cookie.name
-        else:
-            name = cookie.name
-            value = cookie.value
+        fp.write("\t".join(_cookiestxt_fields(cookie)) + "\n")
+
+
+def _cookiestxt_fields(cookie):
+    if cookie.value is None:
+        name = ""
+        value = cookie.name
+    else:
+        name = cookie.name
+        value = cookie.value
+
+    return (
+        cookie.domain,
+        "TRUE" if cookie.domain.startswith(".") else "FALSE",
+        cookie.path,
+        "TRUE" if cookie.secure else "FALSE",
+        "0" if cookie.expires is None else str(cookie.expires),
+        name,
+        value,
+    )
+
+
+class CookieStore():
+    """Parsed cookies.txt files shared by all extractors
+
+    Each file gets parsed once and again only after its modification
+    time changed. Cookies get written back only when they differ from
+    the file's current content.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files = {}
+
+    def load(self, path):
+        """Return a list of all Cookies in the cookies.txt file at 'path'"""
+        stat = self._stat(path)
+        with self.lock:
+            entry = self.files.get(path)
+            if entry and entry[0] == stat:
+                return entry[1]
+
+            with open(path) as fp:
+                cookies = load_cookiestxt(fp)
+            self.files[path] = (stat, cookies, self._signature(cookies))
+            return cookies
+
+    def store(self, path, cookies):
+        """Write 'cookies' to 'path' if they changed
+
+        Return True if the file was written.
+        """
+        cookies = list(cookies)
+        signature = self._signature(cookies)
+
+        with self.lock:
+            entry = self.files.get(path)
+            if entry and entry[2] == signature:
+                try:
+                    if self._stat(path) == entry[0]:
+                        return False
+                except OSError:
+                    pass
+
+            # keep symlinks and the original file's permissions
+            real = os.path.realpath(path)
+            try:
+                mode = os.stat(real).st_mode & 0o7777
+            except OSError:
+                mode = 0o600
+
+            temp = real + ".part"
+            fd = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with open(fd, "w") as fp:
+                os.chmod(temp, mode)
+                save_cookiestxt(fp, cookies)
+            os.replace(temp, real)
+            self.files[path] = (self._stat(path), cookies, signature)
+            return True
+
+    def clear(self):
+        with self.lock:
+            self.files.clear()
+
+    @staticmethod
+    def _stat(path):
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
 
-        fp.write("\t".join((
-            cookie.domain,
-            "TRUE" if cookie.domain.startswith(".") else "FALSE",
-            cookie.path,
-            "TRUE" if cookie.secure else "FALSE",
-            "0" if cookie.expires is None else str(cookie.expires),
-            name,
-            value,
-        )) + "\n")
+    @staticmethod
+    def _signature(cookies):
+        return frozenset(map(_cookiestxt_fields, cookies))
 
 
 def code_to_language(code, default=None):
@@ -420,6 +522,30 @@ def compile_expression(expr, name="<expr>", globals=GLOBALS):
     return functools.partial(eval, code_object, globals)
 
 
+def expression_fields(expr):
+    """Return the names of all variables used in expression 'expr'
+
+    Return None if 'expr' is able to access arbitrary variables.
+    """
+    names = set()
+    for node in ast.walk(ast.parse(expr, mode="eval")):
+        if isinstance(node, ast.Name):
+            names.add(node.id)
+    if names.intersection(("locals", "globals", "vars", "eval")):
+        return None
+    return names
+
+
+def format_fields(format_string):
+    """Return the names of all top-level keys used in 'format_string'"""
+    names = set()
+    for _, field_name, _, _ in _string.formatter_parser(format_string):
+        if field_name:
+            for name in field_name.split("|"):
+                names.add(_string.formatter_field_name_split(name)[0])
+    return names
+
+
 def build_duration_func(duration, min=0.0):
     if not duration:
         return None
@@ -554,6 +680,78 @@ class FilterPredicate():
             raise exception.FilterError(exc)
 
 
+class LayeredDict(collections.abc.MutableMapping):
+    """Mapping of a shared 'base' dict and a small per-file 'layer'
+
+    Lookups fall through to 'base' for keys not found in 'layer', while
+    assignments and deletions only ever touch 'layer'. This allows
+    any number of instances to share the same 'base' without copying it.
+    """
+    __slots__ = ("base", "layer", "deleted")
+
+    def __init__(self, base, layer=None):
+        self.base = base
+        self.layer = {} if layer is None else layer
+        self.deleted = None
+
+    def __getitem__(self, key):
+        try:
+            return self.layer[key]
+        except KeyError:
+            if self.deleted and key in self.deleted:
+                raise
+        return self.base[key]
+
+    def __setitem__(self, key, value):
+        self.layer[key] = value
+        if self.deleted:
+            self.deleted.discard(key)
+
+    def __delitem__(self, key):
+        if key in self.layer:
+            del self.layer[key]
+        elif key not in self:
+            raise KeyError(key)
+        if key in self.base:
+            if self.deleted is None:
+                self.deleted = set()
+            self.deleted.add(key)
+
+    def __contains__(self, key):
+        if key in self.layer:
+            return True
+        if self.deleted and key in self.deleted:
+            return False
+        return key in self.base
+
+    def __iter__(self):
+        layer = self.layer
+        deleted = self.deleted or ()
+        yield from layer
+        for key in self.base:
+            if key not in layer and key not in deleted:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return "{}({!r})".format(self.__class__.__name__, dict(self))
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def copy(self):
+        """Return a snapshot sharing the same 'base'"""
+        new = self.__class__(self.base, self.layer.copy())
+        if self.deleted:
+            new.deleted = self.deleted.copy()
+        return new
+
+
 class ExtendedUrl():
     """URL with attached config key-value pairs"""
     def __init__(self, url, gconf, lconf):
@@ -1116,7 +1314,7 @@ class PathFormat():
 
 class DownloadArchive():
 
-    def __init__(self, path, extractor):
+    def __init__(self, path, extractor=None):
         con = sqlite3.connect(path, timeout=60, check_same_thread=False)
         con.isolation_level = None
         self.close = con.close
@@ -1129,20 +1327,51 @@ class DownloadArchive():
             # fallback for missing WITHOUT ROWID support (#553)
             self.cursor.execute("CREATE TABLE IF NOT EXISTS archive "
                                 "(entry PRIMARY KEY)")
-        self.keygen = (
-            extractor.config("archive-prefix", extractor.category) +
-            extractor.config("archive-format", extractor.archive_fmt)
-        ).format_map
+        if extractor:
+            self.keygen = (
+                extractor.config("archive-prefix", extractor.category) +
+                extractor.config("archive-format", extractor.archive_fmt)
+            ).format_map
+        else:
+            # use precomputed '_archive_key' values
+            self.keygen = operator.itemgetter("_archive_key")
+        self.batch = None
 
     def check(self, kwdict):
         """Return True if the item described by 'kwdict' exists in archive"""
         key = kwdict["_archive_key"] = self.keygen(kwdict)
+        if self.batch:
+            result = self.batch.pop(key, None)
+            if result is not None:
+                return result
         self.cursor.execute(
             "SELECT 1 FROM archive WHERE entry=? LIMIT 1", (key,))
         return self.cursor.fetchone()
 
+    def check_batch(self, kwdicts):
+        """Look up the entries of all 'kwdicts' with as few queries as possible
+
+        Results are used by the following check() calls for these items.
+        """
+        keys = []
+        for kwdict in kwdicts:
+            key = kwdict["_archive_key"] = self.keygen(kwdict)
+            keys.append(key)
+
+        found = set()
+        # stay below SQLite's default limit of 999 variables
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i+500]
+            self.cursor.execute(
+                "SELECT entry FROM archive WHERE entry IN ({})".format(
+                    ",".join("?" * len(chunk))), chunk)
+            found.update(row[0] for row in self.cursor)
+        self.batch = {key: key in found for key in keys}
+
     def add(self, kwdict):
         """Add item described by 'kwdict' to archive"""
         key = kwdict.get("_archive_key") or self.keygen(kwdict)
+        if self.batch and key in self.batch:
+            self.batch[key] = True
         self.cursor.execute(
             "INSERT OR IGNORE INTO archive VALUES (?)", (key,))
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2021 Mike Fährmann
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+
+"""Measure Job.dispatch overhead per million Message.Url items
+
+Compare single Message.Url messages with Message.UrlBatch messages,
+with and without looking up each item in a download archive.
+"""
+
+import argparse
+import time
+
+import util  # noqa
+from gallery_dl import job, config, util as gutil
+from gallery_dl.extractor.common import Extractor, Message
+
+
+class BenchExtractor(Extractor):
+    category = "bench"
+    subcategory = "dispatch"
+    archive_fmt = "{num}"
+    pattern = r"bench:(\d+)(?::(\d+))?$"
+
+    def __init__(self, match):
+        Extractor.__init__(self, match)
+        self.count = int(match.group(1))
+        self.batch = int(match.group(2) or 0)
+
+    def items(self):
+        url = "https://example.org/file.jpg"
+        yield Message.Directory, {}
+
+        if not self.batch:
+            for num in range(self.count):
+                yield Message.Url, url, {"num": num}
+            return
+
+        for start in range(0, self.count, self.batch):
+            yield Message.UrlBatch, [
+                (url, {"num": num})
+                for num in range(start, min(start+self.batch, self.count))
+            ]
+
+
+class BenchJob(job.Job):
+    """Dispatch messages and optionally check them against an archive"""
+
+    def __init__(self, extr, archive=None):
+        job.Job.__init__(self, extr)
+        self.archive = archive
+
+    def handle_url(self, url, kwdict):
+        if self.archive:
+            self.archive.check(kwdict)
+
+    def handle_url_batch(self, items):
+        if self.archive:
+            self.archive.check_batch([kwdict for _, kwdict in items])
+        job.Job.handle_url_batch(self, items)
+
+
+def run(count, batch, archive):
+    extr = BenchExtractor.from_url("bench:{}:{}".format(count, batch))
+    if archive:
+        archive = gutil.DownloadArchive(":memory:", extr)
+        # mark every other item as already downloaded
+        for num in range(0, count, 2):
+            archive.add({"num": num})
+
+    bjob = BenchJob(extr, archive)
+    start = time.process_time()
+    bjob.run()
+    return time.process_time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--count", type=int, default=200000,
+                        help="number of items per run (default: 200000)")
+    parser.add_argument("-b", "--batch", type=int, default=100,
+                        help="items per Message.UrlBatch (default: 100)")
+    args = parser.parse_args()
+
+    config.set(("output",), "mode", "null")
+    scale = 1000000 / args.count
+    for archive in (False, True):
+        for name, batch in (("Url", 0), ("UrlBatch", args.batch)):
+            seconds = run(args.count, batch, archive)
+            print("{:<9} {:<10} {:>7.3f}s CPU per million items".format(
+                name, "archive" if archive else "-", seconds * scale))
+
+
+if __name__ == "__main__":
+    main()
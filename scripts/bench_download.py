@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2021 Mike Fährmann
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+
+"""Measure CPU time per GiB of HttpDownloader's receive loops
+
+The local HTTP server runs inside the same process,
+so its (constant) CPU time is included in all results.
+"""
+
+import argparse
+import logging
+import tempfile
+import threading
+import http.server
+import time
+import os
+
+import util  # noqa
+from gallery_dl import downloader, extractor, output, config, util as gutil
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    chunk = os.urandom(1048576)
+    size = 0
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(self.size))
+        self.end_headers()
+
+        chunk = self.chunk
+        remaining = self.size
+        write = self.wfile.write
+        while remaining > 0:
+            data = chunk[:remaining]
+            write(data)
+            remaining -= len(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeJob():
+
+    def __init__(self):
+        self.extractor = extractor.find("test:")
+        self.pathfmt = gutil.PathFormat(self.extractor)
+        self.out = output.NullOutput()
+        self.get_logger = logging.getLogger
+
+
+def run(url, directory, readinto, rounds):
+    config.set(("downloader",), "readinto", readinto)
+    config.set((), "base-directory", directory)
+    job = FakeJob()
+    dl = downloader.find("http")(job)
+    pathfmt = job.pathfmt
+
+    cpu = wall = 0.0
+    for num in range(rounds):
+        kwdict = {"category": "bench", "subcategory": "",
+                  "filename": str(num), "extension": "bin"}
+        pathfmt.set_directory(kwdict)
+        pathfmt.set_filename(kwdict)
+
+        c1, t1 = time.process_time(), time.perf_counter()
+        if not dl.download(url, pathfmt):
+            raise SystemExit("download failed")
+        cpu += time.process_time() - c1
+        wall += time.perf_counter() - t1
+        os.unlink(pathfmt.temppath)
+    return cpu, wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-s", "--size", type=int, default=256,
+                        help="file size in MiB (default: 256)")
+    parser.add_argument("-n", "--rounds", type=int, default=4,
+                        help="number of downloads per mode (default: 4)")
+    args = parser.parse_args()
+
+    RequestHandler.size = args.size * 1048576
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), RequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = "http://127.0.0.1:{}/file.bin".format(server.server_port)
+
+    gib = RequestHandler.size * args.rounds / 1073741824
+    with tempfile.TemporaryDirectory() as directory:
+        config.set(("downloader",), "part", False)
+        for name, readinto in (("iter_content", False), ("readinto", True)):
+            cpu, wall = run(url, directory, readinto, args.rounds)
+            print("{:<14} {:>7.3f}s CPU/GiB {:>8.1f} MiB/s".format(
+                name, cpu / gib, gib * 1024 / wall))
+
+
+if __name__ == "__main__":
+    main()
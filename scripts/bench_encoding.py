@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2021 Mike Fährmann
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+
+"""Compare bytes-on-wire and decode CPU time of HTTP content codings
+
+Run with recorded API responses, e.g. '.dump' files created by
+'gallery-dl --write-pages', as arguments.
+"""
+
+import sys
+import gzip
+import time
+import argparse
+
+
+def codings():
+    """Yield (name, encode, decode) for all available content codings"""
+    yield ("identity", lambda data: data, lambda data: data)
+    yield ("gzip",
+           lambda data: gzip.compress(data, 6),
+           gzip.decompress)
+
+    try:
+        import brotli
+    except ImportError:
+        try:
+            import brotlicffi as brotli
+        except ImportError:
+            brotli = None
+    if brotli:
+        yield ("br",
+               lambda data: brotli.compress(data, quality=5),
+               brotli.decompress)
+
+    try:
+        import zstandard
+    except ImportError:
+        pass
+    else:
+        yield ("zstd",
+               zstandard.ZstdCompressor(level=3).compress,
+               zstandard.ZstdDecompressor().decompress)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--rounds", type=int, default=20,
+                        help="number of decode rounds (default: 20)")
+    parser.add_argument("files", nargs="+", metavar="FILE")
+    args = parser.parse_args()
+
+    payloads = []
+    for path in args.files:
+        with open(path, "rb") as fp:
+            payloads.append(fp.read())
+    total = sum(map(len, payloads))
+    if not total:
+        sys.exit("no data")
+
+    print("{:<10} {:>12} {:>7} {:>16}".format(
+        "coding", "bytes", "ratio", "decode ms/MiB"))
+    for name, encode, decode in codings():
+        encoded = [encode(data) for data in payloads]
+        size = sum(map(len, encoded))
+
+        t1 = time.process_time()
+        for _ in range(args.rounds):
+            for data in encoded:
+                decode(data)
+        elapsed = time.process_time() - t1
+
+        print("{:<10} {:>12} {:>7.3f} {:>16.3f}".format(
+            name, size, size / total,
+            elapsed * 1000 / args.rounds / (total / 1048576)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2021 Mike Fährmann
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+
+"""Compare text.extract_all() with text.compile_rules()
+
+Extract the metadata fields of an exhentai gallery page from each
+saved HTML file given as argument, or from a synthetic page.
+"""
+
+import argparse
+import timeit
+
+import util  # noqa
+from gallery_dl import text
+from gallery_dl.extractor.exhentai import ExhentaiGalleryExtractor
+
+
+RULES = ExhentaiGalleryExtractor._metadata_rules.args[0]
+RULES = tuple((key, begin, end) for key, begin, _, end, _ in RULES)
+
+
+def synthetic_page():
+    parts = ["<html><head><title>x</title></head><body>", "x" * 20000]
+    for key, begin, end in RULES:
+        parts.append(begin)
+        parts.append(key or "")
+        parts.append(end)
+        parts.append("<div>filler</div>" * 50)
+    parts.append("</body></html>")
+    return "".join(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--number", type=int, default=20000,
+                        help="iterations per page (default: 20000)")
+    parser.add_argument("files", nargs="*", metavar="FILE",
+                        help="saved gallery page")
+    args = parser.parse_args()
+
+    pages = []
+    for path in args.files:
+        with open(path, encoding="utf-8") as fp:
+            pages.append((path, fp.read()))
+    if not pages:
+        pages.append(("<synthetic>", synthetic_page()))
+
+    compiled = text.compile_rules(RULES, "")
+    for name, page in pages:
+        if text.extract_all(page, RULES)[0].keys() != compiled(page)[0].keys():
+            raise SystemExit("result mismatch for " + name)
+
+        for label, func in (
+            ("extract_all", lambda: text.extract_all(page, RULES)),
+            ("compile_rules", lambda: compiled(page)),
+        ):
+            seconds = timeit.timeit(func, number=args.number)
+            print("{:<14} {:<14} {:>8.2f}us per page".format(
+                label, name[-14:], seconds / args.number * 1e6))
+
+
+if __name__ == "__main__":
+    main()
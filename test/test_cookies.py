@@ -14,10 +14,11 @@ from unittest import mock
 
 import logging
 import tempfile
+import http.cookiejar
 from os.path import join
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from gallery_dl import config, extractor  # noqa E402
+from gallery_dl import config, extractor, util  # noqa E402
 
 
 class TestCookiejar(unittest.TestCase):
@@ -72,6 +73,94 @@ class TestCookiejar(unittest.TestCase):
             self.assertIsInstance(mock_warning.call_args[0][1], exc)
 
 
+class TestCookieStore(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.TemporaryDirectory()
+        self.cookiefile = join(self.path.name, "cookies.txt")
+        with open(self.cookiefile, "w") as file:
+            file.write(".example.org\tTRUE\t/\tFALSE\t253402210800"
+                       "\tNAME\tVALUE\n")
+        self.store = util.CookieStore()
+
+    def tearDown(self):
+        self.path.cleanup()
+        config.clear()
+
+    def test_load(self):
+        cookies = self.store.load(self.cookiefile)
+        self.assertEqual(len(cookies), 1)
+        self.assertIs(self.store.load(self.cookiefile), cookies)
+
+        # parse again after the file changed
+        with open(self.cookiefile, "a") as file:
+            file.write(".example.org\tTRUE\t/\tFALSE\t0\tFOO\tBAR\n")
+        cookies = self.store.load(self.cookiefile)
+        self.assertEqual(len(cookies), 2)
+
+    def test_store(self):
+        jar = http.cookiejar.CookieJar()
+        for cookie in self.store.load(self.cookiefile):
+            jar.set_cookie(cookie)
+
+        with mock.patch.object(util, "save_cookiestxt") as save:
+            self.assertFalse(self.store.store(self.cookiefile, jar))
+            save.assert_not_called()
+
+        jar.set_cookie(self.store.load(self.cookiefile)[0])
+        self.assertFalse(self.store.store(self.cookiefile, jar))
+
+        cookie = next(iter(jar))
+        cookie.value = "CHANGED"
+        self.assertTrue(self.store.store(self.cookiefile, jar))
+        self.assertFalse(os.path.exists(self.cookiefile + ".part"))
+        self.assertFalse(self.store.store(self.cookiefile, jar))
+
+        with open(self.cookiefile) as file:
+            cookies = util.load_cookiestxt(file)
+        self.assertEqual(cookies[0].value, "CHANGED")
+
+    @unittest.skipIf(os.name == "nt", "no POSIX permissions or symlinks")
+    def test_store_mode_symlink(self):
+        os.chmod(self.cookiefile, 0o640)
+        link = join(self.path.name, "link.txt")
+        os.symlink(self.cookiefile, link)
+
+        jar = http.cookiejar.CookieJar()
+        jar.set_cookie(self.store.load(link)[0])
+        next(iter(jar)).value = "CHANGED"
+        self.assertTrue(self.store.store(link, jar))
+
+        self.assertTrue(os.path.islink(link))
+        self.assertEqual(os.stat(self.cookiefile).st_mode & 0o777, 0o640)
+        with open(self.cookiefile) as file:
+            cookies = util.load_cookiestxt(file)
+        self.assertEqual(cookies[0].value, "CHANGED")
+
+        # new files are only accessible by their owner
+        path = join(self.path.name, "new.txt")
+        self.assertTrue(self.store.store(path, jar))
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+
+    def test_extractor(self):
+        config.set((), "cookies", self.cookiefile)
+        extractor.common.Extractor.cookiestore.clear()
+
+        with mock.patch.object(util, "load_cookiestxt",
+                               wraps=util.load_cookiestxt) as load:
+            extr = extractor.find("test:")
+            extractor.find("test:")
+            self.assertEqual(load.call_count, 1)
+
+        with mock.patch.object(util, "save_cookiestxt") as save:
+            extr._store_cookies()
+            save.assert_not_called()
+
+            extr.session.cookies.set("FOO", "BAR", domain=".example.org")
+            extr._store_cookies()
+            save.assert_called_once()
+
+
 class TestCookiedict(unittest.TestCase):
 
     def setUp(self):
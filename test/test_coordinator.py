@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2021 Mike Fährmann
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+
+import os
+import sys
+import unittest
+
+import io
+import time
+import sqlite3
+import tempfile
+import threading
+import contextlib
+import unittest.mock
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from gallery_dl import coordinator, journal, server, config, exception  # noqa E402,E501
+from gallery_dl.extractor.common import Extractor, Message  # noqa E402
+
+
+class TestCoordinator(unittest.TestCase):
+
+    def setUp(self):
+        self.journal = journal.Journal(":memory:", lease_time=0.05)
+        self.app = coordinator.Coordinator(self.journal)
+
+    def tearDown(self):
+        self.app.close()
+
+    def test_lease(self):
+        self.app.add("test:1")
+        self.assertFalse(self.app.add("test:1")["added"])
+
+        entry = self.app.lease("host:1")
+        self.assertEqual(entry["url"], "test:1")
+        self.assertEqual(self.app.lease("host:2"), {"wait": True})
+
+        # only the owner can finish an entry
+        finish = self.app.finish
+        self.assertFalse(finish(entry["entry"], "host:2")["finished"])
+        self.assertTrue(finish(entry["entry"], "host:1", 4)["finished"])
+        self.assertEqual(self.app.lease("host:2"), {"done": True})
+        self.assertTrue(self.app.done())
+        self.assertEqual(self.app.status()["status"], 4)
+
+    def test_lease_expiry(self):
+        self.app.add("test:1")
+        entry = self.app.lease("host:1")
+        time.sleep(0.1)
+
+        # the lease of a crashed worker expired
+        entry2 = self.app.lease("host:2")
+        self.assertEqual(entry2["entry"], entry["entry"])
+
+    def test_lease_expired_finish(self):
+        self.app.add("test:1")
+        entry = self.app.lease("host:1")
+        time.sleep(0.1)
+        self.app.lease("host:2")
+
+        self.assertFalse(self.app.finish(entry["entry"], "host:1")["finished"])
+        self.assertEqual(self.app.status()["active"], 1)
+
+    def test_archive(self):
+        cfgpath = ["extractor", "test", "child"]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "archive.db")
+            with self.assertRaises(ValueError):
+                self.app.archive(cfgpath, "foo")
+
+            config.set(("extractor", "test"), "archive", path)
+            try:
+                self.assertFalse(self.app.archive(cfgpath, "foo")["exists"])
+                self.app.archive(cfgpath, "foo", "add")
+                self.assertTrue(self.app.archive(cfgpath, "foo")["exists"])
+                with self.assertRaises(TypeError):
+                    self.app.archive("/tmp/archive.db", "foo")
+            finally:
+                config.clear()
+            self.app.close()
+
+            con = sqlite3.connect(path)
+            self.assertEqual(
+                con.execute("SELECT entry FROM archive").fetchall(),
+                [("foo",)])
+            con.close()
+
+    def test_config(self):
+        config.set((), "base-directory", "/tmp")
+        config.set(("coordinator",), "token", "secret")
+        config.set(("extractor",), "username", "user")
+        config.set(("extractor", "foo"), "password", "pass")
+        config.set(("extractor", "foo"), "refresh-token", "abc")
+        config.set(("extractor", "foo"), "cookies", {"a": "b"})
+        config.set(("extractor", "foo"), "cookies-update", False)
+        config.set(("extractor", "foo"), "videos", False)
+        try:
+            self.assertEqual(self.app.config()["config"], {
+                "base-directory": "/tmp",
+                "extractor": {"foo": {
+                    "cookies-update": False, "videos": False}},
+            })
+        finally:
+            config.clear()
+
+    def test_spawn(self):
+        from gallery_dl import option
+        args = option.build_parser().parse_args([
+            "--ignore-config", "-c", "a.conf", "-c", "b.conf",
+            "--cookies", "cookies.txt", "-u", "user", "-p", "pass",
+            "-o", "extractor.foo.refresh-token=abc", "-o", "videos=false",
+            "-v", "https://example.org/",
+        ])
+
+        with unittest.mock.patch("subprocess.Popen") as popen:
+            coordinator.spawn(
+                "http://127.0.0.1:1", "secret", coordinator.worker_args(args))
+        cmd = popen.call_args[0][0]
+        env = popen.call_args[1]["env"]
+
+        self.assertEqual(cmd[:3], [sys.executable, "-m", "gallery_dl"])
+        self.assertEqual(cmd[-2:], ["--worker", "http://127.0.0.1:1"])
+        self.assertEqual(cmd[3:-2], [
+            "--verbose", "--ignore-config",
+            "--config", "a.conf", "--config", "b.conf",
+            "--option", 'cookies="cookies.txt"',
+            "--option", 'username="user"',
+            "--option", 'password="pass"',
+            "--option", 'extractor.foo.refresh-token="abc"',
+        ])
+        self.assertEqual(env[coordinator.TOKEN_ENV], "secret")
+
+        # forwarded arguments parse to the original values
+        wargs = option.build_parser().parse_args(cmd[3:-2] + ["url"])
+        self.assertEqual(wargs.cfgfiles, ["a.conf", "b.conf"])
+        self.assertIn(([], "username", "user"), wargs.options)
+        self.assertIn((["extractor", "foo"], "refresh-token", "abc"),
+                      wargs.options)
+
+
+class TestCoordinatorHTTP(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.journal = journal.Journal(":memory:")
+        self.app = coordinator.Coordinator(self.journal, None, "SimulationJob")
+        self.server = server.create_server(
+            "127.0.0.1:0", self.app, coordinator.RequestHandler)
+        self.root = "http://127.0.0.1:{}".format(self.server.server_port)
+        thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True)
+        thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.app.close()
+        self.tmpdir.cleanup()
+        config.clear()
+
+    def _work(self):
+        config.set(("coordinator",), "token", self.app.token)
+        with io.StringIO() as buffer:
+            with contextlib.redirect_stdout(buffer):
+                return coordinator.work(self.root)
+
+    def test_work(self):
+        archive = os.path.join(self.tmpdir.name, "archive.db")
+        config.set((), "archive", archive)
+        config.set(("extractor",), "password", "secret")
+        self.journal.add("test:parent", {"extractor": "{}:{}".format(
+            __name__, TestExtractorParent.__name__)})
+
+        self.assertEqual(self._work(), 0)
+        self.assertTrue(self.app.done())
+        self.assertEqual(self.app.status()["done"], 3)
+
+        urls = [row[0] for row in self.journal.cursor.execute(
+            "SELECT url FROM queue ORDER BY id")]
+        self.assertEqual(urls, ["test:parent", "test:child:1", "test:child:2"])
+
+        self.app.archives[archive].close()
+        con = sqlite3.connect(archive)
+        self.assertEqual(len(con.execute(
+            "SELECT entry FROM archive").fetchall()), 2)
+        con.close()
+
+    def test_token(self):
+        self.app.token = "secret"
+        response = requests.get(self.root + "/status")
+        self.assertEqual(response.status_code, 401)
+
+        client = coordinator.Client(self.root, "secret")
+        self.assertEqual(client.call("/status")["pending"], 0)
+
+    def test_invalid(self):
+        response = requests.post(self.root + "/lease", json={"foo": 1})
+        self.assertEqual(response.status_code, 401)
+        response = requests.get(self.root + "/config")
+        self.assertEqual(response.status_code, 401)
+
+        headers = {"Authorization": "Bearer " + self.app.token}
+        response = requests.post(
+            self.root + "/lease", json={"foo": 1}, headers=headers)
+        self.assertEqual(response.status_code, 400)
+        response = requests.post(
+            self.root + "/archive", json={"cfgpath": [], "key": "foo"},
+            headers=headers)
+        self.assertEqual(response.status_code, 400)
+        response = requests.post(
+            self.root + "/foo", json={}, headers=headers)
+        self.assertEqual(response.status_code, 404)
+
+    def test_coordinator_error(self):
+        self.journal.add("test:child:1", {"extractor": "{}:{}".format(
+            __name__, TestExtractor.__name__)})
+        config.set((), "archive", os.path.join(
+            self.tmpdir.name, "archive.db"))
+
+        with unittest.mock.patch.object(
+                coordinator.RemoteArchive, "add",
+                side_effect=exception.CoordinatorError("down")):
+            self.assertEqual(self._work(), 1)
+
+        # the entry was released instead of finished
+        self.assertEqual(self.app.status()["pending"], 1)
+        self.assertEqual(self.app.status()["done"], 0)
+
+    def test_import_extractor(self):
+        cls = journal.import_extractor(
+            "{}:{}".format(__name__, TestExtractor.__name__))
+        self.assertIs(cls, TestExtractor)
+
+        with self.assertRaises(ValueError):
+            journal.import_extractor("gallery_dl.job:DownloadJob")
+
+
+class TestExtractorParent(Extractor):
+    category = "test"
+    subcategory = "parent"
+    pattern = r"test:parent$"
+
+    def items(self):
+        for i in (1, 2, 1):
+            url = "test:child:{}".format(i)
+            yield Message.Queue, url, {"_extractor": TestExtractor}
+
+
+class TestExtractor(Extractor):
+    category = "test"
+    subcategory = "child"
+    archive_fmt = "{num}"
+    pattern = r"test:child:(\d+)$"
+
+    def items(self):
+        num = self.url.rpartition(":")[2]
+        yield Message.Directory, {}
+        yield Message.Url, "https://example.org/{}.jpg".format(num), {
+            "num": num, "filename": num, "extension": "jpg"}
+
+
+if __name__ == "__main__":
+    unittest.main()
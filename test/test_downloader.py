@@ -13,7 +13,9 @@ import unittest
 from unittest.mock import Mock, MagicMock, patch
 
 import re
+import time
 import base64
+import hashlib
 import logging
 import os.path
 import tempfile
@@ -23,6 +25,8 @@ import http.server
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from gallery_dl import downloader, extractor, output, config, util  # noqa E402
+from gallery_dl import metrics, exception  # noqa E402
+from gallery_dl.downloader import common as dlcommon  # noqa E402
 
 
 class MockDownloaderModule(Mock):
@@ -35,6 +39,7 @@ class FakeJob():
         self.extractor = extractor.find("test:")
         self.pathfmt = util.PathFormat(self.extractor)
         self.out = output.NullOutput()
+        self.stop_event = None
         self.get_logger = logging.getLogger
 
 
@@ -101,6 +106,83 @@ class TestDownloaderModule(unittest.TestCase):
         self.assertEqual(import_module.call_count, 1)
 
 
+class TestTokenBucket(unittest.TestCase):
+
+    def tearDown(self):
+        dlcommon._buckets.clear()
+
+    @patch("time.monotonic")
+    def test_consume(self, monotonic):
+        monotonic.return_value = 100.0
+        bucket = dlcommon.TokenBucket("1k")
+        self.assertEqual(bucket.rate, 1024)
+
+        self.assertEqual(bucket.consume(512), 0.5)
+        self.assertEqual(bucket.consume(512), 1.0)
+
+        monotonic.return_value = 101.0
+        self.assertEqual(bucket.consume(1024), 1.0)
+
+        # refill is capped at one second worth of tokens
+        monotonic.return_value = 200.0
+        self.assertEqual(bucket.consume(1024), 0.0)
+        self.assertEqual(bucket.consume(1024), 1.0)
+
+    def test_rate_int(self):
+        self.assertEqual(dlcommon.TokenBucket(2048).rate, 2048)
+        self.assertEqual(dlcommon.TokenBucket(16384).rate, 16384)
+        self.assertEqual(dlcommon.parse_schedule(
+            {"08:00-18:00": 16384}), [(480, 1080, 16384)])
+
+    def test_unlimited(self):
+        bucket = dlcommon.TokenBucket(None)
+        self.assertEqual(bucket.consume(2**30), 0.0)
+        bucket = dlcommon.TokenBucket("invalid")
+        self.assertEqual(bucket.consume(2**30), 0.0)
+
+    def test_schedule(self):
+        schedule = dlcommon.parse_schedule({
+            "08:00-18:00": "1k",
+            "22:30-02": "2k",
+        })
+        self.assertEqual(schedule, [
+            (480, 1080, 1024),
+            (1350, 120, 2048),
+        ])
+
+        def rate(hour, minute):
+            now = time.struct_time((2021, 1, 1, hour, minute, 0, 0, 1, 0))
+            return dlcommon.scheduled_rate(schedule, now)
+
+        self.assertEqual(rate(7, 59), None)
+        self.assertEqual(rate(8, 0), 1024)
+        self.assertEqual(rate(17, 59), 1024)
+        self.assertEqual(rate(18, 0), None)
+        self.assertEqual(rate(22, 30), 2048)
+        self.assertEqual(rate(0, 0), 2048)
+        self.assertEqual(rate(2, 0), None)
+
+    def test_schedule_invalid(self):
+        with self.assertLogs("downloader", "WARNING"):
+            schedule = dlcommon.parse_schedule({
+                "8am-6pm": "1k",
+                "25:00-02:00": "1k",
+                "08:00-18:60": "1k",
+                "22:30-": "2k",
+            })
+        self.assertEqual(schedule, [(1350, 1440, 2048)])
+
+    def test_get_bucket(self):
+        bucket = dlcommon.get_bucket("", "1k")
+        self.assertIs(dlcommon.get_bucket("", "1k"), bucket)
+        self.assertEqual(bucket.rate, 1024)
+
+        self.assertIs(dlcommon.get_bucket("", "2k"), bucket)
+        self.assertEqual(bucket.rate, 2048)
+
+        self.assertIsNot(dlcommon.get_bucket("example.org", "2k"), bucket)
+
+
 class TestDownloaderBase(unittest.TestCase):
 
     @classmethod
@@ -181,6 +263,7 @@ class TestHTTPDownloader(TestDownloaderBase):
 
     def tearDown(self):
         self.downloader.minsize = self.downloader.maxsize = None
+        self.downloader.hash = None
 
     def test_http_download(self):
         self._run_test(self._jpg, None, DATA_JPG, "jpg", "jpg")
@@ -209,6 +292,98 @@ class TestHTTPDownloader(TestDownloaderBase):
             success = self.downloader.download(self._gif, pathfmt)
         self.assertFalse(success)
 
+    def test_http_rate_global(self):
+        self.downloader.rate_global = "100M"
+        try:
+            self._run_test(self._jpg, None, DATA_JPG, "jpg", "jpg")
+            self.assertEqual(len(dlcommon._buckets), 1)
+        finally:
+            self.downloader.rate_global = None
+            dlcommon._buckets.clear()
+
+    def test_http_rate(self):
+        for rate in (1024, "1k"):
+            config.set(("downloader",), "rate", rate)
+            try:
+                http = downloader.find("http")(self.job)
+            finally:
+                config.unset(("downloader",), "rate")
+            self.assertEqual(http.rate.rate, 1024)
+
+            with patch("time.sleep") as sleep:
+                http._receive_rate(Mock(), (b"x" * 512,) * 4, [http.rate])
+            self.assertGreaterEqual(
+                sum(call[0][0] for call in sleep.call_args_list), 1.5)
+
+    def test_http_hash(self):
+        self.downloader.hash = ["md5", "crc32"]
+        pathfmt = self._prepare_destination(None, extension="jpg")
+        self.assertTrue(self.downloader.download(self._jpg, pathfmt))
+
+        kwdict = pathfmt.kwdict
+        self.assertEqual(kwdict["_hash_md5"],
+                         hashlib.md5(DATA_JPG).hexdigest())
+        self.assertEqual(kwdict["_hash_crc32"], "8b59b606")
+
+    def test_http_hash_resume(self):
+        pathfmt = self._prepare_destination(DATA_PNG[:12], extension="png")
+        pathfmt.kwdict["_http_hash"] = (
+            "sha256", hashlib.sha256(DATA_PNG).hexdigest())
+        self.assertTrue(self.downloader.download(self._png, pathfmt))
+        self.assertIn("_hash_sha256", pathfmt.kwdict)
+
+    def test_http_hash_mismatch(self):
+        pathfmt = self._prepare_destination(None, extension="gif")
+        pathfmt.kwdict["_http_hash"] = ("md5", "0" * 32)
+        self.downloader.retries = 0
+        try:
+            with self.assertLogs(self.downloader.log, "WARNING") as cm:
+                success = self.downloader.download(self._gif, pathfmt)
+        finally:
+            self.downloader.retries = 4
+        self.assertFalse(success)
+        self.assertIn("md5 checksum mismatch", cm.output[0])
+
+    def test_http_metrics(self):
+        metrics.active = registry = metrics.Registry()
+        try:
+            pathfmt = self._prepare_destination(None, extension="jpg")
+            self.assertTrue(self.downloader.download(self._jpg, pathfmt))
+        finally:
+            metrics.active = None
+
+        labels = (("category", self.downloader.category),
+                  ("host", "127.0.0.1"))
+        self.assertEqual(
+            registry.counters[("download_bytes_total", labels)],
+            len(DATA_JPG))
+        self.assertEqual(
+            registry.histograms[("download_seconds", labels)].count, 1)
+
+    def test_http_progress(self):
+        out = self.downloader.out = Mock()
+        progress = self.downloader.progress
+        self.downloader.progress = 0.0
+        try:
+            pathfmt = self._prepare_destination(None, extension="jpg")
+            self.assertTrue(self.downloader.download(self._jpg, pathfmt))
+        finally:
+            self.downloader.out = self.job.out
+            self.downloader.progress = progress
+
+        args = out.progress.call_args[0]
+        self.assertEqual(args[0], pathfmt.path)
+        self.assertEqual(args[1:3], (len(DATA_JPG), len(DATA_JPG)))
+        out.progress_end.assert_called_once_with()
+
+    def test_http_stop(self):
+        stop = threading.Event()
+        content = self.downloader._stop_content((b"a", b"b"), stop)
+        self.assertEqual(next(content), b"a")
+        stop.set()
+        with self.assertRaises(exception.TerminateExtraction):
+            next(content)
+
     def test_http_filesize_max(self):
         pathfmt = self._prepare_destination(None, extension=None)
         self.downloader.maxsize = 100
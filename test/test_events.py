@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2021 Mike Fährmann
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+
+import os
+import sys
+import unittest
+
+import io
+import json
+import logging
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from gallery_dl import events, job, config  # noqa E402
+from gallery_dl.extractor.common import Extractor, Message  # noqa E402
+
+
+class TestEvents(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "events.jsonl")
+        config.set((), "events", self.path)
+        config.set((), "base-directory", self.dir.name)
+        config.set((), "download", False)
+        self.handlers = events.log.handlers[:]
+
+    def tearDown(self):
+        for handler in events.log.handlers[:]:
+            if handler in self.handlers:
+                continue
+            events.log.removeHandler(handler)
+            handler.close()
+        events.active = False
+        self.dir.cleanup()
+        config.clear()
+
+    def _run(self, url):
+        events.initialize()
+        self.assertTrue(events.active)
+        with io.StringIO() as buffer:
+            with contextlib.redirect_stdout(buffer):
+                job.DownloadJob(TestExtractor.from_url(url)).run()
+        for handler in events.log.handlers:
+            handler.flush()
+        with open(self.path) as fp:
+            return [json.loads(line) for line in fp]
+
+    def test_events(self):
+        result = self._run("test:events")
+        self.assertEqual([e["event"] for e in result], [
+            "job-start", "url", "success", "url", "success", "job-end"])
+
+        for event in result:
+            self.assertEqual(event["category"], "test")
+            self.assertEqual(event["job"], "test:events")
+            self.assertIsInstance(event["time"], float)
+
+        success = result[2]
+        self.assertEqual(success["url"], "https://example.org/1.jpg")
+        self.assertTrue(success["path"].endswith("1.jpg"))
+        self.assertIn("seconds", success)
+        self.assertEqual(result[-1]["status"], 0)
+
+    def test_error(self):
+        result = self._run("test:error")
+        self.assertEqual(result[-2]["event"], "error")
+        self.assertEqual(result[-2]["error"], "NotFoundError")
+        self.assertEqual(result[-1]["status"], 8)
+
+    def test_async(self):
+        config.set(("output",), "log-async", True)
+        events.initialize()
+        events.emit("foo", bar=1)
+
+        handler = events.log.handlers[-1]
+        self.assertIsInstance(handler, logging.handlers.QueueHandler)
+        handler.queue.join()
+        with open(self.path) as fp:
+            event = json.loads(fp.read())
+        self.assertEqual(event["event"], "foo")
+        self.assertEqual(event["bar"], 1)
+
+
+class TestExtractor(Extractor):
+    category = "test"
+    subcategory = "events"
+    pattern = r"test:(events|error)$"
+
+    def items(self):
+        if self.url == "test:error":
+            from gallery_dl import exception
+            raise exception.NotFoundError("foo")
+        yield Message.Directory, {}
+        for i in (1, 2):
+            yield Message.Url, "https://example.org/{}.jpg".format(i), {
+                "filename": str(i), "extension": "jpg"}
+
+
+if __name__ == "__main__":
+    unittest.main()
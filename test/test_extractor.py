@@ -10,15 +10,18 @@
 import os
 import sys
 import unittest
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 
+import re
 import time
 import string
+import threading
 from datetime import datetime, timedelta
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from gallery_dl import extractor  # noqa E402
-from gallery_dl.extractor import mastodon  # noqa E402
+import gallery_dl  # noqa E402
+from gallery_dl import extractor, config, util, exception, metrics  # noqa E402,E501
+from gallery_dl.extractor import mastodon, common  # noqa E402
 from gallery_dl.extractor.common import Extractor, Message  # noqa E402
 from gallery_dl.extractor.directlink import DirectlinkExtractor  # noqa E402
 
@@ -78,6 +81,36 @@ class TestExtractorModule(unittest.TestCase):
         self.assertEqual(classes[0], FakeExtractor)
         self.assertIsInstance(extractor.find(uri), FakeExtractor)
 
+    def test_find_class(self):
+        for uri in self.VALID_URIS:
+            self.assertIs(extractor.find_class(uri),
+                          extractor.find(uri).__class__)
+        self.assertIsNone(extractor.find_class("/tmp/file.ext"))
+
+    def test_shard(self):
+        urls = ["https://example.org/{}.jpg".format(i) for i in range(20)]
+        shards = [gallery_dl.shard(urls, k, 3) for k in (1, 2, 3)]
+        self.assertEqual(sorted(sum(shards, [])), sorted(urls))
+        self.assertEqual(shards[0], gallery_dl.shard(urls, 1, 3))
+
+        urls = ["https://a.example.org/1", "https://a.example.org/2",
+                "https://b.example.org/1", "https://b.example.org/2"]
+        for key in ("host", "category"):
+            shards = [gallery_dl.shard(urls, k, 2, key) for k in (1, 2)]
+            for result in shards:
+                self.assertIn(len(result), (0, 2, 4))
+            self.assertEqual(len(shards[0]) + len(shards[1]), 4)
+
+    def test_shard_global_options(self):
+        gconf = [((), "foo", "bar")]
+        urls = [util.ExtendedUrl(url, gconf if not i else [], [])
+                for i, url in enumerate(
+                    "https://example.org/{}.jpg".format(i)
+                    for i in range(20))]
+        for k in (1, 2, 3):
+            result = gallery_dl.shard(urls, k, 3)
+            self.assertEqual(result[0].gconfig, gconf)
+
     def test_from_url(self):
         for uri in self.VALID_URIS:
             cls = extractor.find(uri).__class__
@@ -157,6 +190,409 @@ class TestExtractorModule(unittest.TestCase):
                 self.assertEqual(expected, extr.__name__)
 
 
+class TestExtractorSession(unittest.TestCase):
+
+    def test_accept_encoding(self):
+        extr = extractor.find("test:")
+        encoding = extr.session.headers["Accept-Encoding"]
+        self.assertEqual(encoding, common.ACCEPT_ENCODING)
+        self.assertTrue(encoding.startswith("gzip, deflate"))
+
+        try:
+            import brotli  # noqa F401
+        except ImportError:
+            pass
+        else:
+            self.assertIn("br", encoding)
+
+        config.set(("extractor",), "browser", "firefox")
+        try:
+            extr = extractor.find("test:")
+        finally:
+            config.clear()
+        self.assertEqual(
+            extr.session.headers["Accept-Encoding"], common.ACCEPT_ENCODING)
+
+    def test_session_pool(self):
+        config.set(("extractor",), "browser", "firefox")
+        try:
+            extr1 = extractor.find("test:")
+            extr2 = extractor.find("test:")
+            config.set(("extractor",), "browser", "chrome")
+            extr3 = extractor.find("test:")
+        finally:
+            config.clear()
+        sess1, sess2, sess3 = extr1.session, extr2.session, extr3.session
+
+        self.assertIsNot(sess1, sess2)
+        self.assertIs(sess1.adapters["https://"], sess2.adapters["https://"])
+        self.assertIsNot(sess1.adapters["https://"],
+                         sess3.adapters["https://"])
+        self.assertEqual(sess1.headers, sess2.headers)
+        self.assertNotEqual(sess1.headers, sess3.headers)
+
+        # no shared mutable state
+        sess1.headers["X-Test"] = "value"
+        sess1.cookies.set("name", "value")
+        sess1.mount("file://", Mock())
+        self.assertNotIn("X-Test", sess2.headers)
+        self.assertEqual(len(sess2.cookies), 0)
+        self.assertNotIn("file://", sess2.adapters)
+
+    def _interval_extractor(self, per_host):
+        config.set((), "sleep-request", 2.0)
+        config.set((), "sleep-request-per-host", per_host)
+        try:
+            extr = extractor.find("test:")
+        finally:
+            config.clear()
+        extr.session.request = Mock()
+        extr.session.request.return_value.status_code = 200
+        common.Extractor.request_timestamps.clear()
+        return extr
+
+    def test_request_interval(self):
+        extr = self._interval_extractor(False)
+
+        with patch("time.sleep") as sleep, patch("time.time") as t:
+            t.return_value = 1000.0
+            extr.request("https://a.example.org/1")
+            sleep.assert_not_called()
+
+            # one interval for requests to all hosts
+            extr.request("https://b.example.org/1")
+            sleep.assert_called_with(2.0)
+            extr.request("https://a.example.org/2")
+            sleep.assert_called_with(4.0)
+        common.Extractor.request_timestamps.clear()
+
+    def test_request_interval_per_host(self):
+        extr = self._interval_extractor(True)
+
+        with patch("time.sleep") as sleep, patch("time.time") as t:
+            t.return_value = 1000.0
+            extr.request("https://a.example.org/1")
+            extr.request("https://b.example.org/1")
+            sleep.assert_not_called()
+
+            # reserve consecutive time slots for the same host
+            extr.request("https://a.example.org/2")
+            sleep.assert_called_with(2.0)
+            extr.request("https://a.example.org/3")
+            sleep.assert_called_with(4.0)
+        common.Extractor.request_timestamps.clear()
+
+    def test_request_json(self):
+        extr = extractor.find("test:")
+        extr.session.request = Mock()
+        response = extr.session.request.return_value
+        response.status_code = 200
+        response.content = '{"a": [1, "ä"]}'.encode()
+
+        self.assertEqual(
+            extr.request_json("https://example.org/"), {"a": [1, "ä"]})
+
+        metrics.active = metrics.Registry()
+        try:
+            self.assertEqual(extr.parse_json(response), {"a": [1, "ä"]})
+            self.assertEqual(metrics.active.histograms[(
+                "json_decode_seconds", (("category", extr.category),))
+            ].count, 1)
+        finally:
+            metrics.active = None
+
+
+class PrefetchExtractor(Extractor):
+    category = "fake"
+    subcategory = "prefetch"
+
+    def __init__(self, match):
+        Extractor.__init__(self, match)
+        self.count = int(match.group(1))
+        self.error = match.group(2)
+        self.closed = threading.Event()
+        self.produced = 0
+
+    def items(self):
+        data = {}
+        try:
+            for num in range(self.count):
+                data["num"] = num
+                self.produced += 1
+                yield Message.Url, num, data
+            if self.error:
+                raise exception.NotFoundError()
+        finally:
+            self.closed.set()
+
+
+class TestExtractorPrefetch(unittest.TestCase):
+
+    def tearDown(self):
+        config.clear()
+
+    def _extractor(self, url, cls=PrefetchExtractor):
+        return cls(re.match(r"prefetch:(\d+)(:error)?$", url))
+
+    def test_prefetch(self):
+        config.set((), "extractor-prefetch", 2)
+        extr = self._extractor("prefetch:5")
+        messages = list(extr)
+
+        self.assertEqual([msg[1] for msg in messages], list(range(5)))
+        # each message has its own metadata dict
+        self.assertEqual([msg[2]["num"] for msg in messages], list(range(5)))
+        self.assertTrue(extr.closed.is_set())
+
+    def test_prefetch_disabled(self):
+        extr = self._extractor("prefetch:5")
+        self.assertEqual(iter(extr).__name__, "items")
+
+        messages = list(extr)
+        self.assertEqual([msg[2]["num"] for msg in messages], [4] * 5)
+
+    def test_prefetch_stop(self):
+        config.set((), "extractor-prefetch", 1)
+        extr = self._extractor("prefetch:1000")
+        for msg in extr:
+            if msg[1] == 2:
+                break
+
+        self.assertTrue(extr.closed.wait(5))
+        self.assertLess(extr.produced, 10)
+
+    def test_prefetch_stop_explicit(self):
+        config.set((), "extractor-prefetch", 1)
+        extr = self._extractor("prefetch:1000")
+        messages = iter(extr)
+        self.assertEqual(next(messages)[1], 0)
+
+        # stops without 'messages' getting closed or garbage collected
+        extr.stop_prefetch()
+        self.assertTrue(extr.closed.is_set())
+        self.assertLess(extr.produced, 10)
+        produced = extr.produced
+        time.sleep(0.05)
+        self.assertEqual(extr.produced, produced)
+        extr.stop_prefetch()
+
+    def test_prefetch_exception(self):
+        config.set((), "extractor-prefetch", 3)
+        extr = self._extractor("prefetch:2:error")
+        results = []
+        with self.assertRaises(exception.NotFoundError):
+            for msg in extr:
+                results.append(msg[1])
+        self.assertEqual(results, [0, 1])
+
+    def test_asynchronous_mixin(self):
+        class AsyncExtractor(common.AsynchronousMixin, PrefetchExtractor):
+            pass
+
+        extr = self._extractor("prefetch:3", AsyncExtractor)
+        self.assertEqual(iter(extr).__name__, "_prefetch")
+        self.assertEqual([msg[1] for msg in extr], [0, 1, 2])
+
+        config.set((), "extractor-prefetch", 0)
+        extr = self._extractor("prefetch:3", AsyncExtractor)
+        self.assertEqual(iter(extr).__name__, "items")
+
+
+class TestExtractorMapConcurrent(unittest.TestCase):
+
+    def tearDown(self):
+        config.clear()
+
+    def test_sequential(self):
+        extr = extractor.find("test:")
+        calls = []
+
+        def func(item):
+            calls.append(item)
+            return item * 2
+
+        results = extr.map_concurrent(func, range(5))
+        self.assertEqual(calls, [])
+        self.assertEqual(next(results), 0)
+        self.assertEqual(calls, [0])
+        self.assertEqual(list(results), [2, 4, 6, 8])
+
+    def test_concurrent(self):
+        config.set((), "fetch-concurrency", 3)
+        extr = extractor.find("test:")
+        barrier = threading.Barrier(3, timeout=5)
+
+        def func(item):
+            if item < 3:
+                barrier.wait()
+            time.sleep((10 - item) * 0.001)
+            return item
+
+        self.assertEqual(
+            list(extr.map_concurrent(func, range(10))), list(range(10)))
+
+    def test_exception(self):
+        config.set((), "fetch-concurrency", 2)
+        extr = extractor.find("test:")
+        calls = []
+
+        def func(item):
+            calls.append(item)
+            if item == 3:
+                raise exception.NotFoundError()
+            return item
+
+        results = []
+        with self.assertRaises(exception.NotFoundError):
+            for item in extr.map_concurrent(func, range(100)):
+                results.append(item)
+        self.assertEqual(results, [0, 1, 2])
+        self.assertLess(len(calls), 10)
+
+    def test_cancel(self):
+        config.set((), "fetch-concurrency", 2)
+        extr = extractor.find("test:")
+        calls = []
+
+        def func(item):
+            calls.append(item)
+            return item
+
+        results = extr.map_concurrent(func, range(100))
+        self.assertEqual(next(results), 0)
+        results.close()
+        self.assertLess(len(calls), 10)
+
+    def test_cancel_running(self):
+        config.set((), "fetch-concurrency", 3)
+        extr = extractor.find("test:")
+        calls = []
+        finished = []
+
+        def func(item):
+            calls.append(item)
+            time.sleep(0.05)
+            finished.append(item)
+            return item
+
+        results = extr.map_concurrent(func, range(100))
+        self.assertEqual(next(results), 0)
+        results.close()
+
+        # calls in progress have finished and no new ones get started
+        started = len(calls)
+        self.assertEqual(sorted(finished), sorted(calls))
+        time.sleep(0.1)
+        self.assertEqual(len(calls), started)
+        self.assertLess(started, 10)
+
+
+class TestGalleryExtractor(unittest.TestCase):
+
+    def test_items(self):
+        class Gallery(common.GalleryExtractor):
+            category = "fake"
+            root = "https://example.org"
+            lazy = False
+
+            def request(self, url, **kwargs):
+                return Mock(text="")
+
+            def metadata(self, page):
+                return {"gallery_id": 1, "tags": ["a", "b"]}
+
+            def images(self, page):
+                images = [
+                    ("https://example.org/1.jpg", {"width": 100}),
+                    ("https://example.org/2.png", None),
+                ]
+                return iter(images) if self.lazy else images
+
+        extr = Gallery(re.match("(.*)", "/g/1"))
+        messages = list(extr.items())
+        self.assertEqual(len(messages), 2)
+        base = messages[0][1]
+        self.assertEqual(base, {"gallery_id": 1, "tags": ["a", "b"],
+                                "count": 2})
+
+        self.assertEqual(messages[1][0], Message.UrlBatch)
+        (url1, first), (url2, second) = messages[1][1]
+        self.assertEqual(url1, "https://example.org/1.jpg")
+        self.assertIs(first.base, base)
+        self.assertIs(second.base, base)
+        self.assertEqual(dict(first), {
+            "gallery_id": 1, "tags": ["a", "b"], "count": 2, "num": 1,
+            "width": 100, "filename": "1", "extension": "jpg"})
+        self.assertEqual(second["num"], 2)
+        self.assertEqual(second["extension"], "png")
+        self.assertNotIn("width", second)
+
+        # lazily generated images are sent one by one
+        extr = Gallery(re.match("(.*)", "/g/1"))
+        extr.lazy = True
+        messages = list(extr.items())
+        self.assertEqual(len(messages), 3)
+        self.assertEqual(messages[1][:2],
+                         (Message.Url, "https://example.org/1.jpg"))
+
+
+class TestGelbooruV02Extractor(unittest.TestCase):
+
+    def test_api_request(self):
+        extr = extractor.find(
+            "https://safebooru.org/index.php?page=post&s=view&id=1")
+        response = Mock()
+        response.text = (
+            '<?xml version="1.0" encoding="UTF-8"?><posts count="2" '
+            'offset="0"><post id="1" tags="a b"/><post id="2" tags="ä"/>'
+            '</posts>')
+        extr.request = Mock(return_value=response)
+
+        self.assertEqual([post.attrib for post in extr._api_request({})], [
+            {"id": "1", "tags": "a b"},
+            {"id": "2", "tags": "ä"},
+        ])
+
+    def test_api_request_invalid(self):
+        extr = extractor.find(
+            "https://safebooru.org/index.php?page=post&s=view&id=1")
+        response = Mock()
+        response.text = '<posts><post id="1"/>'
+        extr.request = Mock(return_value=response)
+
+        with self.assertRaises(exception.StopExtraction):
+            extr._api_request({"id": "1"})
+
+
+class TestImagefapExtractor(unittest.TestCase):
+
+    def _images(self, count, total):
+        extr = extractor.find("https://www.imagefap.com/pictures/7102714")
+        offsets = []
+
+        def get_page(offset):
+            offsets.append(offset)
+            num = max(0, min(24, total - offset))
+            return "".join(
+                '<a href="https://example.org/{}.jpg">'.format(offset + i)
+                for i in range(num))
+
+        extr._get_page = get_page
+        images = list(extr.get_images(count))
+        return len(images), sorted(offsets)
+
+    def test_get_images(self):
+        self.assertEqual(self._images(50, 50), (50, [0, 24, 48]))
+        self.assertEqual(self._images(48, 48), (48, [0, 24, 48]))
+        self.assertEqual(self._images(0, 30), (30, [0, 24]))
+
+    def test_get_images_wrong_count(self):
+        # too large: stop at the first partial page
+        self.assertEqual(self._images(100, 30)[0], 30)
+        # too small: keep fetching pages one by one
+        self.assertEqual(self._images(10, 60), (60, [0, 24, 48]))
+
+
 class TestExtractorWait(unittest.TestCase):
 
     def test_wait_seconds(self):
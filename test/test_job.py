@@ -13,10 +13,14 @@ import unittest
 from unittest.mock import patch
 
 import io
+import json
+import time
+import tempfile
+import threading
 import contextlib
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from gallery_dl import job, config, text  # noqa E402
+from gallery_dl import job, config, text, exception  # noqa E402
 from gallery_dl.extractor.common import Extractor, Message  # noqa E402
 
 
@@ -36,6 +40,21 @@ class TestJob(unittest.TestCase):
                 jobinstance.run()
             return buffer.getvalue()
 
+    def _assert_interrupted(self, tjob):
+        """Check that child jobs in a thread pool stop with their parent"""
+        TestExtractorSlow.count = 0
+        TestExtractorSlow.started.clear()
+        started = time.monotonic()
+        with self.assertRaises(KeyboardInterrupt):
+            self._capture_stdout(tjob)
+        self.assertLess(time.monotonic() - started, 1.0)
+
+        time.sleep(0.1)
+        count = TestExtractorSlow.count
+        time.sleep(0.1)
+        self.assertEqual(TestExtractorSlow.count, count)
+        self.assertLess(count, 100)
+
 
 class TestKeywordJob(TestJob):
     jobclass = job.KeywordJob
@@ -82,6 +101,14 @@ class TestUrlJob(TestJob):
 https://example.org/1.jpg
 https://example.org/2.jpg
 https://example.org/3.jpg
+""")
+
+    def test_batch(self):
+        config.set((), "image-range", "2-")
+        extr = TestExtractorBatch.from_url("test:batch")
+        self.assertEqual(self._capture_stdout(extr), """\
+https://example.org/2.jpg
+https://example.org/3.jpg
 """)
 
     def test_fallback(self):
@@ -115,6 +142,177 @@ https://example.org/2.jpg
 https://example.org/3.jpg
 """)
 
+    def test_concurrency(self):
+        config.set((), "queue-concurrency", 3)
+        extr = TestExtractorDelayParent.from_url("test:delay")
+        tjob = job.UrlJob(extr, depth=0)
+        self.assertIsNotNone(tjob.executor)
+
+        self.assertEqual(self._capture_stdout(tjob), """\
+https://example.org/delay/3.jpg
+https://example.org/delay/2.jpg
+https://example.org/parent.jpg
+https://example.org/delay/1.jpg
+https://example.org/delay/0.jpg
+""")
+
+    def test_concurrency_unordered(self):
+        config.set((), "queue-concurrency", 4)
+        config.set((), "queue-ordered", False)
+        extr = TestExtractorDelayParent.from_url("test:delay")
+        tjob = job.UrlJob(extr, depth=0)
+
+        output = self._capture_stdout(tjob).splitlines()
+        self.assertEqual(output[0], "https://example.org/parent.jpg")
+        self.assertEqual(output[1], "https://example.org/delay/0.jpg")
+        self.assertEqual(sorted(output[2:]), [
+            "https://example.org/delay/1.jpg",
+            "https://example.org/delay/2.jpg",
+            "https://example.org/delay/3.jpg",
+        ])
+
+    def test_concurrency_interrupt(self):
+        config.set((), "queue-concurrency", 2)
+        extr = TestExtractorInterruptParent.from_url("test:interrupt")
+        self._assert_interrupted(job.UrlJob(extr, depth=0))
+
+
+class TestDownloadJob(TestJob):
+    jobclass = job.SimulationJob
+
+    def test_concurrency(self):
+        config.set((), "queue-concurrency", 2)
+        TestExtractorStatus.barrier = threading.Barrier(2, timeout=5)
+        extr = TestExtractorStatusParent.from_url("test:status")
+        tjob = self.jobclass(extr)
+        self.assertIsNotNone(tjob.executor)
+
+        # both child jobs wait for each other
+        # and their exit status gets combined
+        self._capture_stdout(tjob)
+        self.assertEqual(tjob.status, 4 | 8)
+        self.assertFalse(tjob.pending)
+
+        # the job's thread pool got shut down
+        with self.assertRaises(RuntimeError):
+            tjob.executor.submit(int)
+
+    def test_concurrency_interrupt(self):
+        config.set((), "queue-concurrency", 2)
+        extr = TestExtractorInterruptParent.from_url("test:interrupt")
+        self._assert_interrupted(self.jobclass(extr))
+
+    def test_prefetch_stop(self):
+        config.set((), "extractor-prefetch", 1)
+        extr = TestExtractorSlow.from_url("test:slow/1")
+        tjob = self.jobclass(extr)
+        tjob.handle_url = None  # TypeError on the first file
+
+        self._capture_stdout(tjob)
+        self.assertEqual(tjob.status, 1)
+
+        # the prefetch thread got stopped and joined by Job.run()
+        self.assertIsNone(extr._prefetch_thread)
+        count = TestExtractorSlow.count
+        time.sleep(0.1)
+        self.assertEqual(TestExtractorSlow.count, count)
+
+    @patch.object(job.DownloadJob, "prune_metadata", True)
+    def test_metadata_fields(self):
+        extr = TestExtractor.from_url("test:")
+        self.jobclass(extr)
+        self.assertEqual(extr._fields, {"category", "filename", "extension"})
+        self.assertFalse(extr.metadata_needed("tags", "user"))
+        self.assertTrue(extr.metadata_needed("tags", "file*"))
+
+        config.set((), "directory", {"tags_artist": ["{user[name]}"]})
+        config.set((), "image-filter", "num > 1")
+        config.set((), "postprocessors", [
+            {"name": "mtime"},
+            {"name": "exec", "command": ["echo", "{id}"]},
+        ])
+        extr = TestExtractor.from_url("test:")
+        self.jobclass(extr)
+        self.assertEqual(extr._fields, {
+            "category", "filename", "extension", "tags_artist", "user",
+            "num", "date", "id"})
+        self.assertTrue(extr.metadata_needed("tags_*"))
+
+    @patch.object(job.DownloadJob, "prune_metadata", True)
+    def test_metadata_fields_all(self):
+        config.set((), "postprocessors", [{"name": "metadata"}])
+        extr = TestExtractor.from_url("test:")
+        self.jobclass(extr)
+        self.assertIsNone(extr._fields)
+        self.assertTrue(extr.metadata_needed("foo"))
+
+        config.set((), "postprocessors", ())
+        config.set((), "image-filter", "'a' in locals()")
+        extr = TestExtractor.from_url("test:")
+        self.jobclass(extr)
+        self.assertIsNone(extr._fields)
+
+    def test_metadata_fields_disabled(self):
+        extr = TestExtractor.from_url("test:")
+        self.jobclass(extr)
+        self.assertIsNone(extr._fields)
+
+    @patch.object(job.DownloadJob, "prune_metadata", True)
+    def test_metadata_fields_format(self):
+        config.set((), "filename", "{id}_{tags_artist}.{extension}")
+        extr = TestExtractorTags.from_url("test:tags")
+        tjob = RecordJob(extr)
+        self._capture_stdout(tjob)
+
+        kwdict = tjob.kwdicts[0]
+        self.assertEqual(kwdict["tags_artist"], "foo")
+        self.assertNotIn("notes", kwdict)
+
+    def test_batch_archive(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            config.set((), "archive", os.path.join(tmpdir, "archive.db"))
+            config.set((), "image-range", "1-2")
+            extr = TestExtractorBatch.from_url("test:batch")
+            self._capture_stdout(extr)
+
+            # SimulationJob does not check its archive
+            extr = TestExtractorBatch.from_url("test:batch")
+            tjob = job.DownloadJob(extr)
+            tjob.initialize()
+            statements = []
+            tjob.archive.cursor.connection.set_trace_callback(
+                statements.append)
+
+            with patch.object(tjob, "handle_skip") as skip:
+                self._capture_stdout(tjob)
+
+            # both selected files get looked up with a single query
+            self.assertEqual(skip.call_count, 2)
+            self.assertEqual(
+                [s for s in statements if s.startswith("SELECT")],
+                ["SELECT entry FROM archive WHERE entry IN "
+                 "('test_category1','test_category2')"])
+
+    def test_concurrency_child(self):
+        config.set((), "queue-concurrency", 2)
+        extr = TestExtractorStatusParent.from_url("test:status")
+        tjob = self.jobclass(extr)
+        child = self.jobclass(
+            TestExtractorStatus.from_url("test:status/4"), tjob)
+        self.assertIsNone(child.executor)
+        self.assertTrue(child.pooled)
+
+    def test_concurrency_parent_skip(self):
+        config.set((), "queue-concurrency", 2)
+        config.set((), "parent-skip", True)
+        TestExtractorStatus.barrier = None
+        extr = TestExtractorStatusParent.from_url("test:status")
+        tjob = self.jobclass(extr)
+        self.assertIsNone(tjob.executor)
+
+        self._capture_stdout(tjob)
+        self.assertEqual(tjob.status, 4 | 8)
+
 
 class TestInfoJob(TestJob):
     jobclass = job.InfoJob
@@ -287,6 +485,71 @@ class TestDataJob(TestJob):
         self.assertEqual(tjob.data[-1][0], Message.Url)
         self.assertEqual(tjob.data[-1][2]["num"], "3")
 
+    def test_json_lines(self):
+        config.set(("output",), "json-lines", True)
+        extr = TestExtractor.from_url("test:")
+        tjob = self.jobclass(extr, file=io.StringIO())
+
+        tjob.run()
+
+        self.assertEqual(tjob.data, [])
+        lines = tjob.file.getvalue().splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(json.loads(lines[0]), [
+            Message.Directory, {
+                "category"   : "test_category",
+                "subcategory": "test_subcategory",
+            },
+        ])
+        self.assertEqual(json.loads(lines[3]), [
+            Message.Url, "https://example.org/3.jpg", {
+                "category"   : "test_category",
+                "subcategory": "test_subcategory",
+                "filename"   : "3",
+                "extension"  : "jpg",
+                "num"        : 3,
+                "tags"       : ["foo", "bar", "\u30c6\u30b9\u30c8"],
+                "user"       : {"id": 123, "name": "test"},
+            },
+        ])
+
+    def test_json_lines_num_string(self):
+        config.set(("output",), "json-lines", True)
+        config.set(("output",), "num-to-str", True)
+        extr = TestExtractor.from_url("test:")
+        tjob = self.jobclass(extr, file=io.StringIO())
+        messages = []
+        tjob.dispatch = lambda msg: (
+            messages.append(msg), job.DataJob.dispatch(tjob, msg))
+
+        tjob.run()
+
+        kwdict = json.loads(tjob.file.getvalue().splitlines()[-1])[2]
+        self.assertEqual(kwdict["num"], "3")
+        self.assertEqual(kwdict["user"]["id"], "123")
+        # original metadata stays unchanged
+        self.assertEqual(messages[-1][2]["user"]["id"], 123)
+
+    def test_json_lines_exception(self):
+        config.set(("output",), "json-lines", True)
+        extr = TestExtractorException.from_url("test:exception")
+        tjob = self.jobclass(extr, file=io.StringIO())
+        tjob.run()
+        self.assertEqual(
+            tjob.file.getvalue(),
+            '["ZeroDivisionError", "division by zero"]\n')
+
+
+class RecordJob(job.SimulationJob):
+
+    def __init__(self, url, parent=None):
+        job.SimulationJob.__init__(self, url, parent)
+        self.kwdicts = []
+
+    def handle_url(self, url, kwdict):
+        self.kwdicts.append(kwdict.copy())
+        job.SimulationJob.handle_url(self, url, kwdict)
+
 
 class TestExtractor(Extractor):
     category = "test_category"
@@ -309,6 +572,21 @@ class TestExtractor(Extractor):
             })
 
 
+class TestExtractorTags(Extractor):
+    category = "test_category"
+    subcategory = "test_subcategory_tags"
+    pattern = r"test:tags$"
+
+    def items(self):
+        data = {"id": 1, "extension": "jpg"}
+        if self.metadata_needed("tags_*"):
+            data["tags_artist"] = "foo"
+        if self.metadata_needed("notes"):
+            data["notes"] = []
+        yield Message.Directory, data
+        yield Message.Url, "https://example.org/1.jpg", data
+
+
 class TestExtractorParent(Extractor):
     category = "test_category"
     subcategory = "test_subcategory_parent"
@@ -325,6 +603,103 @@ class TestExtractorParent(Extractor):
             }
 
 
+class TestExtractorDelayParent(Extractor):
+    category = "test_category"
+    subcategory = "test_subcategory_delay_parent"
+    pattern = r"test:delay$"
+
+    def items(self):
+        for delay in (3, 2):
+            yield Message.Queue, "test:delay/{}".format(delay), {
+                "_extractor": TestExtractorDelay}
+        yield Message.Url, "https://example.org/parent.jpg", {}
+        for delay in (1, 0):
+            yield Message.Queue, "test:delay/{}".format(delay), {
+                "_extractor": TestExtractorDelay}
+
+
+class TestExtractorDelay(Extractor):
+    category = "test_category"
+    subcategory = "test_subcategory_delay"
+    pattern = r"test:delay/(\d+)$"
+
+    def items(self):
+        delay = self.url.rpartition("/")[2]
+        time.sleep(int(delay) * 0.05)
+        yield Message.Url, "https://example.org/delay/{}.jpg".format(
+            delay), {}
+
+
+class TestExtractorInterruptParent(Extractor):
+    category = "test_category"
+    subcategory = "test_subcategory_interrupt"
+    pattern = r"test:interrupt$"
+
+    def items(self):
+        for num in range(2):
+            yield Message.Queue, "test:slow/{}".format(num), {
+                "_extractor": TestExtractorSlow}
+        TestExtractorSlow.started.wait(5)
+        raise KeyboardInterrupt()
+
+
+class TestExtractorSlow(Extractor):
+    category = "test_category"
+    subcategory = "test_subcategory_slow"
+    pattern = r"test:slow/(\d+)$"
+    started = threading.Event()
+    count = 0
+
+    def items(self):
+        TestExtractorSlow.started.set()
+        yield Message.Directory, {}
+        for num in range(50):
+            TestExtractorSlow.count += 1
+            yield Message.Url, "https://example.org/{}.jpg".format(num), {
+                "filename": str(num), "extension": "jpg"}
+            time.sleep(0.05)
+
+
+class TestExtractorBatch(Extractor):
+    category = "test_category"
+    subcategory = "test_subcategory_batch"
+    archive_fmt = "{num}"
+    pattern = r"test:batch$"
+
+    def items(self):
+        yield Message.Directory, {}
+        yield Message.UrlBatch, [
+            ("https://example.org/{}.jpg".format(i), {
+                "num": i, "filename": str(i), "extension": "jpg"})
+            for i in range(1, 4)
+        ]
+
+
+class TestExtractorStatusParent(Extractor):
+    category = "test_category"
+    subcategory = "test_subcategory_status_parent"
+    pattern = r"test:status$"
+
+    def items(self):
+        for code in (4, 8):
+            yield Message.Queue, "test:status/{}".format(code), {
+                "_extractor": TestExtractorStatus}
+
+
+class TestExtractorStatus(Extractor):
+    category = "test_category"
+    subcategory = "test_subcategory_status"
+    pattern = r"test:status/(\d+)$"
+    barrier = None
+
+    def items(self):
+        if self.barrier:
+            self.barrier.wait()
+        if self.url.endswith("4"):
+            raise exception.HttpError("")
+        raise exception.NotFoundError()
+
+
 class TestExtractorException(Extractor):
     category = "test_category"
     subcategory = "test_subcategory_exception"
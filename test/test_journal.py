@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2021 Mike Fährmann
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+import time
+import datetime
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from gallery_dl import journal, job, config  # noqa E402
+from gallery_dl.extractor.common import Extractor, Message  # noqa E402
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "journal.sqlite3")
+        self.journal = journal.Journal(self.path)
+
+    def tearDown(self):
+        self.journal.close()
+        self.dir.cleanup()
+        config.clear()
+
+    def test_add(self):
+        self.assertTrue(self.journal.add("test:1"))
+        self.assertTrue(self.journal.add("test:2", {"config": []}))
+        self.assertFalse(self.journal.add("test:1"))
+        self.assertEqual(self.journal.count(journal.PENDING), 2)
+
+    def test_lease(self):
+        date = datetime.datetime(2021, 1, 2, 3, 4, 5, 6)
+        self.journal.add("test:1", {"kwdict": {"date": date}})
+        self.journal.add("test:2")
+
+        entry_id, url, data = self.journal.lease()
+        self.assertEqual(url, "test:1")
+        self.assertEqual(data, {"kwdict": {"date": date}})
+        self.assertEqual(self.journal.count(journal.ACTIVE), 1)
+
+        self.assertEqual(self.journal.lease()[1:], ("test:2", {}))
+        self.assertIsNone(self.journal.lease())
+
+        self.journal.finish(entry_id, 4)
+        self.assertEqual(self.journal.count(journal.ACTIVE), 1)
+        self.assertEqual(self.journal.count(journal.DONE), 1)
+
+    def test_release(self):
+        self.journal.add("test:1")
+        entry_id = self.journal.lease()[0]
+        self.journal.release(entry_id)
+        self.assertEqual(self.journal.lease()[0], entry_id)
+
+    def test_lease_expired(self):
+        other = journal.Journal(self.path, lease_time=10.0)
+        self.journal.add("test:1")
+
+        with patch("time.time") as t:
+            t.return_value = 1000.0
+            self.assertEqual(other.lease()[1], "test:1")
+            t.return_value = 1005.0
+            self.assertIsNone(self.journal.lease())
+            t.return_value = 1011.0
+            self.assertEqual(self.journal.lease()[1], "test:1")
+        other.close()
+
+    def test_renew(self):
+        other = journal.Journal(self.path, lease_time=10.0)
+        self.journal.add("test:1")
+
+        with patch("time.time") as t:
+            t.return_value = 1000.0
+            entry_id = other.lease()[0]
+            t.return_value = 1008.0
+            other.renew(entry_id)
+            t.return_value = 1011.0
+            self.assertIsNone(self.journal.lease())
+        other.close()
+
+    def test_reclaim(self):
+        self.journal.add("test:1")
+        entry_id = self.journal.lease()[0]
+
+        with patch("gallery_dl.journal._process_alive") as alive:
+            alive.return_value = True
+            self.journal.reclaim()
+            self.assertIsNone(self.journal.lease())
+
+            alive.return_value = False
+            self.journal.reclaim()
+            self.assertEqual(self.journal.lease()[0], entry_id)
+
+    def test_dumps_fallback(self):
+        data = {"kwdict": {"a": 1, "gen": (i for i in ()), "_b": 2}}
+        self.journal.add("test:1", data)
+        kwdict = self.journal.lease()[2]["kwdict"]
+        self.assertEqual(kwdict["a"], 1)
+        self.assertIsInstance(kwdict["gen"], str)
+        self.assertNotIn("_b", kwdict)
+
+    def test_dumps_loads(self):
+        tz = datetime.timezone(datetime.timedelta(hours=2))
+        data = {
+            "extractor": TestExtractorChild,
+            "kwdict": {"date": datetime.datetime(2021, 1, 2, 5, tzinfo=tz)},
+        }
+        text = journal.dumps(data)
+        self.assertIsInstance(text, str)
+        self.assertEqual(journal.loads(text), {
+            "extractor": TestExtractorChild,
+            "kwdict": {"date": datetime.datetime(2021, 1, 2, 3)},
+        })
+
+        self.assertIsNone(journal.dumps(None))
+        self.assertEqual(journal.loads(None), {})
+        with self.assertRaises(ValueError):
+            journal.loads('{"extractor": "gallery_dl.job:DownloadJob"}')
+
+        # pickled data of older versions
+        self.assertEqual(journal.loads(b"\x80\x04}\x94."), {})
+
+    def test_heartbeat(self):
+        other = journal.Journal(self.path, lease_time=0.2)
+        other.add("test:1")
+        entry_id = other.lease()[0]
+
+        with journal.Heartbeat(other, entry_id):
+            time.sleep(0.5)
+            self.assertIsNone(self.journal.lease())
+        other.close()
+
+    def test_run(self):
+        config.set((), "parent-metadata", "parent")
+        self.journal.add("test:parent", {"extractor": TestExtractorParent})
+
+        RecordJob.results = []
+        retval = journal.run(self.path, (), RecordJob)
+
+        self.assertEqual(retval, 0)
+        self.assertEqual(len(RecordJob.results), 4)
+        url, kwdict = RecordJob.results[0]
+        self.assertEqual(url, "https://example.org/a/1.jpg")
+        self.assertEqual(kwdict["parent"]["name"], "a")
+        self.assertEqual(kwdict["category"], "test_category")
+        self.assertEqual(kwdict["subcategory"], "test_parent")
+        self.assertEqual(self.journal.count(journal.DONE), 3)
+
+    def test_run_resume(self):
+        self.journal.add("test:parent", {"extractor": TestExtractorParent})
+        self.journal.add("test:child/a", {"extractor": TestExtractorChild})
+        self.journal.finish(self.journal.lease()[0])
+
+        RecordJob.results = []
+        journal.run(self.path, (), RecordJob)
+
+        self.assertEqual([url for url, _ in RecordJob.results], [
+            "https://example.org/a/1.jpg",
+            "https://example.org/a/2.jpg",
+        ])
+
+
+class RecordJob(job.DownloadJob):
+    results = []
+
+    def handle_url(self, url, kwdict):
+        self.results.append((url, kwdict))
+
+    def handle_directory(self, kwdict):
+        pass
+
+
+class TestExtractorParent(Extractor):
+    category = "test_category"
+    subcategory = "test_parent"
+    categorytransfer = True
+    pattern = r"test:parent$"
+
+    def items(self):
+        for name in ("a", "b", "a"):
+            yield Message.Queue, "test:child/" + name, {
+                "name": name,
+                "_extractor": TestExtractorChild,
+            }
+
+
+class TestExtractorChild(Extractor):
+    category = "test_category"
+    subcategory = "test_child"
+    pattern = r"test:child/(\w+)$"
+
+    def items(self):
+        name = self.url.rpartition("/")[2]
+        yield Message.Directory, {}
+        for i in (1, 2):
+            yield Message.Url, "https://example.org/{}/{}.jpg".format(
+                name, i), {"num": i}
+
+
+if __name__ == "__main__":
+    unittest.main()
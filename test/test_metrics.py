@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2021 Mike Fährmann
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+
+import os
+import sys
+import unittest
+from unittest.mock import Mock
+
+import json
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from gallery_dl import metrics, config  # noqa E402
+
+
+class TestRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_count(self):
+        self.registry.count("foo_total", category="a")
+        self.registry.count("foo_total", 2, category="a")
+        self.registry.count("foo_total", 5, category="b")
+
+        self.assertEqual(self.registry.counters, {
+            ("foo_total", (("category", "a"),)): 3,
+            ("foo_total", (("category", "b"),)): 5,
+        })
+
+    def test_observe(self):
+        for value in (0.001, 0.3, 0.3, 100.0, 1000.0):
+            self.registry.observe("bar_seconds", value, host="example.org")
+
+        hist = self.registry.histograms[
+            ("bar_seconds", (("host", "example.org"),))]
+        self.assertEqual(hist.count, 5)
+        self.assertAlmostEqual(hist.sum, 1100.601)
+
+        buckets = dict(hist.cumulative())
+        self.assertEqual(buckets[0.005], 1)
+        self.assertEqual(buckets[0.25], 1)
+        self.assertEqual(buckets[0.5], 3)
+        self.assertEqual(buckets[300.0], 4)
+        self.assertEqual(buckets["+Inf"], 5)
+
+    def test_as_dict(self):
+        self.registry.count("foo_total", 3, category="a")
+        self.registry.observe("bar_seconds", 0.5)
+
+        data = self.registry.as_dict()
+        self.assertEqual(data["counters"], [
+            {"name": "foo_total", "labels": {"category": "a"}, "value": 3},
+        ])
+        hist = data["histograms"][0]
+        self.assertEqual(hist["name"], "bar_seconds")
+        self.assertEqual(hist["count"], 1)
+        self.assertEqual(hist["buckets"]["0.5"], 1)
+        self.assertEqual(hist["buckets"]["0.25"], 0)
+
+    def test_as_prometheus(self):
+        self.registry.count("foo_total", 3, category='a"b')
+        self.registry.observe("bar_seconds", 0.5, host="x")
+
+        text = self.registry.as_prometheus()
+        self.assertIn("# TYPE gallerydl_foo_total counter\n", text)
+        self.assertIn('gallerydl_foo_total{category="a\\"b"} 3\n', text)
+        self.assertIn("# TYPE gallerydl_bar_seconds histogram\n", text)
+        self.assertIn(
+            'gallerydl_bar_seconds_bucket{host="x",le="0.5"} 1\n', text)
+        self.assertIn(
+            'gallerydl_bar_seconds_bucket{host="x",le="+Inf"} 1\n', text)
+        self.assertIn('gallerydl_bar_seconds_sum{host="x"} 0.5\n', text)
+        self.assertIn('gallerydl_bar_seconds_count{host="x"} 1\n', text)
+
+
+class TestMetrics(unittest.TestCase):
+
+    def tearDown(self):
+        metrics.active = None
+        config.clear()
+
+    def test_initialize(self):
+        self.assertIsNone(metrics.initialize())
+
+        config.set(("output",), "metrics", "/dev/null")
+        registry = metrics.initialize()
+        self.assertIsInstance(registry, metrics.Registry)
+        self.assertIs(metrics.initialize(), registry)
+
+    def test_write(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path_json = os.path.join(tmpdir, "metrics.json")
+            path_prom = os.path.join(tmpdir, "metrics.prom")
+            config.set(("output",), "metrics", path_json)
+            config.set(("output",), "metrics-prometheus", path_prom)
+
+            metrics.initialize().count("foo_total", 1)
+            metrics.write()
+
+            with open(path_json) as fp:
+                data = json.load(fp)
+            self.assertEqual(data["counters"][0]["value"], 1)
+
+            with open(path_prom) as fp:
+                self.assertIn("gallerydl_foo_total 1\n", fp.read())
+
+    def test_instrument_archive(self):
+        metrics.active = metrics.Registry()
+        archive = Mock()
+        archive.check.side_effect = (True, False, False)
+
+        metrics.instrument_archive(archive, "test")
+        archive.check({})
+        archive.check({})
+        archive.check({})
+        archive.add({})
+
+        counters = metrics.active.counters
+        self.assertEqual(counters[("archive_checks_total", (
+            ("category", "test"), ("result", "hit")))], 1)
+        self.assertEqual(counters[("archive_checks_total", (
+            ("category", "test"), ("result", "miss")))], 2)
+        self.assertEqual(metrics.active.histograms[("archive_seconds", (
+            ("category", "test"), ("operation", "add")))].count, 1)
+
+    def test_instrument_hook(self):
+        metrics.active = metrics.Registry()
+        callback = Mock()
+
+        hook = metrics.instrument_hook(callback, "file", "test", "exec")
+        hook("pathfmt")
+        hook("pathfmt")
+
+        callback.assert_called_with("pathfmt")
+        self.assertEqual(metrics.active.histograms[("postprocessor_seconds", (
+            ("category", "test"), ("postprocessor", "exec"),
+            ("event", "file")))].count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
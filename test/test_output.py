@@ -10,6 +10,10 @@
 import os
 import sys
 import unittest
+from unittest.mock import patch, Mock
+
+import io
+import logging
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from gallery_dl import output  # noqa E402
@@ -152,5 +156,145 @@ class TestShortenEAW(unittest.TestCase):
         self.assertEqual(f(s, 19, "")   , "幻-想-郷###幻-想-郷")
 
 
+class TestProgress(unittest.TestCase):
+
+    def test_format_progress(self):
+        self.assertEqual(
+            output.format_progress(None, 1500, 300),
+            "  1.50kB     300B/s")
+        self.assertEqual(
+            output.format_progress(4000, 1000, 1000),
+            " 25%   1.00kB/4.00kB   1.00kB/s ETA 0:00:03")
+        self.assertEqual(
+            output.format_progress(4000, 1000, 0),
+            " 25%   1.00kB/4.00kB       0B/s ETA -:--:--")
+
+    @patch("time.monotonic")
+    def test_board_ansi(self, monotonic):
+        stream = io.StringIO()
+        board = output.ProgressBoard(True, stream)
+
+        monotonic.return_value = 100.0
+        board.update(1, ("a.jpg", None, 10, 5), 40)
+        self.assertEqual(stream.getvalue(), "\r\033[J" + (
+            "a.jpg" + " " * 14 + "  " + "     10B       5B/s") + "\r")
+
+        # throttled
+        board.update(2, ("b.jpg", None, 10, 5), 40)
+        self.assertEqual(stream.getvalue().count("\n"), 0)
+
+        monotonic.return_value = 101.0
+        board.update(1, ("a.jpg", None, 20, 5), 40)
+        lines = stream.getvalue().split("\033[J")[-1]
+        self.assertEqual(lines.count("\n"), 1)
+        self.assertTrue(lines.endswith("\033[1A\r"))
+        self.assertEqual(board.drawn, 2)
+
+        board.remove(1)
+        self.assertTrue(stream.getvalue().endswith("\r\033[J"))
+        self.assertEqual(board.drawn, 0)
+        self.assertEqual(list(board.entries), [2])
+
+    @patch("time.monotonic")
+    def test_board_plain(self, monotonic):
+        stream = io.StringIO()
+        board = output.ProgressBoard(False, stream)
+
+        monotonic.return_value = 100.0
+        board.update(1, ("a.jpg", 100, 10, 5), 80)
+        board.update(2, ("b.jpg", 100, 20, 5), 80)
+        monotonic.return_value = 101.0
+        board.update(2, ("b.jpg", 100, 30, 5), 80)
+        line = stream.getvalue().rpartition("\r")[2]
+        self.assertTrue(line.startswith("2 downloads   20% "), line)
+
+        board.clear()
+        self.assertEqual(stream.getvalue().rpartition("\r")[0][-1], " ")
+        self.assertEqual(board.drawn, 0)
+
+
+class TestQueueHandler(unittest.TestCase):
+
+    def test_snapshot(self):
+        class Job():
+            pathfmt = None
+
+        job = Job()
+        logger = output.Logger("test")
+        adapter = output.LoggerAdapter(logger, {
+            "path"    : output.PathfmtProxy(job),
+            "keywords": output.KwdictProxy(job),
+        })
+        records = []
+        handler = output.QueueHandler(Mock(put_nowait=records.append))
+        logger.addHandler(handler)
+
+        adapter.info("foo %s", "bar")
+        job.pathfmt = pathfmt = Mock()
+        pathfmt.__dict__.update({"filename": "a.jpg", "kwdict": {"id": 1}})
+        adapter.info("baz")
+        pathfmt.__dict__.update({"filename": "b.jpg", "kwdict": {"id": 2}})
+
+        fmt = "{msg} {path.filename} {keywords.id}".format_map
+        self.assertEqual(fmt(records[0].__dict__), "foo bar None None")
+        self.assertEqual(fmt(records[1].__dict__), "baz a.jpg 1")
+        self.assertIsNone(records[0].args)
+
+    def test_snapshot_fields(self):
+        class Job():
+            pathfmt = Mock()
+
+        job = Job()
+        job.pathfmt.__dict__.update({
+            "filename": "a.jpg", "path": "/a.jpg", "kwdict": {"id": 1}})
+        logger = output.Logger("test")
+        adapter = output.LoggerAdapter(logger, {
+            "path"    : output.PathfmtProxy(job),
+            "keywords": output.KwdictProxy(job),
+        })
+        records = []
+        handler = output.QueueHandler(
+            Mock(put_nowait=records.append), {"path": {"filename"}})
+        logger.addHandler(handler)
+
+        adapter.info("foo")
+        data = records[0].__dict__
+        self.assertEqual(data["path"].filename, "a.jpg")
+        self.assertIsNone(data["path"].path)
+        self.assertIsNone(data["keywords"].id)
+
+    def test_proxy_fields(self):
+        self.assertEqual(output.proxy_fields(("{message}",)), {})
+        self.assertEqual(output.proxy_fields((
+            "{path.filename} {keywords.id}",
+            "{path.extension:?(/)/} {keywords.id}",
+        )), {
+            "path": {"filename", "extension"},
+            "keywords": {"id"},
+        })
+        self.assertEqual(output.proxy_fields((
+            "{keywords.id}", "{keywords!s}", "{keywords.title}",
+        )), {"keywords": None})
+
+        formatter = output.Formatter(
+            {"error": "{path.filename}: {message}"}, None)
+        self.assertEqual(formatter.fields, {"path": {"filename"}})
+
+    def test_queue_handler(self):
+        stream = io.StringIO()
+        handler = logging.StreamHandler(stream)
+        handler.setLevel(logging.WARNING)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+
+        qhandler = output.queue_handler(handler)
+        self.assertEqual(qhandler.level, logging.WARNING)
+        logger = output.Logger("test")
+        logger.addHandler(qhandler)
+        logger.warning("foo")
+        logger.info("bar")
+        qhandler.queue.join()
+        self.assertEqual(stream.getvalue(), "foo\n")
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -268,6 +268,16 @@ class MetadataTest(BasePostprocessorTest):
         test({"mode": "custom", "content-format": ["{foo}", "{missing}"]})
         test({"mode": "custom", "format": "{foo}\n{missing}\n"})
 
+    def test_metadata_fields(self):
+        pp = postprocessor.find("metadata")
+        self.assertIsNone(pp.fields({}))
+        self.assertEqual(pp.fields({"mode": "tags"}), {"tags", "tag_string"})
+        self.assertEqual(pp.fields({
+            "mode": "custom",
+            "format": ["{foo}", "{bar[baz]}"],
+            "filename": "{id}.txt",
+        }), {"foo", "bar", "id"})
+
     def test_metadata_extfmt(self):
         pp = self._create({
             "extension"       : "ignored",
@@ -354,6 +364,11 @@ class MtimeTest(BasePostprocessorTest):
         self._trigger()
         self.assertEqual(self.pathfmt.kwdict["_mtime"], 315532800)
 
+    def test_mtime_fields(self):
+        pp = postprocessor.find("mtime")
+        self.assertEqual(pp.fields({}), ("date",))
+        self.assertEqual(pp.fields({"key": "foo"}), ("foo",))
+
     def test_mtime_custom(self):
         self._create({"key": "foo"}, {"foo": 315532800})
         self._trigger()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2021 Mike Fährmann
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+
+import os
+import sys
+import unittest
+
+import io
+import json
+import time
+import pstats
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from gallery_dl import profiler, job, config  # noqa E402
+from gallery_dl.extractor.common import Extractor, Message  # noqa E402
+
+
+class TestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        config.set(("output",), "profile", self.dir.name)
+
+    def tearDown(self):
+        profiler.directory = None
+        profiler.mode = "cprofile"
+        self.dir.cleanup()
+        config.clear()
+
+    def _run(self):
+        profiler.initialize()
+        extr = TestExtractorParent.from_url("test:parent")
+        with io.StringIO() as buffer:
+            with contextlib.redirect_stdout(buffer):
+                job.UrlJob(extr, depth=0).run()
+
+        with open(os.path.join(self.dir.name, "index.jsonl")) as fp:
+            return [json.loads(line) for line in fp]
+
+    def test_cprofile(self):
+        index = self._run()
+
+        self.assertEqual(len(index), 3)
+        parent = index[-1]
+        self.assertEqual(parent["subcategory"], "parent")
+        self.assertEqual(parent["url"], "test:parent")
+        self.assertIsNone(parent["parent"])
+        for child in index[:2]:
+            self.assertEqual(child["subcategory"], "child")
+            self.assertEqual(child["parent"], parent["id"])
+            self.assertEqual(child["mode"], "cprofile")
+
+        pstats_path, collapsed_path = index[0]["files"]
+        stats = pstats.Stats(pstats_path)
+        self.assertTrue(any(
+            name == "items" for _, _, name in stats.stats))
+
+        with open(collapsed_path) as fp:
+            lines = fp.read().splitlines()
+        self.assertTrue(lines)
+        for line in lines:
+            self.assertTrue(line.startswith(
+                "job test/parent;job test/child;"))
+            self.assertTrue(line.rpartition(" ")[2].isdecimal())
+
+    def test_concurrency(self):
+        config.set((), "queue-concurrency", 2)
+        index = self._run()
+
+        self.assertEqual(len(index), 3)
+        parent = index[-1]
+        self.assertEqual(parent["subcategory"], "parent")
+        self.assertIsNone(parent["parent"])
+        for child in index[:2]:
+            # child jobs in pool threads are still nested under their parent
+            self.assertEqual(child["subcategory"], "child")
+            self.assertEqual(child["parent"], parent["id"])
+
+            with open(child["files"][1]) as fp:
+                lines = fp.read().splitlines()
+            self.assertTrue(lines)
+            for line in lines:
+                self.assertTrue(line.startswith(
+                    "job test/parent;job test/child;"))
+
+    def test_sample(self):
+        config.set(("output",), "profile-mode", "sample")
+        config.set(("output",), "profile-interval", 0.001)
+        index = self._run()
+
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index[0]["mode"], "sample")
+        self.assertEqual(len(index[0]["files"]), 1)
+
+        with open(index[0]["files"][0]) as fp:
+            content = fp.read()
+        self.assertIn("job test/parent;job test/child;", content)
+        self.assertIn("items (test_profiler.py:", content)
+
+    def test_datajob(self):
+        profiler.initialize()
+        extr = TestExtractorParent.from_url("test:parent")
+        with io.StringIO() as buffer:
+            job.DataJob(extr, file=buffer).run()
+
+        with open(os.path.join(self.dir.name, "index.jsonl")) as fp:
+            index = [json.loads(line) for line in fp]
+        self.assertEqual(len(index), 1)
+        self.assertEqual(index[0]["subcategory"], "parent")
+
+    def test_index_error(self):
+        profiler.initialize()
+        os.mkdir(os.path.join(self.dir.name, "index.jsonl"))
+        extr = TestExtractor.from_url("test:child")
+
+        with self.assertLogs("profile", "WARNING"):
+            with io.StringIO() as buffer:
+                with contextlib.redirect_stdout(buffer):
+                    self.assertEqual(job.UrlJob(extr).run(), 0)
+
+    def test_collapse_stats(self):
+        stats = {
+            ("a.py", 1, "main"): (1, 1, 0.1, 1.0, {}),
+            ("a.py", 5, "foo"): (2, 2, 0.2, 0.6, {
+                ("a.py", 1, "main"): (2, 2, 0.2, 0.6)}),
+            ("a.py", 9, "bar"): (2, 2, 0.6, 0.6, {
+                ("a.py", 1, "main"): (1, 1, 0.3, 0.3),
+                ("a.py", 5, "foo"): (1, 1, 0.3, 0.3)}),
+        }
+        self.assertEqual(dict(profiler.collapse_stats(stats)), {
+            "main (a.py:1)": 100000,
+            "main (a.py:1);foo (a.py:5)": 200000,
+            "main (a.py:1);foo (a.py:5);bar (a.py:9)": 300000,
+            "main (a.py:1);bar (a.py:9)": 300000,
+        })
+
+
+class TestExtractorParent(Extractor):
+    category = "test"
+    subcategory = "parent"
+    pattern = r"test:parent$"
+
+    def items(self):
+        for i in range(2):
+            yield Message.Queue, "test:child", {"_extractor": TestExtractor}
+
+
+class TestExtractor(Extractor):
+    category = "test"
+    subcategory = "child"
+    pattern = r"test:child$"
+
+    def items(self):
+        time.sleep(0.02)
+        yield Message.Url, "https://example.org/1.jpg", {}
+
+
+if __name__ == "__main__":
+    unittest.main()
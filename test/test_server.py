@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2021 Mike Fährmann
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+
+import os
+import sys
+import unittest
+
+import time
+import tempfile
+import threading
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from gallery_dl import server, config  # noqa E402
+
+
+class FakeJob():
+    runs = []
+
+    def __init__(self, url):
+        if url == "fail:":
+            raise ValueError("invalid")
+        self.url = url
+        self.extractor = FakeExtractor()
+
+    def run(self):
+        self.runs.append((self.url, config.get((), "skip")))
+        if self.url == "exit:":
+            sys.exit()
+        return 4 if "error" in self.url else 0
+
+
+class FakeExtractor():
+    category = "test"
+
+    def __init__(self):
+        self.session = requests.Session()
+
+
+class TestServer(unittest.TestCase):
+
+    def setUp(self):
+        FakeJob.runs = []
+        self.app = server.Server(FakeJob, workers=2)
+
+    def tearDown(self):
+        self.app.stop()
+        config.clear()
+
+    def _wait(self, app=None):
+        app = app or self.app
+        for _ in range(100):
+            status = app.status()
+            if not status["queued"] and not status["running"]:
+                return status
+            time.sleep(0.01)
+        self.fail("jobs did not finish")
+
+    def test_submit(self):
+        self.app.start()
+        entry = self.app.submit("test:1")
+        self.assertEqual(entry["id"], 1)
+        self.assertEqual(entry["url"], "test:1")
+        self.app.submit("test:error")
+        self.app.submit("fail:")
+
+        status = self._wait()
+        self.assertEqual(status["finished"], 3)
+        self.assertEqual(self.app.status(1)["status"], 0)
+        self.assertEqual(self.app.status(2)["status"], 4)
+        self.assertEqual(self.app.status(3)["status"], 1)
+        self.assertEqual(self.app.status(3)["state"], "finished")
+        self.assertIsNone(self.app.status(4))
+
+    def test_system_exit(self):
+        self.app.workers = 1
+        self.app.start()
+        with self.assertLogs("server", "ERROR"):
+            self.app.submit("exit:")
+            self.app.submit("test:1")
+            self._wait()
+        self.assertEqual(self.app.status(1)["status"], 1)
+        self.assertEqual(self.app.status(2)["state"], "finished")
+        self.assertEqual(self.app.status(2)["status"], 0)
+
+    def test_options(self):
+        self.app.start()
+        self.app.submit("test:1", server.parse_options({"skip": "abort:1"}))
+        self.app.submit("test:2")
+        self._wait()
+
+        self.assertEqual(sorted(FakeJob.runs), [
+            ("test:1", "abort:1"),
+            ("test:2", None),
+        ])
+        self.assertIsNone(config.get((), "skip"))
+
+    def test_share_adapters(self):
+        extr1 = FakeExtractor()
+        extr2 = FakeExtractor()
+        self.app._share_adapters(extr1)
+        self.app._share_adapters(extr2)
+        self.assertIs(extr1.session.adapters, extr2.session.adapters)
+
+    def test_history(self):
+        self.app.history = 2
+        self.app.start()
+        for i in range(4):
+            self.app.submit("test:{}".format(i))
+            self._wait()
+        self.assertEqual([e["id"] for e in self.app.list()], [3, 4])
+
+    def test_parse_options(self):
+        self.assertEqual(server.parse_options(None), [])
+        self.assertEqual(server.parse_options({
+            "extractor.twitter.retweets": True,
+            "skip": False,
+        }), [
+            (["extractor", "twitter"], "retweets", True),
+            ([], "skip", False),
+        ])
+
+        for options in ({"postprocessors": []},
+                        {"extractor.image-filter": "True"},
+                        {"extractor.twitter.base-directory": "/"},
+                        {"downloader.skip": False},
+                        {"skip": "exit"},
+                        {"extractor.skip": "terminate:3"}):
+            with self.assertRaises(ValueError):
+                server.parse_options(options)
+        self.assertEqual(server.parse_options({"foo": 1}, ("foo",)),
+                         [([], "foo", 1)])
+
+    def test_unix_socket(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "file")
+            with open(path, "w") as fp:
+                fp.write("data")
+            with self.assertRaises(ValueError):
+                server.create_server(path, self.app)
+            self.assertTrue(os.path.exists(path))
+
+            path = os.path.join(tmpdir, "socket")
+            for _ in range(2):
+                srv = server.create_server(path, self.app)
+                srv.server_close()
+                self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+
+    def test_serve_requires_token(self):
+        with self.assertRaises(ValueError):
+            server.serve("127.0.0.1:0", FakeJob)
+
+
+class TestSharedLock(unittest.TestCase):
+
+    def test_shared(self):
+        lock = server.SharedLock()
+        lock.acquire_shared()
+        lock.acquire_shared()
+        self.assertEqual(lock.shared, 2)
+        lock.release_shared()
+        lock.release_shared()
+        self.assertEqual(lock.shared, 0)
+
+    def test_exclusive(self):
+        lock = server.SharedLock()
+        events = []
+
+        lock.acquire_shared()
+
+        def exclusive():
+            lock.acquire_exclusive()
+            events.append("exclusive")
+            lock.release_exclusive()
+
+        thread = threading.Thread(target=exclusive)
+        thread.start()
+        time.sleep(0.05)
+        self.assertEqual(events, [])
+        self.assertEqual(lock.waiting, 1)
+
+        lock.release_shared()
+        thread.join()
+        self.assertEqual(events, ["exclusive"])
+
+        lock.acquire_shared()
+        lock.release_shared()
+
+
+class TestRequestHandler(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        FakeJob.runs = []
+        cls.app = server.Server(FakeJob, workers=1, token="secret")
+        cls.app.start()
+        cls.server = server.create_server("127.0.0.1:0", cls.app)
+        cls.root = "http://127.0.0.1:{}".format(cls.server.server_port)
+        thread = threading.Thread(
+            target=cls.server.serve_forever, daemon=True)
+        thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.app.stop()
+
+    def setUp(self):
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = "Bearer secret"
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_submit(self):
+        response = self.session.post(self.root + "/jobs", json={
+            "url": "test:http", "options": {"skip": 1}})
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()["id"]
+        self.assertNotIn("options", response.json())
+
+        for _ in range(100):
+            data = self.session.get(
+                "{}/jobs/{}".format(self.root, job_id)).json()
+            if data["state"] == "finished":
+                break
+            time.sleep(0.01)
+        self.assertEqual(data["status"], 0)
+        self.assertIn(("test:http", 1), FakeJob.runs)
+
+        response = self.session.post(self.root + "/jobs", json={
+            "url": "test:http", "options": {"postprocessors": []}})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.session.get(self.root + "/status")
+        self.assertEqual(response.json()["workers"], 1)
+        response = self.session.get(self.root + "/jobs")
+        self.assertIn(job_id, [entry["id"] for entry in response.json()])
+
+    def test_invalid(self):
+        response = self.session.post(
+            self.root + "/jobs", data="test:",
+            headers={"Content-Type": "text/plain"})
+        self.assertEqual(response.status_code, 415)
+
+        response = self.session.post(self.root + "/jobs", json={"foo": 1})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.session.post(self.root + "/jobs", json={
+            "url": "test:", "options": ["foo"]})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.session.get(self.root + "/jobs/99999")
+        self.assertEqual(response.status_code, 404)
+
+        response = self.session.get(self.root + "/foo")
+        self.assertEqual(response.status_code, 404)
+
+    def test_token(self):
+        response = requests.get(self.root + "/status")
+        self.assertEqual(response.status_code, 401)
+        response = requests.get(self.root + "/status",
+                                headers={"Authorization": "Bearer foo"})
+        self.assertEqual(response.status_code, 401)
+
+    def test_host(self):
+        self.app.token = None
+        try:
+            response = requests.get(
+                self.root + "/status", headers={"Host": "example.org"})
+        finally:
+            self.app.token = "secret"
+        self.assertEqual(response.status_code, 403)
+
+    def test_nonlocal_address(self):
+        with self.assertRaises(ValueError):
+            server.create_server("0.0.0.0:0", self.app)
+
+
+if __name__ == "__main__":
+    unittest.main()
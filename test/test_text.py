@@ -234,6 +234,38 @@ class TestText(unittest.TestCase):
         rdict, pos = f(txt, (), values=vdict)
         self.assertIs(vdict, rdict)
 
+    def test_compile_rules(self, f=text.compile_rules):
+        txt = "[c][b][a]: xyz! [d][e"
+
+        # same results as extract_all()
+        for rules in (
+            (),
+            (("C", "[", "]"), ("B", "[", "]"), ("A", "[", "]")),
+            ((None, "[", "]"), (None, "[", "]"), ("A", "[", "]")),
+            (("C", "[", "]"), ("X", "X", "X"), ("B", "[", "]")),
+            (("A", "[", "]"), ("D", ": ", "!"), ("E", "[", "]")),
+        ):
+            self.assertEqual(f(rules)(txt), text.extract_all(txt, rules))
+            self.assertEqual(f(rules)(txt, 1),
+                             text.extract_all(txt, rules, 1))
+
+        # 'default' argument
+        rules = f((("C", "[", "]"), ("X", "X", "X")), "")
+        self.assertEqual(rules(txt), ({"C": "c", "X": ""}, 3))
+        self.assertEqual(rules(None), ({"C": "", "X": ""}, 0))
+        self.assertEqual(rules(txt, 100), ({"C": "", "X": ""}, 100))
+
+        # 'values' argument
+        vdict = {"A": "a"}
+        rdict, pos = rules(txt, values=vdict)
+        self.assertIs(vdict, rdict)
+        self.assertEqual(rdict, {"A": "a", "C": "c", "X": ""})
+
+        # class attribute
+        class Test():
+            rules = f((("A", "[", "]"),))
+        self.assertEqual(Test().rules(txt), ({"A": "c"}, 3))
+
     def test_extract_iter(self, f=text.extract_iter):
         txt = "[c][b][a]: xyz! [d][e"
 
@@ -10,8 +10,11 @@
 import os
 import sys
 import unittest
+from unittest.mock import patch
 
 import io
+import json
+import math
 import random
 import string
 import datetime
@@ -423,6 +426,63 @@ class TestFormatter(unittest.TestCase):
         self.assertEqual(output, result, format_string)
 
 
+class TestLayeredDict(unittest.TestCase):
+
+    def test_lookup(self):
+        base = {"a": 1, "b": 2}
+        kwdict = util.LayeredDict(base, {"b": 3, "c": 4})
+
+        self.assertEqual(kwdict["a"], 1)
+        self.assertEqual(kwdict["b"], 3)
+        self.assertEqual(kwdict.get("c"), 4)
+        self.assertEqual(kwdict.get("d", 5), 5)
+        self.assertIn("a", kwdict)
+        self.assertNotIn("d", kwdict)
+        self.assertEqual(len(kwdict), 3)
+        self.assertEqual(dict(kwdict), {"a": 1, "b": 3, "c": 4})
+        with self.assertRaises(KeyError):
+            kwdict["d"]
+
+    def test_write(self):
+        base = {"a": 1, "b": 2}
+        kwdict = util.LayeredDict(base)
+
+        kwdict["a"] = 10
+        kwdict.update(c=3)
+        del kwdict["b"]
+        self.assertEqual(dict(kwdict), {"a": 10, "c": 3})
+        self.assertEqual(base, {"a": 1, "b": 2})
+
+        self.assertNotIn("b", kwdict)
+        self.assertIsNone(kwdict.get("b"))
+        with self.assertRaises(KeyError):
+            del kwdict["b"]
+
+        kwdict["b"] = 20
+        self.assertEqual(kwdict["b"], 20)
+        self.assertEqual(sorted(kwdict), ["a", "b", "c"])
+
+    def test_copy(self):
+        base = {"tags": ["a", "b"]}
+        kwdict = util.LayeredDict(base, {"num": 1})
+        snapshot = kwdict.copy()
+        kwdict["num"] = 2
+
+        self.assertEqual(snapshot["num"], 1)
+        self.assertIs(snapshot["tags"], base["tags"])
+        self.assertIsInstance(snapshot, util.LayeredDict)
+
+    def test_formatter(self):
+        kwdict = util.LayeredDict({"a": "foo"}, {"b": "bar"})
+        fmt = util.Formatter("{a}_{b}_{c}")
+        self.assertEqual(fmt.format_map(kwdict), "foo_bar_None")
+
+        expr = util.compile_expression("a == 'foo' and b == 'bar'")
+        self.assertTrue(expr(kwdict))
+        self.assertEqual(util.filter_dict(
+            util.LayeredDict({"_a": 1, "b": 2}, {"c": 3})), {"b": 2, "c": 3})
+
+
 class TestOther(unittest.TestCase):
 
     def test_bencode(self):
@@ -520,6 +580,43 @@ class TestOther(unittest.TestCase):
         with self.assertRaises(exception.StopExtraction):
             expr()
 
+    def test_expression_fields(self):
+        self.assertEqual(util.expression_fields("a + b * 3"), {"a", "b"})
+        self.assertEqual(
+            util.expression_fields("user['name'] == 'x' or num > 2"),
+            {"user", "num"})
+        self.assertEqual(
+            util.expression_fields("abort() if tags_artist else True"),
+            {"abort", "tags_artist"})
+        self.assertIsNone(util.expression_fields("'tags' in locals()"))
+
+    def test_format_fields(self):
+        self.assertEqual(util.format_fields("foo"), set())
+        self.assertEqual(
+            util.format_fields("{a}_{b[c]}.{d.e!l:?<//}{f|g}"),
+            {"a", "b", "d", "f", "g"})
+
+    def test_json_loads(self, f=util.json_loads):
+        data = {"a": [1, 2.5, None, True], "b": "ä€"}
+        for value in (json.dumps(data), json.dumps(data).encode(),
+                      json.dumps(data, ensure_ascii=False).encode()):
+            self.assertEqual(f(value), data)
+
+        # input 'orjson' rejects
+        self.assertEqual(f(json.dumps(data).encode("utf-16")), data)
+        self.assertEqual(f(b'[18446744073709551615, -9223372036854775808]'),
+                         [18446744073709551615, -9223372036854775808])
+        self.assertTrue(math.isnan(f(b'[NaN]')[0]))
+
+        with self.assertRaises(ValueError):
+            f(b'{"a": ')
+
+    def test_json_loads_stdlib(self):
+        with patch.object(util, "orjson", None):
+            self.test_json_loads()
+            self.assertEqual(util.json_loads(
+                b'\xef\xbb\xbf{"a": "\xc3\xa4"}'), {"a": "ä"})
+
     def test_generate_token(self):
         tokens = set()
         for _ in range(100):